@@ -1,16 +1,70 @@
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
+import threading
 
 # Firebase 서비스 계정 키 경로
-cred = credentials.Certificate("gpt-chating-c72cacf446d4.json")
+CREDENTIALS_PATH = "gpt-chating-c72cacf446d4.json"
+# Firebase Storage 버킷 이름
+STORAGE_BUCKET = "gpt-chating.appspot.com"
 
-# Firebase 초기화 (Storage 버킷 이름 포함)
-firebase_admin.initialize_app(cred, {
-    'storageBucket': 'gpt-chating.appspot.com'  # Firebase Storage 버킷 이름 설정
-})
+# 아래 객체들은 처음 사용할 때 한 번만 만들어 모든 세션이 공유
+# (임포트 시점에 초기화하면 SDK 로딩과 인증 때문에 앱 시작이 느려짐)
+_app = None
+_db = None
+_bucket = None
+_lock = threading.Lock()
 
-# Firestore 클라이언트 초기화
-db = firestore.client()
 
-# Firebase Storage 사용을 위한 bucket 초기화
-bucket = storage.bucket()  # Firebase Storage 기본 버킷을 가져오기
+def get_app():
+    """Firebase 앱을 초기화해 반환"""
+    global _app
+    with _lock:
+        if _app is None:
+            import firebase_admin
+            from firebase_admin import credentials
+
+            cred = credentials.Certificate(CREDENTIALS_PATH)
+            _app = firebase_admin.initialize_app(cred, {"storageBucket": STORAGE_BUCKET})
+        return _app
+
+
+def get_db():
+    """Firestore 클라이언트"""
+    global _db
+    if _db is None:
+        app = get_app()
+        with _lock:
+            if _db is None:
+                from firebase_admin import firestore
+
+                _db = firestore.client(app)
+    return _db
+
+
+def get_bucket():
+    """Firebase Storage 기본 버킷"""
+    global _bucket
+    if _bucket is None:
+        app = get_app()
+        with _lock:
+            if _bucket is None:
+                from firebase_admin import storage
+
+                _bucket = storage.bucket(app=app)
+    return _bucket
+
+
+def get_auth():
+    """초기화된 앱으로 사용할 firebase_admin.auth 모듈"""
+    get_app()
+    from firebase_admin import auth
+
+    return auth
+
+
+def override_clients(db=None, bucket=None):
+    """Firebase에 연결하지 않고 대체 객체를 사용 (부하 테스트/로컬 실행용)"""
+    global _db, _bucket
+    with _lock:
+        if db is not None:
+            _db = db
+        if bucket is not None:
+            _bucket = bucket
@@ -1,64 +1,141 @@
 import streamlit as st
-from utils.firestore import get_chat_history, save_message, update_chat_summary
+from utils.firestore import (
+    get_chat_history,
+    get_older_messages,
+    get_write_error,
+    save_message,
+)
 from utils.auth import get_user_id
+from utils.storage import (
+    IMAGE_UPLOAD_MODE,
+    prepare_image,
+    to_data_url,
+    upload_chat_image,
+)
+from utils.turn import begin_turn, finish_turn
+from utils.ingest import extract_docx_text, extract_pdf_text, summarize_csv
+from utils.file_cache import get_file_cache
+from utils.retrieval import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, add_document
+from utils.tokens import get_encoding_name
+from utils.image_jobs import get_image_job, submit_image_job
+from utils.history_store import ATTACHMENT_CONTENT_HEADER, HistoryStore
+from utils.llm import set_current_user
 from openai_api import (
-    get_response,
-    summarize_chat,
-    analyze_user_input_for_image_request,
-    generate_image,
-    analyze_image  # 수정된 부분
+    analyze_image,  # 수정된 부분
+    get_attachment_token_budget,
 )
-from firebase_admin import storage
-import PyPDF2
-import pandas as pd
 import os
 
-# Firebase Storage에 이미지 파일을 업로드하고 URL 반환
-def upload_file_to_storage(image_file):
-    bucket = storage.bucket()  # Firebase Storage 버킷 가져오기
-    blob = bucket.blob(image_file.name)  # 파일 이름을 그대로 사용하거나 고유 이름 설정
-    blob.upload_from_file(image_file)  # Firebase Storage에 파일 업로드
-    blob.make_public()  # 파일을 공개로 설정
-    return blob.public_url  # 파일의 공개 URL 반환
+# 첨부 문서 처리 방식: "retrieval"(관련 부분만 검색해 전달) 또는 "inline"(전체 내용을 메시지에 포함)
+ATTACHMENT_MODE = os.getenv("ATTACHMENT_MODE", "retrieval")
+# retrieval 모드에서 문서 하나에서 추출할 최대 토큰 수
+RETRIEVAL_DOCUMENT_TOKEN_LIMIT = 500000
+# 이미지 생성 작업 상태를 확인하는 주기 (초)
+IMAGE_JOB_POLL_SECONDS = 2
+
+def prepare_uploaded_image(image_file, user_id, chat_id):
+    """
+    업로드된 이미지를 축소한 뒤 비전 모델에 전달할 URL과 기록에 남길 메시지 머리말을 반환합니다.
+    """
+    data, content_type = prepare_image(image_file.getvalue(), image_file.type)
+    if IMAGE_UPLOAD_MODE == "data_url":
+        # Storage를 거치지 않고 바로 전달 (기록에는 파일 이름만 남김)
+        return to_data_url(data, content_type), f"🖼️ {image_file.name}"
+
+    # 같은 이미지는 내용 해시로 저장되어 다시 업로드하지 않음
+    image_url = upload_chat_image(data, content_type, user_id, chat_id)
+    return image_url, f"![Uploaded Image]({image_url})"
+
+def _extract_cached(uploaded_file, model, max_tokens):
+    # 같은 파일은 내용 해시로 캐시된 추출 결과를 재사용
+    file_cache = get_file_cache()
+    key = file_cache.make_key(
+        uploaded_file.getvalue(),
+        uploaded_file.type,
+        get_encoding_name(model),
+        max_tokens,
+    )
+    entry = file_cache.get_or_extract(
+        key, model, lambda: extract_file_text(uploaded_file, model, max_tokens)
+    )
+    return key, entry
+
+def process_file(uploaded_file, model):
+    _, entry = _extract_cached(
+        uploaded_file, model, get_attachment_token_budget(model)
+    )
+    return entry["text"]
 
-def process_file(uploaded_file):
+def index_attachment(uploaded_file, model, user_id, chat_id):
+    # 문서 전체를 조각내어 채팅별 검색 인덱스에 추가
+    key, entry = _extract_cached(uploaded_file, model, RETRIEVAL_DOCUMENT_TOKEN_LIMIT)
+    chunks = get_file_cache().get_chunks(
+        key, entry, model, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+    )
+    add_document(user_id, chat_id, uploaded_file.name, chunks)
+
+def extract_file_text(uploaded_file, model, max_tokens):
+    # 모델 컨텍스트에 들어갈 만큼만 추출
     if uploaded_file.type == "application/pdf":
-        return process_pdf(uploaded_file)
+        return extract_pdf_text(uploaded_file.getvalue(), model, max_tokens)
     elif uploaded_file.type == "text/csv":
-        return process_csv(uploaded_file)
+        return summarize_csv(uploaded_file, model, max_tokens)
     elif uploaded_file.type in [
         "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
         "application/msword",
     ]:
-        return process_word(uploaded_file)
+        return extract_docx_text(uploaded_file, model, max_tokens)
     else:
         return "Unsupported file type."
 
-def process_pdf(file):
-    reader = PyPDF2.PdfReader(file)
-    text = ""
-    for page in range(len(reader.pages)):
-        text += reader.pages[page].extract_text()
-    return text
+def get_history_store():
+    """세션이 연 채팅들의 기록 저장소 (채팅 수와 메모리 예산을 넘으면 오래된 채팅부터 내보냄)"""
+    if "history_store" not in st.session_state:
+        st.session_state["history_store"] = HistoryStore()
+    return st.session_state["history_store"]
+
+def render_message(record):
+    with st.chat_message(record.role):
+        if not record.out_of_line:
+            st.markdown(record.message)
+        # 긴 첨부 내용은 앞부분만 보여 주고, 펼칠 때만 본문을 다시 읽음
+        elif st.toggle("첨부 내용 전체 보기", key=f"expand_{record.id}"):
+            st.markdown(record.message)
+        else:
+            st.markdown(f"{record.preview}…")
+        if record.fallback_model:
+            st.caption(f"선택한 모델 대신 {record.fallback_model} 모델이 답변했습니다.")
 
-def process_csv(file):
-    df = pd.read_csv(file)
-    return df.to_string()
+@st.fragment(run_every=IMAGE_JOB_POLL_SECONDS)
+def render_image_jobs(selected_chat):
+    """진행 중인 이미지 생성 작업을 주기적으로 확인하고, 끝나면 채팅 기록에 추가"""
+    job_ids = st.session_state.get(f"image_jobs_{selected_chat}", [])
+    chat_history = get_history_store().get(selected_chat)
+    finished = False
 
-def process_word(file):
-    try:
-        import docx
-    except ImportError:
-        return "Please install python-docx to process Word files."
+    for job_id in list(job_ids):
+        job = get_image_job(job_id)
+        if job is None or job.finished:
+            job_ids.remove(job_id)
+            if job is not None and chat_history is not None:
+                chat_history.append({"role": "assistant", "message": job.message})
+            finished = True
+        else:
+            with st.chat_message("assistant"):
+                st.markdown(
+                    "Generating image..." if job.status == "running" else "Waiting..."
+                )
+                st.caption(job.prompt)
 
-    doc = docx.Document(file)
-    text = "\n".join([para.text for para in doc.paragraphs])
-    return text
+    if finished:
+        st.rerun()
 
 def render(selected_chat, model):
     st.title("GPT Chat")
 
     user_id = get_user_id()
+    # LLM 요청 대기열에서 사용자별로 공정하게 순서를 나누기 위해 지정
+    set_current_user(user_id)
 
     if selected_chat is None:
         st.write(
@@ -66,16 +143,33 @@ def render(selected_chat, model):
         )
         return
 
-    if f"chat_history_{selected_chat}" not in st.session_state:
-        chat_history = get_chat_history(user_id, selected_chat)
-        st.session_state[f"chat_history_{selected_chat}"] = chat_history
-        st.session_state[f"summary_created_{selected_chat}"] = False
-    else:
-        chat_history = st.session_state[f"chat_history_{selected_chat}"]
+    history_store = get_history_store()
+    chat_history = history_store.get(selected_chat)
+    if chat_history is None:
+        # 최근 메시지 한 페이지만 먼저 불러옴 (내보낸 채팅도 다시 열면 여기서 불러옴)
+        chat_history = history_store.load(
+            user_id, selected_chat, get_chat_history(user_id, selected_chat)
+        )
 
-    for chat in chat_history:
-        with st.chat_message(chat["role"]):
-            st.markdown(chat["message"])
+    if chat_history.has_more and st.button(
+        "이전 메시지 불러오기", key=f"load_older_{selected_chat}"
+    ):
+        older_messages, has_more = get_older_messages(
+            user_id, selected_chat, chat_history[0]["timestamp"]
+        )
+        chat_history.prepend(older_messages)
+        chat_history.has_more = has_more
+        history_store.enforce_budget()
+        st.rerun()
+
+    for record in chat_history:
+        render_message(record)
+
+    if get_write_error(user_id, selected_chat) is not None:
+        st.warning("일부 메시지를 아직 저장하지 못해 다시 시도하고 있습니다.")
+
+    if st.session_state.get(f"image_jobs_{selected_chat}"):
+        render_image_jobs(selected_chat)
 
     if model == "gpt-3.5-turbo-0125" or model == "llama-3.1-8b-instant":
         file = None  # 파일 업로드 기능 비활성화
@@ -106,19 +200,17 @@ def render(selected_chat, model):
                     st.image(file, caption="Uploaded Image", use_column_width=True)
                     st.markdown(prompt)
 
-                # Firebase Storage에 이미지 업로드 후 URL 반환
-                image_url = upload_file_to_storage(file)
-                save_message(
-                    user_id,
-                    selected_chat,
-                    "user",
-                    f"![Uploaded Image]({image_url})\n\n{prompt}",
+                # 축소한 이미지를 Storage에 올리거나 data URL로 변환
+                image_url, image_reference = prepare_uploaded_image(
+                    file, user_id, selected_chat
                 )
                 chat_history.append(
-                    {
-                        "role": "user",
-                        "message": f"![Uploaded Image]({image_url})\n\n{prompt}",
-                    }
+                    save_message(
+                        user_id,
+                        selected_chat,
+                        "user",
+                        f"{image_reference}\n\n{prompt}",
+                    )
                 )
 
                 # OpenAI Vision API로 이미지 URL과 사용자 프롬프트 전달하여 분석
@@ -126,54 +218,51 @@ def render(selected_chat, model):
                     analysis_result = analyze_image(image_url, model=model, user_prompt=prompt)  # URL과 프롬프트 전달
                     with st.chat_message("assistant"):
                         st.markdown(analysis_result)
-                    save_message(user_id, selected_chat, "assistant", analysis_result)
-                    chat_history.append({"role": "assistant", "message": analysis_result})
+                    chat_history.append(
+                        save_message(user_id, selected_chat, "assistant", analysis_result)
+                    )
             else:
                 # 기타 파일(예: PDF, CSV 등) 처리
-                file_content = process_file(file)
-                prompt = f"{prompt}\n\nAttached file content:\n{file_content}"
+                if ATTACHMENT_MODE == "retrieval":
+                    # 문서는 인덱스에만 넣고, 매 턴 관련 부분만 검색해서 전달
+                    with st.spinner("Indexing file..."):
+                        index_attachment(file, model, user_id, selected_chat)
+                    prompt = f"{prompt}\n\n📎 {file.name}"
+                else:
+                    file_content = process_file(file, model)
+                    prompt = f"{prompt}{ATTACHMENT_CONTENT_HEADER}{file_content}"
 
         if prompt and (file is None or not file.type.startswith("image/")):
             with st.chat_message("user"):
                 st.markdown(prompt)
-            save_message(user_id, selected_chat, "user", prompt)
-            chat_history.append({"role": "user", "message": prompt})
 
             with st.spinner("Analyzing input..."):
-                is_image_request = analyze_user_input_for_image_request(prompt)
-
-            if is_image_request:
-                with st.spinner("Generating image..."):
-                    image_url = generate_image(prompt)
-
-                with st.chat_message("assistant"):
-                    if "Error" in image_url:
-                        st.markdown(image_url)
-                    else:
-                        st.image(image_url, caption=prompt, use_column_width=True)
-                        st.markdown(f"![Generated Image]({image_url})")
-                save_message(
-                    user_id,
-                    selected_chat,
-                    "assistant",
-                    f"![Generated Image]({image_url})",
-                )
-                chat_history.append(
-                    {"role": "assistant", "message": f"![Generated Image]({image_url})"}
-                )
-            else:
-                with st.spinner("Thinking..."):
-                    response = get_response(chat_history, model)
-                    with st.chat_message("assistant"):
-                        st.markdown(response)
-                    save_message(user_id, selected_chat, "assistant", response)
-                    chat_history.append({"role": "assistant", "message": response})
+                # 사용자 메시지를 저장하고 이미지 요청 판별과 답변 생성을 동시에 시작
+                turn = begin_turn(user_id, selected_chat, chat_history, prompt, model)
 
-        st.session_state[f"chat_history_{selected_chat}"] = chat_history
+            # 렌더링이 중단돼도 블록을 벗어나면 생성 중인 답변을 취소
+            with turn:
+                if turn.is_image_request:
+                    # 이미지 생성은 백그라운드 작업으로 넘기고 결과는 폴링해서 표시
+                    job_id = submit_image_job(user_id, selected_chat, prompt)
+                    st.session_state.setdefault(
+                        f"image_jobs_{selected_chat}", []
+                    ).append(job_id)
+                else:
+                    with st.chat_message("assistant"):
+                        response = st.write_stream(turn.stream())
+                    # 대체 모델이 답했으면 메시지에 남겨 기록에서도 표시
+                    chat_history.append(
+                        save_message(
+                            user_id,
+                            selected_chat,
+                            "assistant",
+                            response,
+                            fallback_model=turn.fallback_model,
+                        )
+                    )
 
-        if not st.session_state[f"summary_created_{selected_chat}"]:
-            summary = summarize_chat(chat_history)
-            update_chat_summary(user_id, selected_chat, summary)
-            st.session_state[f"summary_created_{selected_chat}"] = True
+        history_store.enforce_budget()
+        finish_turn(user_id, selected_chat, chat_history, model)
 
         st.rerun()
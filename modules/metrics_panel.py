@@ -0,0 +1,50 @@
+import streamlit as st
+from utils.metrics import collect
+
+
+def render():
+    # 사이드바에 표시하는 디버그용 성능 지표 (SHOW_METRICS_PANEL=1일 때만 사용)
+    with st.expander("성능 지표", expanded=False):
+        metrics = collect()
+
+        st.markdown("**호출 지점별**")
+        if metrics["sites"]:
+            st.dataframe(
+                [{"site": site, **stats} for site, stats in metrics["sites"].items()],
+                use_container_width=True,
+            )
+        else:
+            st.caption("아직 기록된 호출이 없습니다.")
+
+        st.markdown("**응답 캐시**")
+        st.json(metrics["response_cache"])
+
+        st.markdown("**이미지 요청 판별**")
+        st.json(metrics["intent"])
+
+        st.markdown("**채팅 기록 메모리**")
+        store = st.session_state.get("history_store")
+        st.json(
+            {
+                "session": store.stats() if store is not None else None,
+                "process": metrics["history"],
+            }
+        )
+
+        st.markdown("**Firestore 쓰기 대기열**")
+        st.json(metrics["writes"])
+
+        st.markdown("**모델 경로**")
+        if metrics["routes"]:
+            st.dataframe(
+                [
+                    {
+                        "route": route,
+                        **{k: v for k, v in stats.items() if k != "histogram"},
+                    }
+                    for route, stats in metrics["routes"].items()
+                ],
+                use_container_width=True,
+            )
+        else:
+            st.caption("아직 기록된 모델 요청이 없습니다.")
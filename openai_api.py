@@ -2,12 +2,22 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from groq import Groq
-from openai import OpenAI
-import os
+import asyncio
+import logging
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+from utils.cache import MISSING, get_response_cache
+from utils.intent import classify_image_request
+from utils.llm import iterate_sync, run_sync
+from utils.metrics import record_cache_hit, track
+from utils.routing import route_chat_completion, route_stream_chat_completion
+from utils.tokens import (
+    MESSAGE_OVERHEAD_TOKENS,
+    REPLY_PRIMING_TOKENS,
+    count_message_tokens,
+    count_tokens,
+    select_context_window,
+    truncate_text,
+)
 
 MODEL_TOKEN_LIMITS = {
     "gpt-4o": 128000,
@@ -19,14 +29,60 @@ MODEL_TOKEN_LIMITS = {
 }
 
 
-def split_messages(messages, max_tokens):
+# 응답 생성을 위해 컨텍스트에서 비워두는 토큰 수
+RESPONSE_TOKEN_RESERVE = 1000
+
+# 컨텍스트 한도를 넘는 대화의 처리 방식
+# - "window": 한도에 맞는 최신 메시지만 전송 (기본값)
+# - "map_reduce": 창 밖의 이전 대화를 청크별로 병렬 요약한 뒤 최신 메시지와 함께 한 번에 답변
+CONTEXT_STRATEGIES = {
+    "gpt-4": "map_reduce",
+    "gpt-3.5-turbo-0125": "map_reduce",
+}
+# map 단계의 동시 요청 수와 청크별 요약 길이
+MAP_REDUCE_WORKERS = 4
+MAP_SUMMARY_TOKENS = 400
+# map 요청에 넣는 마지막 질문의 최대 비율 (질문이 길어도 청크에 쓸 토큰이 남도록)
+MAP_QUESTION_SHARE = 0.25
+MAP_PROMPT_TEMPLATE = (
+    "다음은 긴 대화의 일부야. 마지막 질문에 답하는 데 필요한 사실과 맥락만 간결하게 요약해.\n\n"
+    "마지막 질문: {question}\n\n대화:\n{transcript}"
+)
+
+# 첨부 파일 내용에 할당할 컨텍스트 비율
+ATTACHMENT_TOKEN_SHARE = 0.5
+
+
+def get_context_token_budget(model):
+    """모델에 보내는 대화(응답 여유분 제외)에 쓸 수 있는 최대 토큰 수"""
+    return MODEL_TOKEN_LIMITS.get(model, MODEL_TOKEN_LIMITS["gpt-4o"]) - RESPONSE_TOKEN_RESERVE
+
+
+def get_attachment_token_budget(model):
+    """첨부 파일에서 추출한 텍스트에 허용할 최대 토큰 수"""
+    limit = MODEL_TOKEN_LIMITS.get(model, MODEL_TOKEN_LIMITS["gpt-4o"])
+    return int((limit - RESPONSE_TOKEN_RESERVE) * ATTACHMENT_TOKEN_SHARE)
+
+
+# 결정적인 호출의 응답 캐시 유지 시간 (초)
+SUMMARY_CACHE_TTL = 24 * 60 * 60
+IMAGE_ANALYSIS_CACHE_TTL = 24 * 60 * 60
+INTENT_CACHE_TTL = 7 * 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+def split_messages(messages, max_tokens, model="gpt-4o"):
     result = []
     current_chunk = []
     current_length = 0
 
     for message in messages:
-        message_tokens = len(message["message"].split())
-        if current_length + message_tokens > max_tokens:
+        if message["message"] is None:
+            continue
+
+        message_tokens = count_message_tokens(message, model)
+        if current_chunk and current_length + message_tokens > max_tokens:
             result.append(current_chunk)
             current_chunk = [message]
             current_length = message_tokens
@@ -40,52 +96,183 @@ def split_messages(messages, max_tokens):
     return result
 
 
-def get_response(messages, model="gpt-4o", temperature=0.7):
+def _to_api_messages(messages):
+    return [
+        {"role": message["role"], "content": message["message"]}
+        for message in messages
+    ]
+
+
+def _window_tokens(window, model):
+    # select_context_window가 메시지에 캐시해 둔 토큰 수를 그대로 합산
+    return sum(count_message_tokens(message, model) for message in window) + REPLY_PRIMING_TOKENS
+
+
+def _select_window(messages, model, max_tokens):
+    window = select_context_window(messages, model, max_tokens)
+    return window, _window_tokens(window, model)
+
+
+def _plan_map_reduce(messages, model, max_tokens):
+    """
+    최신 메시지 창과, 창 밖 이전 대화를 청크로 나눈 map 프롬프트 목록을 만듦.
+    토큰 계산이 많으므로 워커 스레드에서 실행합니다.
+    """
+    notes_budget = max_tokens // 4
+    window = select_context_window(messages, model, max_tokens - notes_budget)
+    older = [message for message in messages if message["message"] is not None]
+    older = older[: len(older) - len(window)]
+    if not older:
+        return window, []
+
+    # map 요청 하나(템플릿 + 질문 + 청크)가 모델 한도 안에 들어가도록 청크 예산을 계산
+    question = (
+        truncate_text(window[-1]["message"], model, int(max_tokens * MAP_QUESTION_SHARE))
+        if window
+        else ""
+    )
+    prompt_tokens = (
+        count_tokens(MAP_PROMPT_TEMPLATE.format(question=question, transcript=""), model)
+        + MESSAGE_OVERHEAD_TOKENS
+        + REPLY_PRIMING_TOKENS
+    )
+    chunk_tokens = min(max_tokens // 2, max_tokens - prompt_tokens)
+    prompts = []
+    for chunk in split_messages(older, chunk_tokens, model):
+        transcript = "\n".join(f"{msg['role']}: {msg['message']}" for msg in chunk)
+        # 예산보다 긴 메시지 하나로 된 청크도 한도를 넘지 않도록 자름
+        transcript = truncate_text(transcript, model, chunk_tokens)
+        prompt = MAP_PROMPT_TEMPLATE.format(question=question, transcript=transcript)
+        prompts.append(
+            (prompt, count_tokens(prompt, model) + MESSAGE_OVERHEAD_TOKENS + REPLY_PRIMING_TOKENS)
+        )
+    return window, prompts
+
+
+async def _summarize_chunk(prompt, prompt_tokens, model, semaphore):
+    with track("map_summary"):
+        async with semaphore:
+            response = await route_chat_completion(
+                model,
+                [{"role": "user", "content": prompt}],
+                prompt_tokens=prompt_tokens,
+                temperature=0,
+                max_tokens=MAP_SUMMARY_TOKENS,
+            )
+        return response.choices[0].message.content
+
+
+async def _map_reduce_context(messages, model, max_tokens):
+    """
+    최신 메시지 창에 들어가지 않는 이전 대화를 청크별로 병렬 요약해 system 메시지로 합침.
+    (API 메시지, 프롬프트 토큰 수)를 반환합니다.
+    """
+    window, prompts = await asyncio.to_thread(_plan_map_reduce, messages, model, max_tokens)
+    if not prompts:
+        return _to_api_messages(window), _window_tokens(window, model)
+
+    semaphore = asyncio.Semaphore(MAP_REDUCE_WORKERS)
+    results = await asyncio.gather(
+        *(
+            _summarize_chunk(prompt, prompt_tokens, model, semaphore)
+            for prompt, prompt_tokens in prompts
+        ),
+        return_exceptions=True,
+    )
+    notes = []
+    for index, result in enumerate(results):
+        if isinstance(result, BaseException):
+            # 실패는 map_summary 호출 지점의 오류로도 집계됨
+            logger.warning(
+                "Map summary failed for chunk %d/%d: %r", index + 1, len(prompts), result
+            )
+        else:
+            notes.append(result)
+    if not notes:
+        return _to_api_messages(window), _window_tokens(window, model)
+    if len(notes) < len(prompts):
+        notes.append("(이전 대화의 일부는 요약하지 못했습니다.)")
+
+    summary = {
+        "role": "system",
+        "message": "이전 대화 요약:\n"
+        + truncate_text("\n\n".join(notes), model, max_tokens // 4),
+    }
+    return (
+        _to_api_messages([summary, *window]),
+        _window_tokens(window, model) + count_message_tokens(summary, model),
+    )
+
+
+async def _prepare_chat_request(messages, model):
+    """모델에 보낼 메시지와 그 프롬프트 토큰 수 (토큰 계산은 워커 스레드에서)"""
     if model not in MODEL_TOKEN_LIMITS:
         raise ValueError(f"Model {model} not found in MODEL_TOKEN_LIMITS.")
 
-    max_tokens = MODEL_TOKEN_LIMITS[model] - 1000
-    message_chunks = split_messages(messages, max_tokens)
-
-    responses = []
-
-    if model == "llama-3.1-8b-instant":
-        for chunk in message_chunks:
-            filtered_messages = [
-                {"role": message["role"], "content": message["message"]}
-                for message in chunk
-                if message["message"] is not None
-            ]
-            try:
-                response = groq_client.chat.completions.create(
-                    model=model,
-                    messages=filtered_messages,
-                    temperature=temperature,
-                )
-                responses.append(response.choices[0].message.content)
-            except Exception as e:
-                responses.append(f"Error: {str(e)}")
-    else:
-        for chunk in message_chunks:
-            filtered_messages = [
-                {"role": message["role"], "content": message["message"]}
-                for message in chunk
-                if message["message"] is not None
-            ]
-            try:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=filtered_messages,
-                    temperature=temperature,
-                )
-                responses.append(response.choices[0].message.content)
-            except Exception as e:
-                responses.append(f"Error: {str(e)}")
-
-    return "\n".join(responses)
+    max_tokens = MODEL_TOKEN_LIMITS[model] - RESPONSE_TOKEN_RESERVE
+    if CONTEXT_STRATEGIES.get(model, "window") == "map_reduce":
+        return await _map_reduce_context(messages, model, max_tokens)
+    window, prompt_tokens = await asyncio.to_thread(
+        _select_window, messages, model, max_tokens
+    )
+    return _to_api_messages(window), prompt_tokens
 
 
-def summarize_chat(chat_history, model="gpt-4o"):
+async def get_response_async(messages, model="gpt-4o", temperature=0.7):
+    with track("get_response") as call:
+        filtered_messages, prompt_tokens = await _prepare_chat_request(messages, model)
+        try:
+            response = await route_chat_completion(
+                model,
+                filtered_messages,
+                prompt_tokens=prompt_tokens,
+                temperature=temperature,
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            call.fail(e)
+            return f"Error: {str(e)}"
+
+
+async def stream_response_async(messages, model="gpt-4o", temperature=0.7, route_info=None):
+    """
+    응답을 생성되는 대로 텍스트 조각(delta) 단위로 yield하는 비동기 제너레이터.
+    route_info(dict)를 넘기면 첫 조각 전에 실제로 응답한 모델을 route_info["model"]에 기록합니다.
+    """
+    with track("stream_response") as call:
+        filtered_messages, prompt_tokens = await _prepare_chat_request(messages, model)
+        try:
+            async for delta in route_stream_chat_completion(
+                model,
+                filtered_messages,
+                prompt_tokens=prompt_tokens,
+                temperature=temperature,
+            ):
+                if route_info is not None and call.first_token_at is None:
+                    route_info["model"] = call.served_model
+                call.first_token()
+                yield delta
+        except Exception as e:
+            call.fail(e)
+            yield f"Error: {str(e)}"
+
+
+async def _cached_completion(namespace, ttl, model, messages, **params):
+    """같은 모델/메시지/파라미터의 요청이면 캐시된 응답 텍스트를 반환"""
+    cache = get_response_cache()
+    key = cache.make_key(namespace, model, messages, params)
+    content = await asyncio.to_thread(cache.get, key)
+    if content is not MISSING:
+        record_cache_hit()
+        return content
+
+    response = await route_chat_completion(model, messages, **params)
+    content = response.choices[0].message.content
+    await asyncio.to_thread(cache.set, key, content, ttl)
+    return content
+
+
+async def summarize_chat_async(chat_history, model="gpt-4o"):
     prompt = "다음 대화의 핵심 주제를 15자 이내로 작성해:\n\n" + "\n".join(
         [f"{msg['role']}: {msg['message']}" for msg in chat_history]
     )
@@ -93,10 +280,32 @@ def summarize_chat(chat_history, model="gpt-4o"):
         {"role": "system", "content": "You are a helpful assistant."},
         {"role": "user", "content": prompt},
     ]
-    response = client.chat.completions.create(model=model, messages=messages)
+    with track("summarize_chat"):
+        return await _cached_completion("summary", SUMMARY_CACHE_TTL, model, messages)
+
+
+async def update_memory_async(memory, new_messages, model="gpt-4o-mini", max_tokens=800):
+    """기존 대화 요약(memory)에 새 메시지들을 반영한 요약을 생성"""
+    transcript = "\n".join(f"{msg['role']}: {msg['message']}" for msg in new_messages)
+    prompt = (
+        "다음은 지금까지의 대화 요약과 그 이후의 대화야. 이후 대화에서 나온 사실, 결정, "
+        "사용자의 요청과 선호, 아직 답하지 않은 질문을 반영해 요약을 갱신해. "
+        "나중에 대화를 이어갈 때 필요한 내용만 남기고 간결하게 써.\n\n"
+        f"기존 요약:\n{memory or '(없음)'}\n\n이후 대화:\n{transcript}"
+    )
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt},
+    ]
+    # 요약할 때마다 기존 요약과 새 메시지가 달라 캐시가 맞을 일이 없으므로 바로 호출
+    with track("update_memory"):
+        response = await route_chat_completion(
+            model, messages, temperature=0, max_tokens=max_tokens
+        )
     return response.choices[0].message.content
 
-def analyze_image(image_url, model, user_prompt):
+
+async def analyze_image_async(image_url, model, user_prompt):
     """
     이미지 URL과 사용자 프롬프트를 받아 OpenAI Vision API를 사용하여 설명을 생성합니다.
     
@@ -108,49 +317,64 @@ def analyze_image(image_url, model, user_prompt):
     Returns:
     - str: 이미지 설명 또는 오류 메시지.
     """
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
+    with track("analyze_image") as call:
+        try:
+            return await _cached_completion(
+                "image_analysis",
+                IMAGE_ANALYSIS_CACHE_TTL,
+                model,
+                [
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": [{"type": "text", "text": user_prompt}]},
+                    {"role": "user", "content": [{"type": "image_url", "image_url": {"url": image_url}}]},
+                ],
+                max_tokens=300,
+            )
+        except Exception as e:
+            call.fail(e)
+            return f"Error analyzing image: {str(e)}"
+
+
+async def analyze_user_input_for_image_request_async(prompt, model="gpt-4o"):
+    with track("image_intent"):
+        # 대부분의 입력은 로컬 분류기로 판별하고, 애매한 경우에만 선택된 모델에 질의
+        decision = classify_image_request(prompt)
+        if decision is not None:
+            return decision
+
+        answer = await _cached_completion(
+            "image_intent",
+            INTENT_CACHE_TTL,
+            model,
+            [
                 {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": [{"type": "text", "text": user_prompt}]},
-                {"role": "user", "content": [{"type": "image_url", "image_url": {"url": image_url}}]},
+                {
+                    "role": "user",
+                    "content": f"Is the following user input a request to generate an image? '{prompt}' Please answer 'yes' or 'no'.",
+                },
             ],
-            max_tokens=300
+            temperature=0,
         )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error analyzing image: {str(e)}"
+        answer = answer.strip().lower()
+        return "yes" in answer
 
 
+# 동기 API: 공유 이벤트 루프에서 비동기 함수를 실행
+def get_response(messages, model="gpt-4o", temperature=0.7):
+    return run_sync(get_response_async(messages, model, temperature))
 
 
+def stream_response(messages, model="gpt-4o", temperature=0.7):
+    return iterate_sync(stream_response_async(messages, model, temperature))
+
+
+def summarize_chat(chat_history, model="gpt-4o"):
+    return run_sync(summarize_chat_async(chat_history, model))
+
+
+def analyze_image(image_url, model, user_prompt):
+    return run_sync(analyze_image_async(image_url, model, user_prompt))
+
 
 def analyze_user_input_for_image_request(prompt, model="gpt-4o"):
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {
-                "role": "user",
-                "content": f"Is the following user input a request to generate an image? '{prompt}' Please answer 'yes' or 'no'.",
-            },
-        ],
-        temperature=0,
-    )
-    answer = response.choices[0].message.content.strip().lower()
-    return "yes" in answer
-
-
-def generate_image(prompt, model="dall-e-3", size="1024x1024"):
-    try:
-        response = client.images.generate(
-            model=model,
-            prompt=prompt,
-            size=size,
-            quality="standard",
-            n=1,
-        )
-        return response.data[0].url
-    except Exception as e:
-        return f"Error generating image: {str(e)}"
+    return run_sync(analyze_user_input_for_image_request_async(prompt, model))
@@ -0,0 +1,93 @@
+"""
+기존 채팅 문서에 목록용 집계 필드를 채우는 일회성 스크립트.
+
+save_message는 메시지를 저장할 때 채팅 문서의 message_count, token_count,
+last_message_at, last_message_preview를 함께 갱신합니다. 그 전에 만들어진 채팅은
+이 필드가 없어 last_message_at 순 목록에 나타나지 않으므로, 메시지를 한 번 읽어
+집계한 값을 set(merge=True)로 기록합니다. 여러 번 실행해도 결과는 같습니다.
+
+사용법 (저장소 루트에서, 앱을 멈춘 상태에서 실행):
+    python scripts/backfill_chat_stats.py --dry-run
+    python scripts/backfill_chat_stats.py --user <user_id>
+"""
+
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from firebase_config import get_db
+from utils.firestore import MESSAGE_PREVIEW_CHARS
+from utils.tokens import count_tokens
+
+# 한 배치에 담는 채팅 문서 수 (Firestore 배치 한도는 500)
+BATCH_SIZE = 400
+
+
+def chat_stats(chat):
+    """채팅의 메시지를 읽어 집계 필드를 계산 (메시지가 없으면 생성 시각 사용)"""
+    stats = {"message_count": 0, "token_count": 0}
+    last = None
+    for doc in chat.reference.collection("messages").order_by("timestamp").stream():
+        message = doc.to_dict()
+        text = message.get("message")
+        stats["message_count"] += 1
+        stats["token_count"] += count_tokens(text) if isinstance(text, str) else 0
+        last = message
+
+    if last is not None:
+        stats["last_message_at"] = last.get("timestamp")
+        text = last.get("message")
+        stats["last_message_preview"] = (
+            text[:MESSAGE_PREVIEW_CHARS] if isinstance(text, str) else ""
+        )
+    else:
+        stats["last_message_at"] = (chat.to_dict() or {}).get("created_at")
+    if stats["last_message_at"] is None:
+        del stats["last_message_at"]
+    return stats
+
+
+def backfill(user_ids=None, dry_run=False):
+    db = get_db()
+    if user_ids is None:
+        # 사용자 문서 없이 하위 컬렉션만 있는 경우도 있어 list_documents 사용
+        user_ids = [ref.id for ref in db.collection("users").list_documents()]
+
+    updated = 0
+    batch = db.batch()
+    pending = 0
+    for user_id in user_ids:
+        chats = db.collection("users").document(user_id).collection("chats").stream()
+        for chat in chats:
+            stats = chat_stats(chat)
+            print(f"{user_id}/{chat.id}: {stats}")
+            updated += 1
+            if dry_run:
+                continue
+            batch.set(chat.reference, stats, merge=True)
+            pending += 1
+            if pending >= BATCH_SIZE:
+                batch.commit()
+                batch = db.batch()
+                pending = 0
+    if pending:
+        batch.commit()
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="채팅 목록 집계 필드 백필")
+    parser.add_argument("--user", action="append", dest="users", help="대상 사용자 (여러 번 지정 가능)")
+    parser.add_argument("--dry-run", action="store_true", help="쓰지 않고 계산 결과만 출력")
+    args = parser.parse_args()
+
+    count = backfill(args.users, args.dry_run)
+    action = "확인" if args.dry_run else "갱신"
+    print(f"채팅 {count}개 {action}")
+
+
+if __name__ == "__main__":
+    main()
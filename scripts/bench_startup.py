@@ -0,0 +1,110 @@
+"""
+앱 시작 비용 측정 스크립트.
+
+모듈마다 새 파이썬 프로세스에서 임포트 시간을 여러 번 재고, -X importtime 결과에서
+자체 임포트 시간이 큰 모듈을 보여줍니다. --first-use를 주면 Firebase/LLM 클라이언트를
+처음 만들 때 걸리는 시간도 잽니다 (인증 정보 필요).
+
+사용법 (저장소 루트에서):
+    python scripts/bench_startup.py
+    python scripts/bench_startup.py --runs 10 --top 15 modules.chat
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = [
+    "firebase_config",
+    "utils.auth",
+    "utils.firestore",
+    "openai_api",
+    "modules.chat",
+    "streamlit_app",
+]
+
+# 처음 사용할 때 만들어지는 클라이언트들
+FIRST_USE_STEPS = [
+    ("firebase app", "from firebase_config import get_app; get_app()"),
+    ("firestore client", "from firebase_config import get_db; get_db()"),
+    ("storage bucket", "from firebase_config import get_bucket; get_bucket()"),
+    ("openai client", "from utils.llm import get_client; get_client('openai')"),
+    ("groq client", "from utils.llm import get_client; get_client('groq')"),
+]
+
+_TIMED_SNIPPET = """
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def _run(code, importtime=False):
+    args = [sys.executable]
+    if importtime:
+        args += ["-X", "importtime"]
+    args += ["-c", _TIMED_SNIPPET.format(code=code)]
+    result = subprocess.run(args, cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return float(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def _top_imports(importtime_output, count):
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        rows.append((int(self_us), int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def bench_imports(modules, runs, top):
+    print(f"{'module':<20} {'median':>9} {'min':>9}  (seconds, {runs} runs)")
+    for module in modules:
+        try:
+            times = [_run(f"import {module}")[0] for _ in range(runs)]
+        except RuntimeError as e:
+            print(f"{module:<20} failed: {e}")
+            continue
+        print(f"{module:<20} {statistics.median(times):>9.3f} {min(times):>9.3f}")
+
+    if top:
+        target = modules[-1]
+        _, output = _run(f"import {target}", importtime=True)
+        print(f"\n{target}: 자체 임포트 시간 상위 {top}개 (ms)")
+        for self_us, cumulative_us, name in _top_imports(output, top):
+            print(f"  {self_us / 1000:>8.1f} {cumulative_us / 1000:>9.1f}  {name}")
+
+
+def bench_first_use():
+    print("\n첫 사용 비용 (임포트 포함, 초)")
+    for label, code in FIRST_USE_STEPS:
+        try:
+            elapsed, _ = _run(code)
+            print(f"  {label:<18} {elapsed:>8.3f}")
+        except RuntimeError as e:
+            print(f"  {label:<18} failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="마지막 모듈의 상위 임포트 수")
+    parser.add_argument("--first-use", action="store_true")
+    args = parser.parse_args()
+
+    bench_imports(args.modules, args.runs, args.top)
+    if args.first_use:
+        bench_first_use()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+utils/firestore가 사용하는 Firestore API만 구현한 인메모리 대체 클라이언트.
+
+컬렉션/문서 참조, where/order_by/select/limit/start_after 쿼리, list_documents,
+배치 쓰기와 SERVER_TIMESTAMP/Increment/DELETE_FIELD 변환을 지원합니다.
+latency를 주면 매 요청마다 그만큼 기다려 네트워크 왕복을 흉내 냅니다.
+"""
+
+import copy
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import cmp_to_key
+
+from google.cloud.firestore_v1 import DELETE_FIELD, SERVER_TIMESTAMP, Increment
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+def _apply_transforms(current, data, commit_time):
+    result = dict(current or {})
+    for field, value in data.items():
+        if value is DELETE_FIELD:
+            result.pop(field, None)
+        elif value is SERVER_TIMESTAMP:
+            result[field] = commit_time
+        elif isinstance(value, Increment):
+            result[field] = result.get(field, 0) + value.value
+        else:
+            result[field] = copy.deepcopy(value)
+    return result
+
+
+class MemoryFirestore:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._documents = {}
+        self._lock = threading.RLock()
+        self._last_commit_time = None
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def _commit_time(self):
+        # 실제 Firestore처럼 커밋마다 하나의, 계속 증가하는 시각 (SERVER_TIMESTAMP 값)
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            if self._last_commit_time is not None and now <= self._last_commit_time:
+                now = self._last_commit_time + timedelta(microseconds=1)
+            self._last_commit_time = now
+            return now
+
+    def _write(self, op, path, data=None, merge=False, commit_time=None):
+        with self._lock:
+            commit_time = commit_time or self._commit_time()
+            if op == "delete":
+                self._documents.pop(path, None)
+            elif op == "update":
+                if path not in self._documents:
+                    raise KeyError(f"No document to update: {path}")
+                self._documents[path] = _apply_transforms(
+                    self._documents[path], data, commit_time
+                )
+            else:
+                current = self._documents.get(path) if merge else None
+                self._documents[path] = _apply_transforms(current, data, commit_time)
+
+    def _children(self, collection_path):
+        prefix = collection_path + "/"
+        with self._lock:
+            return [
+                (path, copy.deepcopy(data))
+                for path, data in self._documents.items()
+                if path.startswith(prefix) and "/" not in path[len(prefix) :]
+            ]
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None):
+        self._client._round_trip()
+        with self._client._lock:
+            data = copy.deepcopy(self._client._documents.get(self.path))
+        if data is not None and field_paths is not None:
+            data = {field: data[field] for field in field_paths if field in data}
+        return DocumentSnapshot(self, data)
+
+    def set(self, data, merge=False):
+        self._client._round_trip()
+        self._client._write("set", self.path, data, merge)
+
+    def update(self, data):
+        self._client._round_trip()
+        self._client._write("update", self.path, data)
+
+    def delete(self):
+        self._client._round_trip()
+        self._client._write("delete", self.path)
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field):
+        return self._data[field]
+
+
+class Query:
+    def __init__(self, client, path, filters=(), orders=(), limit=None, cursor=None, fields=None):
+        self._client = client
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "cursor": self._cursor,
+            "fields": self._fields,
+            **changes,
+        }
+        return Query(self._client, self._path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        cursor = document_fields_or_snapshot
+        if isinstance(cursor, DocumentSnapshot):
+            cursor = {**cursor.to_dict(), "__name__": cursor.reference}
+        values = []
+        for field, _ in self._orders:
+            value = cursor.get(field)
+            values.append(value.path if isinstance(value, DocumentReference) else value)
+        return self._copy(cursor=values)
+
+    def _compare(self, a, b):
+        for (field, direction), left, right in zip(self._orders, a, b):
+            if left == right:
+                continue
+            result = -1 if left < right else 1
+            return -result if direction == "DESCENDING" else result
+        return 0
+
+    def stream(self):
+        self._client._round_trip()
+        rows = []
+        for path, data in self._client._children(self._path):
+            if any(field not in data and field != "__name__" for field, _ in self._orders):
+                continue
+            if all(
+                field in data and _OPERATORS[op](data[field], value)
+                for field, op, value in self._filters
+            ):
+                rows.append((path, data))
+
+        def key(row):
+            # "__name__"은 문서 경로 순 (실제 Firestore의 문서 id 정렬과 같은 컬렉션 안에서 동일)
+            return [
+                row[0] if field == "__name__" else row[1][field]
+                for field, _ in self._orders
+            ]
+
+        rows.sort(key=cmp_to_key(lambda a, b: self._compare(key(a), key(b))))
+        if self._cursor is not None:
+            rows = [row for row in rows if self._compare(key(row), self._cursor) > 0]
+        if self._limit is not None:
+            rows = rows[: self._limit]
+
+        for path, data in rows:
+            if self._fields is not None:
+                data = {field: data[field] for field in self._fields if field in data}
+            yield DocumentSnapshot(DocumentReference(self._client, path), data)
+
+    def get(self):
+        return list(self.stream())
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.path = path
+
+    def document(self, document_id=None):
+        return DocumentReference(
+            self._client, f"{self.path}/{document_id or uuid.uuid4().hex[:20]}"
+        )
+
+    def list_documents(self, page_size=None):
+        self._client._round_trip()
+        for path, _ in self._client._children(self.path):
+            yield DocumentReference(self._client, path)
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference.path, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(("update", reference.path, data, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference.path, None, False))
+
+    def commit(self):
+        self._client._round_trip()
+        # 실제 배치처럼 모든 쓰기를 한 번에 반영
+        with self._client._lock:
+            # 하나라도 실패할 쓰기가 있으면 아무것도 반영하지 않음
+            exists = {}
+            for op, path, _, _ in self._writes:
+                if op == "update" and not exists.get(
+                    path, path in self._client._documents
+                ):
+                    raise KeyError(f"No document to update: {path}")
+                exists[path] = op != "delete"
+            commit_time = self._client._commit_time()
+            for op, path, data, merge in self._writes:
+                self._client._write(op, path, data, merge, commit_time)
+        self._writes = []
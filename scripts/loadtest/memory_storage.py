@@ -0,0 +1,87 @@
+"""
+utils/storage가 사용하는 Firebase Storage 버킷 API만 구현한 인메모리 대체 객체.
+
+blob 업로드/다운로드, get_blob, list_blobs, delete_blobs와 세대(generation) 번호를
+지원합니다. latency를 주면 매 요청마다 그만큼 기다려 네트워크 왕복을 흉내 냅니다.
+"""
+
+import itertools
+import threading
+import time
+
+
+class MemoryBucket:
+    def __init__(self, latency=0.0, name="loadtest-bucket"):
+        self.latency = latency
+        self.name = name
+        # 이름 → (데이터, content type, 세대 번호)
+        self._objects = {}
+        self._generations = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def blob(self, name):
+        return Blob(self, name)
+
+    def get_blob(self, name):
+        self._round_trip()
+        with self._lock:
+            stored = self._objects.get(name)
+        if stored is None:
+            return None
+        blob = Blob(self, name)
+        blob.generation = stored[2]
+        return blob
+
+    def list_blobs(self, prefix=""):
+        self._round_trip()
+        with self._lock:
+            names = sorted(name for name in self._objects if name.startswith(prefix))
+        return [self.get_blob(name) for name in names]
+
+    def delete_blobs(self, blobs, on_error=None):
+        self._round_trip()
+        with self._lock:
+            for blob in blobs:
+                if self._objects.pop(blob.name, None) is None and on_error is not None:
+                    on_error(blob)
+
+
+class Blob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.generation = None
+
+    @property
+    def public_url(self):
+        return f"https://storage.invalid/{self.bucket.name}/{self.name}"
+
+    def exists(self):
+        return self.bucket.get_blob(self.name) is not None
+
+    def upload_from_string(self, data, content_type=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.bucket._round_trip()
+        with self.bucket._lock:
+            self.generation = next(self.bucket._generations)
+            self.bucket._objects[self.name] = (bytes(data), content_type, self.generation)
+
+    def download_as_bytes(self):
+        self.bucket._round_trip()
+        with self.bucket._lock:
+            stored = self.bucket._objects.get(self.name)
+        if stored is None:
+            raise FileNotFoundError(self.name)
+        self.generation = stored[2]
+        return stored[0]
+
+    def make_public(self):
+        pass
+
+    def delete(self):
+        self.bucket.delete_blobs([self])
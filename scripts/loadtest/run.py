@@ -0,0 +1,248 @@
+"""
+동시 사용자 부하 테스트 드라이버 (네트워크 접근 불필요).
+
+스텁 LLM 서버와 인메모리 Firestore/Storage를 띄우고, N개의 세션이 각각 스레드에서
+modules/chat.render와 같은 utils.turn의 텍스트 턴 흐름(기록 로드 → 사용자 메시지 저장 →
+대화 기억·첨부 검색 → 이미지 요청 판별과 답변 스트리밍 → 답변 저장 → 백그라운드 요약·압축)을
+반복합니다.
+끝나면 처리량과 단계별 p50/p95/p99 지연을 출력합니다.
+
+사용법 (저장소 루트에서):
+    python scripts/loadtest/run.py --sessions 50 --turns 5
+    python scripts/loadtest/run.py --sessions 200 --rate-429 0.05 --model-latency gpt-4o=2
+    python scripts/loadtest/run.py --base-url http://127.0.0.1:8800   # 따로 띄운 스텁 서버 사용
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from memory_firestore import MemoryFirestore
+from memory_storage import MemoryBucket
+from stub_llm_server import add_stub_arguments, config_from_args, start_stub_server
+
+STAGES = [
+    "load_history",
+    "save_user",
+    "context",
+    "intent",
+    "first_token",
+    "stream",
+    "save_assistant",
+    "turn",
+]
+
+PROMPTS = [
+    "파이썬에서 리스트와 튜플의 차이를 설명해줘",
+    "오늘 회의 내용을 세 줄로 정리해줘",
+    "Explain how HTTP keep-alive works.",
+    "이 코드의 시간 복잡도를 알려줘",
+    "What are good practices for writing commit messages?",
+]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def error(self, stage):
+        with self._lock:
+            self.errors[stage] += 1
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def _configure_environment(base_url, work_dir):
+    # 앱 모듈을 임포트하기 전에 설정해야 적용됨
+    os.environ["OPENAI_BASE_URL"] = f"{base_url}/v1"
+    os.environ["GROQ_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ.setdefault("GROQ_API_KEY", "stub")
+    os.environ["LLM_CACHE_PATH"] = os.path.join(work_dir, "llm_responses.sqlite3")
+    os.environ["RETRIEVAL_INDEX_DIR"] = os.path.join(work_dir, "indexes")
+    os.environ["FILE_CACHE_DIR"] = os.path.join(work_dir, "extracted")
+    os.environ["METRICS_LOG_PATH"] = ""
+
+
+def run_session(session_index, args, recorder, app):
+    user_id = f"loadtest-user-{session_index}"
+    app["set_current_user"](user_id)
+    chat_id = app["create_new_chat"](user_id)
+    rng = random.Random(session_index)
+    # 세션마다 Streamlit 세션 상태처럼 기록 저장소 하나
+    history_store = app["HistoryStore"]()
+
+    started = time.perf_counter()
+    chat_history = history_store.load(
+        user_id, chat_id, app["get_chat_history"](user_id, chat_id)
+    )
+    recorder.add("load_history", time.perf_counter() - started)
+
+    for turn in range(args.turns):
+        prompt = f"{rng.choice(PROMPTS)} ({session_index}-{turn})"
+        turn_started = time.perf_counter()
+
+        with app["begin_turn"](user_id, chat_id, chat_history, prompt, args.model) as turn_state:
+            for stage, seconds in turn_state.timings.items():
+                recorder.add(stage, seconds)
+            if not turn_state.is_image_request:
+                stream_started = time.perf_counter()
+                parts = []
+                for delta in turn_state.stream():
+                    if not parts:
+                        recorder.add("first_token", time.perf_counter() - turn_started)
+                    parts.append(delta)
+                recorder.add("stream", time.perf_counter() - stream_started)
+                response = "".join(parts)
+                if response.startswith("Error"):
+                    recorder.error("stream")
+
+                started = time.perf_counter()
+                chat_history.append(
+                    app["save_message"](
+                        user_id,
+                        chat_id,
+                        "assistant",
+                        response,
+                        fallback_model=turn_state.fallback_model,
+                    )
+                )
+                recorder.add("save_assistant", time.perf_counter() - started)
+
+        history_store.enforce_budget()
+        app["finish_turn"](user_id, chat_id, chat_history, args.model)
+        recorder.add("turn", time.perf_counter() - turn_started)
+
+        if args.think_time:
+            time.sleep(rng.uniform(0, 2 * args.think_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="동시 세션 부하 테스트")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--think-time", type=float, default=0.5, help="턴 사이 평균 대기 (초)")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="모든 세션을 시작하는 데 걸리는 시간 (초)")
+    parser.add_argument("--firestore-latency", type=float, default=0.02, help="Firestore 요청당 지연 (초)")
+    parser.add_argument("--base-url", help="따로 실행 중인 스텁 서버 주소 (없으면 내장 서버 사용)")
+    parser.add_argument("--json", action="store_true", help="결과를 JSON으로 출력")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stub = None
+    base_url = args.base_url
+    if base_url is None:
+        stub = start_stub_server(config_from_args(args))
+        base_url = stub.base_url
+
+    work_dir = tempfile.mkdtemp(prefix="loadtest-")
+    _configure_environment(base_url.rstrip("/"), work_dir)
+
+    import firebase_config
+
+    firebase_config.override_clients(
+        db=MemoryFirestore(latency=args.firestore_latency),
+        bucket=MemoryBucket(latency=args.firestore_latency),
+    )
+
+    from utils.firestore import create_new_chat, flush_messages, get_chat_history, save_message
+    from utils.history_store import HistoryStore
+    from utils.llm import set_current_user
+    from utils.turn import begin_turn, finish_turn
+
+    app = {
+        "create_new_chat": create_new_chat,
+        "get_chat_history": get_chat_history,
+        "save_message": save_message,
+        "set_current_user": set_current_user,
+        "HistoryStore": HistoryStore,
+        "begin_turn": begin_turn,
+        "finish_turn": finish_turn,
+    }
+
+    recorder = Recorder()
+    failures = []
+    started = time.perf_counter()
+    # Streamlit처럼 세션마다 스크립트 스레드 하나
+    with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+        futures = []
+        for index in range(args.sessions):
+            futures.append(executor.submit(run_session, index, args, recorder, app))
+            if args.ramp_up and args.sessions > 1:
+                time.sleep(args.ramp_up / (args.sessions - 1))
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failures.append(repr(e))
+    elapsed = time.perf_counter() - started
+    flush_messages()
+
+    turns = len(recorder.samples["turn"])
+    report = {
+        "sessions": args.sessions,
+        "turns": turns,
+        "elapsed": elapsed,
+        "throughput_turns_per_s": turns / elapsed if elapsed else 0.0,
+        "failed_sessions": len(failures),
+        "stages": {},
+        "errors": dict(recorder.errors),
+        "stub": stub.stats() if stub else None,
+    }
+    for stage in STAGES:
+        values = sorted(recorder.samples[stage])
+        if values:
+            report["stages"][stage] = {
+                "count": len(values),
+                "p50": _percentile(values, 0.5),
+                "p95": _percentile(values, 0.95),
+                "p99": _percentile(values, 0.99),
+                "max": values[-1],
+            }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(
+        f"{args.sessions} sessions, {turns} turns in {elapsed:.1f}s "
+        f"→ {report['throughput_turns_per_s']:.2f} turns/s"
+    )
+    print(f"\n{'stage':<16}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (seconds)")
+    for stage, stats in report["stages"].items():
+        print(
+            f"{stage:<16}{stats['count']:>7}{stats['p50']:>9.3f}{stats['p95']:>9.3f}"
+            f"{stats['p99']:>9.3f}{stats['max']:>9.3f}"
+        )
+    if report["errors"]:
+        print(f"\nerror replies: {report['errors']}")
+    if failures:
+        print(f"failed sessions: {len(failures)} (first: {failures[0]})")
+    if report["stub"]:
+        print(f"stub server: {report['stub']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+OpenAI/Groq 호환 스텁 서버 (네트워크 없이 부하 테스트용).
+
+chat.completions(일반/SSE 스트리밍)와 images.generations를 흉내 내며, 응답 지연,
+토큰 간 지연, 429/500 오류 비율을 설정할 수 있습니다. 앱은 아래처럼 연결합니다.
+
+    OPENAI_BASE_URL=http://127.0.0.1:8800/v1
+    GROQ_BASE_URL=http://127.0.0.1:8800
+
+단독 실행:
+    python scripts/loadtest/stub_llm_server.py --port 8800 --latency 0.5 --rate-429 0.05
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class StubConfig:
+    # 첫 토큰까지의 평균 지연과 표준편차 (초)
+    latency: float = 0.3
+    jitter: float = 0.1
+    # 스트리밍 시 조각 사이 지연 (초)과 응답 조각 수
+    token_delay: float = 0.01
+    completion_tokens: int = 60
+    # 오류 주입 비율과 429 응답의 Retry-After (초)
+    rate_429: float = 0.0
+    rate_500: float = 0.0
+    retry_after: float = 1.0
+    # 모델별 평균 지연 덮어쓰기 (예: {"gpt-4o": 2.0})
+    model_latency: dict = field(default_factory=dict)
+
+
+_WORDS = "stub response text for load testing the chat application".split()
+
+
+def _reply_text(messages, count):
+    last = messages[-1]["content"] if messages else ""
+    if isinstance(last, list):
+        last = " ".join(part.get("text", "") for part in last)
+    # 이미지 요청 판별 질의에는 짧게 답함
+    if "'yes' or 'no'" in last:
+        return ["no"]
+    return [_WORDS[i % len(_WORDS)] + " " for i in range(count)]
+
+
+def _prompt_tokens(messages):
+    return max(1, len(json.dumps(messages, ensure_ascii=False)) // 4)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "StubLLM/1.0"
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _inject_error(self):
+        roll = random.random()
+        if roll < self.config.rate_429:
+            self.server.record("429")
+            retry_after = self.config.retry_after
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"retry-after": str(retry_after), "retry-after-ms": str(int(retry_after * 1000))},
+            )
+            return True
+        if roll < self.config.rate_429 + self.config.rate_500:
+            self.server.record("500")
+            self._send_json(500, {"error": {"message": "Internal error (stub)", "type": "server_error"}})
+            return True
+        return False
+
+    def _wait_first_token(self, model):
+        mean = self.config.model_latency.get(model, self.config.latency)
+        time.sleep(max(0.0, random.gauss(mean, self.config.jitter)))
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        request = self._read_json()
+        if self.path.endswith("/chat/completions"):
+            self.server.record("chat")
+            if self._inject_error():
+                return
+            if request.get("stream"):
+                self._stream_chat(request)
+            else:
+                self._chat(request)
+        elif self.path.endswith("/images/generations"):
+            self.server.record("images")
+            if self._inject_error():
+                return
+            self._wait_first_token(request.get("model"))
+            host, port = self.server.server_address[:2]
+            self._send_json(
+                200,
+                {
+                    "created": int(time.time()),
+                    "data": [{"url": f"http://{host}:{port}/images/{uuid.uuid4().hex}.png"}],
+                },
+            )
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _chat(self, request):
+        messages = request.get("messages", [])
+        model = request.get("model")
+        pieces = _reply_text(messages, request.get("max_tokens") or self.config.completion_tokens)
+        self._wait_first_token(model)
+        prompt_tokens = _prompt_tokens(messages)
+        self._send_json(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(pieces).strip()},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(pieces),
+                    "total_tokens": prompt_tokens + len(pieces),
+                },
+            },
+        )
+
+    def _write_chunk(self, payload):
+        data = f"data: {payload}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_chat(self, request):
+        messages = request.get("messages", [])
+        model = request.get("model")
+        pieces = _reply_text(messages, request.get("max_tokens") or self.config.completion_tokens)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def chunk(delta, finish_reason=None, usage=None):
+            return json.dumps(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": []
+                    if usage
+                    else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    "usage": usage,
+                }
+            )
+
+        self._wait_first_token(model)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            self._write_chunk(chunk({"role": "assistant", "content": ""}))
+            for index, piece in enumerate(pieces):
+                if index:
+                    time.sleep(self.config.token_delay)
+                self._write_chunk(chunk({"content": piece}))
+            self._write_chunk(chunk({}, "stop"))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                prompt_tokens = _prompt_tokens(messages)
+                self._write_chunk(
+                    chunk(
+                        None,
+                        usage={
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": len(pieces),
+                            "total_tokens": prompt_tokens + len(pieces),
+                        },
+                    )
+                )
+            self._write_chunk("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 클라이언트가 스트림을 취소함 (헤지 요청에서 진 쪽 등)
+            self.server.record("cancelled")
+            self.close_connection = True
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self._counts = Counter()
+        self._counts_lock = threading.Lock()
+
+    def record(self, name):
+        with self._counts_lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        with self._counts_lock:
+            return dict(self._counts)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub_server(config=None, host="127.0.0.1", port=0):
+    """스텁 서버를 백그라운드 스레드에서 시작 (port=0이면 빈 포트 사용)"""
+    server = StubServer((host, port), config or StubConfig())
+    threading.Thread(target=server.serve_forever, name="stub-llm-server", daemon=True).start()
+    return server
+
+
+def add_stub_arguments(parser):
+    defaults = StubConfig()
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="첫 토큰까지 평균 지연 (초)")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+    parser.add_argument("--token-delay", type=float, default=defaults.token_delay)
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens)
+    parser.add_argument("--rate-429", type=float, default=defaults.rate_429, help="429 응답 비율 (0~1)")
+    parser.add_argument("--rate-500", type=float, default=defaults.rate_500, help="500 응답 비율 (0~1)")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+    parser.add_argument(
+        "--model-latency",
+        action="append",
+        default=[],
+        metavar="MODEL=SECONDS",
+        help="모델별 평균 지연 (여러 번 지정 가능)",
+    )
+
+
+def config_from_args(args):
+    return StubConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        token_delay=args.token_delay,
+        completion_tokens=args.completion_tokens,
+        rate_429=args.rate_429,
+        rate_500=args.rate_500,
+        retry_after=args.retry_after,
+        model_latency={
+            model: float(seconds)
+            for model, seconds in (item.split("=", 1) for item in args.model_latency)
+        },
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI/Groq 호환 스텁 서버")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), config_from_args(args))
+    print(f"OPENAI_BASE_URL={server.base_url}/v1")
+    print(f"GROQ_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,13 @@ from utils.auth import (
     handle_google_callback,
 )
 from datetime import datetime, timedelta
-from modules import login, signup, chat
-from utils.firestore import get_user_chats, create_new_chat, delete_chat
+from modules import login, signup, chat, metrics_panel
+from utils.firestore import (
+    get_user_chats_with_metadata,
+    create_new_chat,
+    delete_chat,
+)
+from utils.metrics import start_metrics_server
 import urllib.parse
 import os
 
@@ -25,6 +30,9 @@ AVAILABLE_MODELS = [
     "llama-3.1-8b-instant",
 ]
 
+# 사이드바에 성능 지표 디버그 패널 표시 여부
+SHOW_METRICS_PANEL = os.getenv("SHOW_METRICS_PANEL") == "1"
+
 
 def format_chat_date(chat_date):
     """채팅 날짜를 포맷팅하는 함수"""
@@ -58,7 +66,7 @@ def group_chats_by_date(chats):
     older_chats = []
 
     for chat in chats:
-        chat_date = chat.get("created_at")
+        chat_date = chat.get("last_message_at") or chat.get("created_at")
         if not chat_date:
             older_chats.append(chat)
             continue
@@ -85,6 +93,14 @@ def group_chats_by_date(chats):
     }
 
 
+def chat_preview(chat):
+    """채팅 버튼 툴팁: 마지막 메시지 미리보기와 메시지 수"""
+    preview = chat.get("last_message_preview")
+    if not preview:
+        return None
+    return f"{preview} ({chat.get('message_count', 0)}개 메시지)"
+
+
 def render_chat_group(chats, title):
     """채팅 그룹을 렌더링하는 함수"""
     if not chats:
@@ -97,6 +113,7 @@ def render_chat_group(chats, title):
             if st.button(
                 chat.get("summary", "새로운 채팅"),
                 key=f"chat_{chat['id']}",
+                help=chat_preview(chat),
                 use_container_width=True,
             ):
                 st.session_state["selected_chat"] = chat["id"]
@@ -104,12 +121,19 @@ def render_chat_group(chats, title):
         with col2:
             if st.button("삭제", key=f"delete_{chat['id']}", use_container_width=True):
                 delete_chat(st.session_state["user"], chat["id"])
+                # 이 세션에 불러 둔 기록도 함께 버림
+                history_store = st.session_state.get("history_store")
+                if history_store is not None:
+                    history_store.discard(chat["id"])
                 if st.session_state.get("selected_chat") == chat["id"]:
                     st.session_state.pop("selected_chat", None)
                 st.rerun()
 
 
 def main():
+    # METRICS_PORT가 설정된 경우에만 Prometheus /metrics 엔드포인트를 시작
+    start_metrics_server()
+
     query_params = st.experimental_get_query_params()
     if "code" in query_params:
         code = query_params["code"][0]
@@ -166,7 +190,10 @@ def main():
         # 채팅 기록 섹션
         st.markdown("## 채팅 기록")
 
-        user_chats = get_user_chats_with_metadata(st.session_state["user"])
+        chat_list_pages = st.session_state.get("chat_list_pages", 1)
+        user_chats, has_more_chats = get_user_chats_with_metadata(
+            st.session_state["user"], max_pages=chat_list_pages
+        )
         if user_chats:
             grouped_chats = group_chats_by_date(user_chats)
 
@@ -174,10 +201,20 @@ def main():
             for group_title, chats in grouped_chats.items():
                 render_chat_group(chats, group_title)
 
+            # 이전 채팅은 요청할 때만 다음 페이지를 불러옴
+            if has_more_chats and st.button(
+                "더 보기", key="load_more_chats", use_container_width=True
+            ):
+                st.session_state["chat_list_pages"] = chat_list_pages + 1
+                st.rerun()
+
             # 선택된 채팅이 없으면 첫 번째 채팅 선택
             if "selected_chat" not in st.session_state and user_chats:
                 st.session_state["selected_chat"] = user_chats[0]["id"]
 
+        if SHOW_METRICS_PANEL:
+            metrics_panel.render()
+
     # 메인 컨텐츠 영역
     if "show_login" in st.session_state and st.session_state["show_login"]:
         login.render()
@@ -1,15 +1,16 @@
 import uuid
 import streamlit as st
 import requests
-from firebase_admin import auth
-from firebase_config import db
-from google_auth_oauthlib.flow import Flow
-from google.auth.transport import requests as google_requests
-from google.oauth2 import id_token
-from firebase_admin import auth
-from firebase_admin.auth import UserNotFoundError
+from firebase_config import get_auth, get_db
 import os
 
+from utils.cache import MISSING, LRUCache
+
+# 사용자 프로필 캐시 (모든 세션 공유). auth.get_users는 한 번에 최대 100명까지 조회 가능
+USER_PROFILE_TTL = 300
+GET_USERS_BATCH_SIZE = 100
+_user_profile_cache = LRUCache(max_entries=4096, ttl=USER_PROFILE_TTL)
+
 # 환경 변수에서 서버 호스트와 포트를 가져옵니다.
 # 기본값은 localhost와 8501입니다.
 host = os.environ.get("STREAMLIT_SERVER_ADDRESS", "localhost")
@@ -20,6 +21,9 @@ REDIRECT_URI = f"http://{host}:{port}"
 
 
 def get_google_flow():
+    # google-auth-oauthlib은 Google 로그인을 사용할 때만 로드
+    from google_auth_oauthlib.flow import Flow
+
     return Flow.from_client_secrets_file(
         "client_secret.json",
         scopes=[
@@ -32,9 +36,11 @@ def get_google_flow():
 
 
 def signup(email, password):
+    auth = get_auth()
     try:
         user = auth.create_user(email=email, password=password)
-        db.collection("users").document(user.uid).set({"email": email})
+        get_db().collection("users").document(user.uid).set({"email": email})
+        invalidate_user_profile(user.uid)
         st.session_state["user"] = user.uid
         st.success("User created and logged in successfully.")
         return True
@@ -53,6 +59,7 @@ def login(email, password):
         response = requests.post(firebase_auth_url, json=payload)
         response.raise_for_status()
         data = response.json()
+        invalidate_user_profile(data["localId"])
         st.session_state["user"] = data["localId"]
         st.success("Logged in successfully")
         st.session_state["show_login"] = False
@@ -74,7 +81,11 @@ def login_with_google():
 
 
 def handle_google_callback(code):
+    from google.auth.transport import requests as google_requests
+    from google.oauth2 import id_token
+
     try:
+        auth = get_auth()
         flow = get_google_flow()
         flow.fetch_token(code=code)
         credentials = flow.credentials
@@ -92,8 +103,10 @@ def handle_google_callback(code):
         except auth.UserNotFoundError:
             # If user is not found, create a new user
             user = auth.create_user(uid=user_id, email=user_email)
-            db.collection("users").document(user.uid).set({"email": user_email})
+            get_db().collection("users").document(user.uid).set({"email": user_email})
 
+        # 로그인 시 새로 조회한 프로필로 캐시 갱신
+        _cache_user_profile(user)
         st.session_state["user"] = user.uid
         return True
     except Exception as e:
@@ -114,6 +127,7 @@ def login_anonymously():
 
 def logout():
     if "user" in st.session_state:
+        invalidate_user_profile(st.session_state["user"])
         del st.session_state["user"]
         st.success("Logged out successfully")
 
@@ -128,15 +142,42 @@ def get_user_id():
     return st.session_state.get("user")
 
 
+def _cache_user_profile(user):
+    profile = {"email": user.email, "display_name": user.display_name}
+    _user_profile_cache.set(user.uid, profile)
+    return profile
+
+
+def get_user_profile(uid):
+    """사용자 프로필(email, display_name)을 캐시에서 조회하고 없으면 Firebase Auth에서 가져옴"""
+    profile = _user_profile_cache.get(uid)
+    if profile is MISSING:
+        profile = _cache_user_profile(get_auth().get_user(uid))
+    return profile
+
+
+def prefetch_user_profiles(uids):
+    """여러 사용자의 프로필을 한 번에 조회해 캐시에 채움"""
+    missing = [uid for uid in uids if _user_profile_cache.get(uid) is MISSING]
+    auth = get_auth()
+    for start in range(0, len(missing), GET_USERS_BATCH_SIZE):
+        batch = missing[start : start + GET_USERS_BATCH_SIZE]
+        result = auth.get_users([auth.UidIdentifier(uid) for uid in batch])
+        for user in result.users:
+            _cache_user_profile(user)
+
+
+def invalidate_user_profile(uid):
+    _user_profile_cache.delete(uid)
+
+
 def get_user_email():
     if check_authentication():
-        user = auth.get_user(st.session_state["user"])
-        return user.email
+        return get_user_profile(st.session_state["user"])["email"]
     return None
 
 
 def get_user_display_name():
     if check_authentication():
-        user = auth.get_user(st.session_state["user"])
-        return user.display_name
+        return get_user_profile(st.session_state["user"])["display_name"]
     return None
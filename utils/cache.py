@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LRUCache:
+    """스레드 안전한 인메모리 LRU 캐시 (항목별 TTL 지원)"""
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry if entry is MISSING else entry[0]
+
+    def get_entry(self, key):
+        """(값, 만료 시각) 또는 MISSING을 반환 (만료 시각이 없으면 None)"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value, expires_at
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """
+    여러 프로세스/세션이 공유할 수 있는 SQLite 기반 디스크 캐시.
+
+    만료/초과 항목 정리는 evict_every번 쓸 때마다 한 번 하므로, 항목 수가 잠시
+    max_entries를 조금 넘을 수 있습니다.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=None, evict_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+            )
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry if entry is MISSING else entry[0]
+
+    def get_entry(self, key):
+        """(값, 만료 시각) 또는 MISSING을 반환 (만료 시각이 없으면 None)"""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return MISSING
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return MISSING
+            self._conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(value), expires_at
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now),
+            )
+            self._writes += 1
+            if self._writes % self.evict_every:
+                return
+            # 만료 항목을 정리하고, 한도를 넘으면 가장 오래 사용되지 않은 항목부터 삭제
+            self._conn.execute(
+                "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (now,),
+            )
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache")
+
+
+class ResponseCache:
+    """
+    결정적인 LLM 호출 결과를 저장하는 2단계 캐시 (메모리 LRU → SQLite).
+
+    키는 호출 종류, 모델, 메시지, 파라미터로 만들어지며 모든 세션이 공유합니다.
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+        self._stats = {"hits": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(namespace, model, messages, params=None):
+        payload = json.dumps(
+            {
+                "namespace": namespace,
+                "model": model,
+                "messages": messages,
+                "params": params or {},
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _backend_ttl(backend, ttl):
+        # 호출에서 정한 TTL과 백엔드 자체 TTL 중 짧은 쪽 (둘 다 없으면 만료 없음)
+        ttls = [t for t in (ttl, backend.ttl) if t]
+        return min(ttls) if ttls else None
+
+    def get(self, key):
+        for index, backend in enumerate(self.backends):
+            entry = backend.get_entry(key)
+            if entry is MISSING:
+                continue
+            value, expires_at = entry
+            # 상위(더 빠른) 캐시에 남은 유효 시간만큼만 채워 넣음
+            remaining = None if expires_at is None else expires_at - time.time()
+            if remaining is None or remaining > 0:
+                for upper in self.backends[:index]:
+                    upper.set(key, value, self._backend_ttl(upper, remaining))
+            self._record("hits")
+            return value
+        self._record("misses")
+        return MISSING
+
+    def set(self, key, value, ttl=None):
+        for backend in self.backends:
+            backend.set(key, value, self._backend_ttl(backend, ttl))
+
+    def clear(self):
+        for backend in self.backends:
+            backend.clear()
+
+    def _record(self, kind):
+        with self._stats_lock:
+            self._stats[kind] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            hits, misses = self._stats["hits"], self._stats["misses"]
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """프로세스 전체에서 공유하는 LLM 응답 캐시를 반환"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            backends = [
+                LRUCache(
+                    max_entries=int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "2048")),
+                    ttl=int(os.getenv("LLM_CACHE_MEMORY_TTL", "3600")),
+                )
+            ]
+            path = os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite3")
+            if path:
+                backends.append(
+                    SQLiteCache(
+                        path,
+                        max_entries=int(os.getenv("LLM_CACHE_DISK_ENTRIES", "50000")),
+                    )
+                )
+            _response_cache = ResponseCache(backends)
+        return _response_cache
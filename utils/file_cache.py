@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils.tokens import count_tokens, get_encoding_name, split_text
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class ExtractedTextCache:
+    """
+    파일 내용의 SHA-256으로 추출 결과를 찾는 디스크 캐시.
+
+    항목마다 추출 텍스트, 토큰 수, (선택) 미리 나눈 조각을 JSON 파일 하나로 저장하고,
+    전체 크기가 max_bytes를 넘으면 가장 오래 사용되지 않은 항목부터 삭제합니다.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def make_key(self, data, *params):
+        suffix = hashlib.sha256(json.dumps(params).encode("utf-8")).hexdigest()[:16]
+        return f"{content_hash(data)}-{suffix}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # 접근 시각을 갱신해 LRU 삭제 순서에 반영
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def set(self, key, entry):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += len(payload) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict(keep=path)
+
+    def get_or_extract(self, key, model, extract):
+        """캐시에 없으면 extract()로 텍스트를 만들어 토큰 수와 함께 저장"""
+        entry = self.get(key)
+        if entry is None:
+            text = extract()
+            entry = {
+                "text": text,
+                "tokens": {get_encoding_name(model): count_tokens(text, model)},
+                "created_at": time.time(),
+            }
+            self.set(key, entry)
+        return entry
+
+    def get_chunks(self, key, entry, model, chunk_tokens, overlap_tokens=0):
+        """미리 나눈 조각이 있으면 재사용하고, 없으면 만들어 항목에 함께 저장"""
+        chunk_key = f"{get_encoding_name(model)}:{chunk_tokens}:{overlap_tokens}"
+        chunks = entry.setdefault("chunks", {})
+        if chunk_key not in chunks:
+            chunks[chunk_key] = split_text(
+                entry["text"], model, chunk_tokens, overlap_tokens
+            )
+            self.set(key, entry)
+        return chunks[chunk_key]
+
+    def _iter_files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    yield os.path.join(root, name)
+
+    def _scan_size(self):
+        total = 0
+        for path in self._iter_files():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def _evict(self, keep):
+        files = []
+        for path in self._iter_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        self._total_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+            except OSError:
+                pass
+
+
+_file_cache = None
+_file_cache_lock = threading.Lock()
+
+
+def get_file_cache():
+    """프로세스 공용 추출 텍스트 캐시를 반환"""
+    global _file_cache
+    with _file_cache_lock:
+        if _file_cache is None:
+            _file_cache = ExtractedTextCache(
+                os.getenv("FILE_CACHE_DIR", ".cache/extracted"),
+                int(os.getenv("FILE_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+            )
+        return _file_cache
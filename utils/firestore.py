@@ -1,70 +1,589 @@
-from firebase_config import db
-from firebase_admin import firestore
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
+from firebase_config import get_db
+from utils.cache import MISSING, LRUCache
+from utils.metrics import record_cache_hit, timed
+from utils.retrieval import delete_index
+from utils.storage import delete_chat_files
+from utils.tokens import count_tokens
+from utils.write_behind import WriteBehindQueue
 
-def get_user_chats(user_id):
-    return (
-        db.collection("users")
-        .document(user_id)
-        .collection("chats")
-        .order_by("created_at", direction=firestore.Query.DESCENDING)
-        .stream()
-    )
+# firestore.Query.DESCENDING과 같은 값 (firebase_admin.firestore를 처음 쓸 때까지 로드하지 않기 위해 문자열 사용)
+DESCENDING = "DESCENDING"
 
+# 삭제 배치 크기 (Firestore 배치 한도)와 병렬 삭제 스레드 수
+DELETE_BATCH_SIZE = 500
+DELETE_WORKERS = 8
 
-def get_chat_history(user_id, chat_id):
-    chat_ref = (
-        db.collection("users")
+_delete_executor = ThreadPoolExecutor(
+    max_workers=DELETE_WORKERS, thread_name_prefix="firestore-delete"
+)
+
+# 사이드바 채팅 목록 페이지 크기와 사용자별 목록 캐시
+CHAT_LIST_PAGE_SIZE = 30
+# 채팅 목록에서 읽는 필드 (메시지 수/최근 활동은 save_message가 채팅 문서에 집계)
+CHAT_LIST_FIELDS = [
+    "summary",
+    "created_at",
+    "message_count",
+    "token_count",
+    "last_message_at",
+    "last_message_preview",
+]
+# 채팅 문서에 저장하는 마지막 메시지 미리보기 길이 (글자 수)
+MESSAGE_PREVIEW_CHARS = 80
+_chat_list_cache = LRUCache(max_entries=4096, ttl=60)
+
+# 채팅 기록 페이지 크기와 프로세스 공용 메시지 캐시
+# (키: (user_id, chat_id)는 채팅의 메시지 목록, (user_id, chat_id, message_id)는 목록 밖에서 읽은 메시지)
+HISTORY_PAGE_SIZE = 50
+_message_cache = LRUCache(max_entries=512, ttl=600)
+
+# 턴마다 필요한 채팅 문서 필드(대화 기억, 검색 인덱스 여부) 캐시 (키: (user_id, chat_id))
+CHAT_STATE_FIELDS = ["memory", "memory_until", "retrieval_index"]
+_chat_state_cache = LRUCache(max_entries=4096, ttl=600)
+
+# 이 프로세스에서 삭제한 채팅 (키: (user_id, chat_id)). 삭제 뒤에 끝난 작업(예: 이미지 생성)의
+# 메시지 저장이 set(merge=True)로 채팅 문서를 다시 만들지 않도록 저장을 건너뜀
+_deleted_chats = LRUCache(max_entries=4096, ttl=24 * 60 * 60)
+_deleted_chats_lock = threading.Lock()
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+_last_provisional_timestamp = None
+
+
+@timed("get_user_chats")
+def get_user_chats_with_metadata(user_id, max_pages=1, page_size=CHAT_LIST_PAGE_SIZE):
+    """
+    사이드바용 채팅 목록을 최근 활동순으로 페이지 단위로 가져옵니다.
+
+    채팅 문서의 요약/집계 필드(CHAT_LIST_FIELDS)만 읽으며, 이미 읽은 페이지는
+    사용자별로 캐시됩니다 (채팅이 바뀌면 캐시를 지움). 페이지는 (last_message_at, 문서 id)
+    값으로 이어 읽으므로 커서에 문서 스냅샷을 들고 있지 않습니다.
+
+    Returns:
+    - (list, bool): 채팅 목록(max_pages 페이지까지)과 더 불러올 채팅이 있는지 여부.
+    """
+    listing = _chat_list_cache.get(user_id)
+    if listing is MISSING or listing["page_size"] != page_size:
+        listing = {"chats": [], "cursor": None, "exhausted": False, "page_size": page_size}
+
+    limit = max_pages * page_size
+    if len(listing["chats"]) < limit and not listing["exhausted"]:
+        chats_ref = get_db().collection("users").document(user_id).collection("chats")
+        chats = list(listing["chats"])
+        seen = {chat["id"] for chat in chats}
+        cursor = listing["cursor"]
+        exhausted = False
+        while len(chats) < limit and not exhausted:
+            query = (
+                chats_ref.order_by("last_message_at", direction=DESCENDING)
+                .order_by("__name__", direction=DESCENDING)
+                .select(CHAT_LIST_FIELDS)
+                .limit(page_size)
+            )
+            if cursor is not None:
+                last_message_at, chat_id = cursor
+                query = query.start_after(
+                    {
+                        "last_message_at": last_message_at,
+                        "__name__": chats_ref.document(chat_id),
+                    }
+                )
+            docs = list(query.stream())
+            # 페이지를 읽는 사이 순서가 바뀐 채팅이 두 번 나오지 않도록 id로 거름
+            for doc in docs:
+                if doc.id not in seen:
+                    seen.add(doc.id)
+                    chats.append({"id": doc.id, **doc.to_dict()})
+            if docs:
+                cursor = (docs[-1].get("last_message_at"), docs[-1].id)
+            exhausted = len(docs) < page_size
+
+        listing = {
+            "chats": chats,
+            "cursor": cursor,
+            "exhausted": exhausted,
+            "page_size": page_size,
+        }
+        _chat_list_cache.set(user_id, listing)
+    else:
+        record_cache_hit()
+
+    has_more = len(listing["chats"]) > limit or not listing["exhausted"]
+    return listing["chats"][:limit], has_more
+
+
+def invalidate_user_chats(user_id):
+    _chat_list_cache.delete(user_id)
+
+
+def _messages_ref(user_id, chat_id):
+    return (
+        get_db().collection("users")
         .document(user_id)
         .collection("chats")
         .document(chat_id)
         .collection("messages")
-        .order_by("timestamp")
     )
-    chats = chat_ref.stream()
-    return [
-        {"role": chat.to_dict()["role"], "message": chat.to_dict()["message"]}
-        for chat in chats
-    ]
 
 
-def save_message(user_id, chat_id, role, message):
-    chat_ref = (
-        db.collection("users")
-        .document(user_id)
-        .collection("chats")
-        .document(chat_id)
-        .collection("messages")
-        .document()
+def _message_from_doc(doc):
+    data = doc.to_dict()
+    return {
+        "id": doc.id,
+        "role": data["role"],
+        "message": data["message"],
+        "timestamp": data.get("timestamp"),
+        "fallback_model": data.get("fallback_model"),
+    }
+
+
+def _merge_messages(messages, new_messages):
+    # 같은 id는 새로 읽은 값(서버 시각)으로 바꿈
+    merged = {message["id"]: message for message in messages}
+    merged.update((message["id"], message) for message in new_messages)
+    return sorted(merged.values(), key=lambda message: message["timestamp"])
+
+
+@timed("get_chat_history")
+def get_chat_history(user_id, chat_id, limit=HISTORY_PAGE_SIZE):
+    """
+    채팅의 최근 메시지 limit개를 오래된 순으로 반환합니다 (limit=None이면 전체).
+
+    메시지는 프로세스 공용 캐시에 보관되며, 캐시가 있으면 마지막으로 읽은 메시지의
+    서버 시각(커밋 시각) 이후의 메시지만 Firestore에서 가져옵니다.
+    """
+    # 이 채팅의 아직 기록되지 않은 메시지가 있으면 먼저 반영 (실패하면 캐시의 임시 값 사용)
+    flush_messages(user_id=user_id, chat_id=chat_id)
+    key = (user_id, chat_id)
+    entry = _message_cache.get(key)
+
+    if entry is MISSING or entry["synced_at"] is None:
+        query = _messages_ref(user_id, chat_id).order_by(
+            "timestamp", direction=DESCENDING
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        messages = [_message_from_doc(doc) for doc in query.stream()][::-1]
+        complete = limit is None or len(messages) < limit
+        synced_at = messages[-1]["timestamp"] if messages else None
+        if entry is not MISSING:
+            messages = _merge_messages(entry["messages"], messages)
+    else:
+        from firebase_admin import firestore
+
+        record_cache_hit()
+        # 서버가 부여한 커밋 시각끼리 비교하므로 클라이언트 시계와 무관
+        delta = [
+            _message_from_doc(doc)
+            for doc in _messages_ref(user_id, chat_id)
+            .where(filter=firestore.FieldFilter("timestamp", ">", entry["synced_at"]))
+            .order_by("timestamp")
+            .stream()
+        ]
+        messages = _merge_messages(entry["messages"], delta)
+        synced_at = delta[-1]["timestamp"] if delta else entry["synced_at"]
+        complete = entry["complete"]
+        if not complete and (limit is None or len(messages) < limit):
+            older, has_more = _load_older_messages(
+                user_id,
+                chat_id,
+                messages[0]["timestamp"] if messages else None,
+                None if limit is None else limit - len(messages),
+            )
+            messages = older + messages
+            complete = not has_more
+
+    _message_cache.set(
+        key,
+        {"messages": messages, "complete": complete, "synced_at": synced_at},
     )
-    chat_ref.set(
-        {"role": role, "message": message, "timestamp": firestore.SERVER_TIMESTAMP}
+    return list(messages if limit is None else messages[-limit:])
+
+
+def _load_older_messages(user_id, chat_id, before_timestamp, page_size):
+    query = _messages_ref(user_id, chat_id).order_by(
+        "timestamp", direction=DESCENDING
+    )
+    if before_timestamp is not None:
+        query = query.start_after({"timestamp": before_timestamp})
+    if page_size is not None:
+        query = query.limit(page_size)
+    page = [_message_from_doc(doc) for doc in query.stream()][::-1]
+    return page, page_size is not None and len(page) == page_size
+
+
+@timed("get_older_messages")
+def get_older_messages(user_id, chat_id, before_timestamp, page_size=HISTORY_PAGE_SIZE):
+    """
+    before_timestamp보다 오래된 메시지를 최대 page_size개 반환합니다.
+
+    Returns:
+    - (list, bool): 오래된 순의 메시지 목록과 더 오래된 메시지가 남아 있는지 여부.
+    """
+    key = (user_id, chat_id)
+    entry = _message_cache.get(key)
+    if entry is not MISSING:
+        cached = [m for m in entry["messages"] if m["timestamp"] < before_timestamp]
+        if len(cached) >= page_size or entry["complete"]:
+            record_cache_hit()
+            return cached[-page_size:], len(cached) > page_size or not entry["complete"]
+
+    page, has_more = _load_older_messages(user_id, chat_id, before_timestamp, page_size)
+
+    # 캐시된 구간과 이어지는 페이지면 캐시에도 붙여 둠
+    if (
+        entry is not MISSING
+        and entry["messages"]
+        and entry["messages"][0]["timestamp"] == before_timestamp
+    ):
+        _message_cache.set(
+            key,
+            {
+                "messages": page + entry["messages"],
+                "complete": not has_more,
+                "synced_at": entry["synced_at"],
+            },
+        )
+    return page, has_more
+
+
+def get_message(user_id, chat_id, message_id):
+    """메시지 하나를 반환 (캐시에 없으면 Firestore에서 읽음, 없으면 None)"""
+    entry = _message_cache.get((user_id, chat_id))
+    if entry is not MISSING:
+        for message in entry["messages"]:
+            if message["id"] == message_id:
+                record_cache_hit()
+                return message
+
+    message_key = (user_id, chat_id, message_id)
+    message = _message_cache.get(message_key)
+    if message is not MISSING:
+        record_cache_hit()
+        return message
+
+    doc_ref = _messages_ref(user_id, chat_id).document(message_id)
+    doc = doc_ref.get()
+    if not doc.exists:
+        # 아직 대기열에 있는 메시지일 수 있으므로 기록한 뒤 다시 읽음
+        flush_messages(user_id=user_id, chat_id=chat_id)
+        doc = doc_ref.get()
+    if not doc.exists:
+        return None
+    message = _message_from_doc(doc)
+    _message_cache.set(message_key, message)
+    return message
+
+
+def _cache_saved_message(user_id, chat_id, message):
+    key = (user_id, chat_id)
+    entry = _message_cache.get(key)
+    if entry is not MISSING:
+        _message_cache.set(
+            key, {**entry, "messages": _merge_messages(entry["messages"], [message])}
+        )
+
+
+def get_write_queue():
+    """메시지 저장에 사용하는 프로세스 공용 write-behind 큐를 반환"""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteBehindQueue(get_db())
+        return _write_queue
+
+
+def _provisional_timestamp():
+    # 저장 시각은 커밋 시 서버가 정하므로, 그 전까지 세션 기록에서 쓸 임시 시각 (단조 증가)
+    global _last_provisional_timestamp
+    with _write_queue_lock:
+        timestamp = datetime.now(timezone.utc)
+        if _last_provisional_timestamp and timestamp <= _last_provisional_timestamp:
+            timestamp = _last_provisional_timestamp + timedelta(microseconds=1)
+        _last_provisional_timestamp = timestamp
+        return timestamp
+
+
+@timed("save_message")
+def save_message(user_id, chat_id, role, message, fallback_model=None):
+    """
+    메시지를 저장 대기열에 넣고 저장될 메시지(id, role, message, timestamp)를 반환합니다.
+    fallback_model은 요청한 모델 대신 답한 대체 모델로, 있을 때만 함께 저장합니다.
+
+    이 프로세스에서 삭제한 채팅이면 저장하지 않습니다.
+
+    timestamp는 SERVER_TIMESTAMP(커밋 시각)로 저장되며, 반환값에는 다시 읽을 때까지 쓸
+    임시 시각이 들어 있습니다. 대기열은 채팅마다 한 배치에 메시지 하나만 커밋하므로
+    채팅 안에서 커밋 시각이 겹치지 않습니다.
+
+    같은 배치에서 채팅 문서의 message_count, token_count, last_message_at,
+    last_message_preview도 함께 갱신하므로 목록 조회 시 메시지를 읽을 필요가 없습니다.
+    """
+    from firebase_admin import firestore
+
+    chat_doc_ref = (
+        get_db().collection("users").document(user_id).collection("chats").document(chat_id)
     )
+    message_ref = chat_doc_ref.collection("messages").document()
+    timestamp = _provisional_timestamp()
+    tokens = count_tokens(message)
+    data = {"role": role, "message": message}
+    if fallback_model is not None:
+        data["fallback_model"] = fallback_model
+    saved = {
+        "id": message_ref.id,
+        "fallback_model": fallback_model,
+        "timestamp": timestamp,
+        **data,
+    }
+    with _deleted_chats_lock:
+        if _deleted_chats.get((user_id, chat_id)) is not MISSING:
+            return dict(saved)
+        get_write_queue().submit(
+            ("set", message_ref, {**data, "timestamp": firestore.SERVER_TIMESTAMP}),
+            (
+                "merge",
+                chat_doc_ref,
+                {
+                    "message_count": firestore.Increment(1),
+                    "token_count": firestore.Increment(tokens),
+                    "last_message_at": firestore.SERVER_TIMESTAMP,
+                    "last_message_preview": message[:MESSAGE_PREVIEW_CHARS],
+                },
+            ),
+            key=(user_id, chat_id),
+        )
+    _cache_saved_message(user_id, chat_id, saved)
+    # 집계 필드는 서버에서 정해지므로 캐시된 목록을 고치지 않고 다시 읽게 함
+    invalidate_user_chats(user_id)
+    return dict(saved)
+
+
+def flush_messages(timeout=None, user_id=None, chat_id=None):
+    """
+    저장 대기 중인 메시지(chat_id를 주면 그 채팅의 메시지만)를 Firestore에 즉시 기록합니다.
+    커밋에 실패해 재시도를 기다리는 메시지가 있으면 False를 반환합니다.
+    """
+    key = (user_id, chat_id) if chat_id is not None else None
+    return get_write_queue().flush(timeout, key=key)
+
+
+def get_write_error(user_id, chat_id):
+    """채팅의 메시지 저장이 실패해 재시도 중이면 마지막 오류, 아니면 None"""
+    if _write_queue is None:
+        return None
+    return _write_queue.failure((user_id, chat_id))
+
+
+def get_write_stats():
+    """write-behind 큐의 대기/재시도 중인 쓰기와 커밋·실패 횟수"""
+    if _write_queue is None:
+        return {
+            "pending": 0,
+            "retrying": 0,
+            "commits": 0,
+            "committed_writes": 0,
+            "commit_failures": 0,
+            "lost_writes": 0,
+        }
+    return _write_queue.stats()
 
 
 def create_new_chat(user_id):
-    chat_ref = db.collection("users").document(user_id).collection("chats").document()
-    chat_ref.set({"created_at": firestore.SERVER_TIMESTAMP})
+    from firebase_admin import firestore
+
+    chat_ref = get_db().collection("users").document(user_id).collection("chats").document()
+    # 목록이 last_message_at 순이므로 메시지가 없는 새 채팅도 생성 시각으로 채워 둠
+    chat_ref.set(
+        {
+            "created_at": firestore.SERVER_TIMESTAMP,
+            "last_message_at": firestore.SERVER_TIMESTAMP,
+            "message_count": 0,
+            "token_count": 0,
+        }
+    )
+    invalidate_user_chats(user_id)
     return chat_ref.id
 
 
-def delete_chat(user_id, chat_id):
-    # 채팅 문서 삭제
-    chat_ref = (
-        db.collection("users").document(user_id).collection("chats").document(chat_id)
+def _iter_message_ref_pages(chat_ref):
+    # 문서 내용은 읽지 않고 참조만 페이지 단위로 가져옴
+    page = []
+    for message_ref in chat_ref.collection("messages").list_documents(
+        page_size=DELETE_BATCH_SIZE
+    ):
+        page.append(message_ref)
+        if len(page) == DELETE_BATCH_SIZE:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def _delete_refs(refs):
+    batch = get_db().batch()
+    for ref in refs:
+        batch.delete(ref)
+    batch.commit()
+
+
+def chat_exists(user_id, chat_id):
+    """채팅 문서가 있는지 (다른 레플리카에서 삭제된 채팅인지 확인할 때 사용)"""
+    return (
+        get_db().collection("users")
+        .document(user_id)
+        .collection("chats")
+        .document(chat_id)
+        .get(field_paths=["created_at"])
+        .exists
     )
 
-    # 채팅에 속한 모든 메시지 삭제
-    messages = chat_ref.collection("messages").get()
-    for msg in messages:
-        msg.reference.delete()
 
-    # 채팅 문서 자체 삭제
-    chat_ref.delete()
+def delete_chats(user_id, chat_ids):
+    """여러 채팅과 그 메시지, 첨부 파일을 배치 단위로 병렬 삭제"""
+    chat_refs = [
+        get_db().collection("users").document(user_id).collection("chats").document(chat_id)
+        for chat_id in chat_ids
+    ]
+
+    # 아직 기록되지 않은 메시지가 삭제 후에 다시 생기지 않도록 정리
+    chat_paths = tuple(chat_ref.path + "/" for chat_ref in chat_refs)
+    chat_doc_paths = {chat_ref.path for chat_ref in chat_refs}
+    queue = get_write_queue()
+    # 표시한 뒤로는 새 쓰기가 대기열에 들어오지 않으므로 아래에서 한 번 정리하면 충분
+    with _deleted_chats_lock:
+        for chat_id in chat_ids:
+            _deleted_chats.set((user_id, chat_id), True)
+
+    def in_deleted_chat(ref):
+        return ref.path.startswith(chat_paths) or ref.path in chat_doc_paths
+
+    queue.discard(in_deleted_chat)
+    for chat_id in chat_ids:
+        # 이미 커밋 중이던 쓰기가 끝나기를 기다리고, 그 사이 실패해 재시도 대기로 간 쓰기도 버림
+        queue.flush(key=(user_id, chat_id))
+    queue.discard(in_deleted_chat)
+
+    futures = []
+    for chat_id, chat_ref in zip(chat_ids, chat_refs):
+        futures.append(_delete_executor.submit(delete_chat_files, user_id, chat_id))
+        futures.append(_delete_executor.submit(delete_index, user_id, chat_id))
+        for page in _iter_message_ref_pages(chat_ref):
+            futures.append(_delete_executor.submit(_delete_refs, page))
+    for future in futures:
+        future.result()
+
+    # 메시지를 모두 지운 뒤 채팅 문서 자체 삭제
+    for start in range(0, len(chat_refs), DELETE_BATCH_SIZE):
+        _delete_refs(chat_refs[start : start + DELETE_BATCH_SIZE])
+    for chat_id in chat_ids:
+        _message_cache.delete((user_id, chat_id))
+        _chat_state_cache.delete((user_id, chat_id))
+    invalidate_user_chats(user_id)
+
+
+def delete_chat(user_id, chat_id):
+    delete_chats(user_id, [chat_id])
 
 
 def update_chat_summary(user_id, chat_id, summary):
     chat_ref = (
-        db.collection("users").document(user_id).collection("chats").document(chat_id)
+        get_db().collection("users").document(user_id).collection("chats").document(chat_id)
     )
     chat_ref.update({"summary": summary})
+    invalidate_user_chats(user_id)
+
+
+def _get_chat_state(user_id, chat_id):
+    key = (user_id, chat_id)
+    state = _chat_state_cache.get(key)
+    if state is MISSING:
+        doc = (
+            get_db().collection("users")
+            .document(user_id)
+            .collection("chats")
+            .document(chat_id)
+            .get(field_paths=CHAT_STATE_FIELDS)
+        )
+        data = doc.to_dict() or {}
+        state = {field: data.get(field) for field in CHAT_STATE_FIELDS}
+        _chat_state_cache.set(key, state)
+    return state
+
+
+def _update_chat_state(user_id, chat_id, fields):
+    chat_ref = (
+        get_db().collection("users").document(user_id).collection("chats").document(chat_id)
+    )
+    chat_ref.update(fields)
+    key = (user_id, chat_id)
+    state = _chat_state_cache.get(key)
+    if state is not MISSING:
+        _chat_state_cache.set(key, {**state, **fields})
+
+
+def get_chat_memory(user_id, chat_id):
+    """
+    채팅 문서에 저장된 대화 기억을 반환합니다.
+
+    Returns:
+    - dict: memory(이전 대화 요약, 없으면 None)와 memory_until(요약에 포함된 마지막 메시지 시각).
+    """
+    state = _get_chat_state(user_id, chat_id)
+    return {"memory": state["memory"], "memory_until": state["memory_until"]}
+
+
+def update_chat_memory(user_id, chat_id, memory, memory_until, memory_token_count):
+    """대화 기억을 저장 (memory_token_count: 기억에 합쳐진 메시지들의 token_count 합계)"""
+    _update_chat_state(
+        user_id,
+        chat_id,
+        {
+            "memory": memory,
+            "memory_until": memory_until,
+            "memory_token_count": memory_token_count,
+        },
+    )
+
+
+def update_memory_token_count(user_id, chat_id, memory_token_count):
+    """이 필드가 생기기 전에 만든 대화 기억에 합쳐진 토큰 수를 기록"""
+    _update_chat_state(user_id, chat_id, {"memory_token_count": memory_token_count})
+
+
+def get_chat_token_counts(user_id, chat_id):
+    """
+    채팅 문서의 토큰 집계를 읽습니다 (메시지마다 바뀌므로 캐시하지 않음).
+
+    Returns:
+    - dict: token_count(저장된 메시지 전체)와 memory_token_count(대화 기억에 합쳐진 부분).
+      기록되지 않은 값은 None.
+    """
+    doc = (
+        get_db().collection("users")
+        .document(user_id)
+        .collection("chats")
+        .document(chat_id)
+        .get(field_paths=["token_count", "memory_token_count"])
+    )
+    data = doc.to_dict() or {}
+    return {
+        "token_count": data.get("token_count"),
+        "memory_token_count": data.get("memory_token_count"),
+    }
+
+
+def has_retrieval_index(user_id, chat_id):
+    """채팅에 첨부 문서 검색 인덱스가 있는지 (없으면 검색을 건너뜀)"""
+    return bool(_get_chat_state(user_id, chat_id)["retrieval_index"])
+
+
+def mark_retrieval_index(user_id, chat_id):
+    """채팅에 검색 인덱스가 생겼음을 채팅 문서에 기록"""
+    if not has_retrieval_index(user_id, chat_id):
+        _update_chat_state(user_id, chat_id, {"retrieval_index": True})
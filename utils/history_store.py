@@ -0,0 +1,242 @@
+"""
+세션별 채팅 기록 저장소.
+
+세션이 연 채팅들의 메시지를 __slots__ 레코드로 보관하고, 채팅 수와 메모리 예산을
+넘으면 가장 오래 사용하지 않은 채팅부터 내보냅니다. 첨부 파일 내용이 들어간 긴 메시지는
+앞부분만 들고 있다가 필요할 때 프로세스 공용 메시지 캐시(없으면 Firestore)에서 다시 읽습니다.
+"""
+
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+from utils.firestore import HISTORY_PAGE_SIZE, get_message
+
+# 세션이 동시에 들고 있는 최대 채팅 수와 기록 메모리 예산 (바이트)
+HISTORY_MAX_CHATS = int(os.getenv("HISTORY_MAX_CHATS", "8"))
+HISTORY_MEMORY_BUDGET = int(os.getenv("HISTORY_MEMORY_BUDGET", str(4 * 1024 * 1024)))
+# 메시지에 첨부 파일 내용을 붙일 때 쓰는 구분자 (modules/chat.py의 inline 첨부 방식)
+ATTACHMENT_CONTENT_HEADER = "\n\nAttached file content:\n"
+# 첨부 내용이 이 글자 수를 넘는 메시지는 본문을 따로 두고 앞부분만 보관
+OUT_OF_LINE_CHARS = 4000
+MESSAGE_PREVIEW_CHARS = 500
+# 예산을 넘어도 현재 채팅에서 남겨 두는 최신 메시지 수
+MIN_RECENT_MESSAGES = 20
+
+_stores = weakref.WeakSet()
+_stores_lock = threading.Lock()
+
+
+class HistoryRecord:
+    """
+    메시지 하나를 담는 레코드. 기존 코드가 쓰던 dict처럼 record["message"],
+    record.get("timestamp")로 읽을 수 있습니다.
+    """
+
+    __slots__ = (
+        "id",
+        "role",
+        "timestamp",
+        "fallback_model",
+        "preview",
+        "token_counts",
+        "size",
+        "_body",
+        "_chat",
+    )
+
+    def __init__(self, chat, message):
+        text = message["message"]
+        self._chat = chat
+        self.id = message.get("id")
+        self.role = sys.intern(message["role"])
+        self.timestamp = message.get("timestamp")
+        self.fallback_model = message.get("fallback_model")
+        self.token_counts = message.get("token_counts")
+        # 저장된 메시지만 다시 읽을 수 있으므로 id가 있을 때만 본문을 밖에 둠
+        attachment = (
+            text.find(ATTACHMENT_CONTENT_HEADER)
+            if self.id is not None and text is not None
+            else -1
+        )
+        if attachment >= 0 and len(text) - attachment > OUT_OF_LINE_CHARS:
+            # 사용자가 쓴 부분은 그대로 두고 첨부 내용만 앞부분을 남김
+            self._body = None
+            self.preview = text[
+                : attachment + len(ATTACHMENT_CONTENT_HEADER) + MESSAGE_PREVIEW_CHARS
+            ]
+        else:
+            self._body = text
+            self.preview = None
+        self.size = sys.getsizeof(self) + sys.getsizeof(self.preview or self._body)
+
+    @property
+    def out_of_line(self):
+        return self.preview is not None
+
+    @property
+    def message(self):
+        if not self.out_of_line:
+            return self._body
+        body = self._chat.load_body(self.id)
+        return self.preview if body is None else body
+
+    def __getitem__(self, key):
+        if key == "message":
+            return self.message
+        if key in ("id", "role", "timestamp", "fallback_model", "token_counts"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        # count_message_tokens가 토큰 수를 레코드에 캐시함
+        if key != "token_counts":
+            raise KeyError(key)
+        self.token_counts = value
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+
+class ChatHistory:
+    """채팅 하나의 메시지 레코드 목록 (오래된 순)"""
+
+    def __init__(self, user_id, chat_id, messages, has_more):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.records = [HistoryRecord(self, message) for message in messages]
+        self.size = sum(record.size for record in self.records)
+        self.has_more = has_more
+        self.summary_created = False
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def append(self, message):
+        record = HistoryRecord(self, message)
+        self.records.append(record)
+        self.size += record.size
+        return record
+
+    def prepend(self, messages):
+        records = [HistoryRecord(self, message) for message in messages]
+        self.records[:0] = records
+        self.size += sum(record.size for record in records)
+
+    def trim(self, max_bytes):
+        """오래된 메시지부터 버려 max_bytes 이하로 줄임 (버린 메시지는 다시 불러올 수 있음)"""
+        count = 0
+        while (
+            self.size > max_bytes
+            and len(self.records) - count > MIN_RECENT_MESSAGES
+        ):
+            self.size -= self.records[count].size
+            count += 1
+        if count:
+            del self.records[:count]
+            self.has_more = True
+        return count
+
+    def load_body(self, message_id):
+        # 같은 채팅의 메시지 캐시를 그대로 사용하므로 본문을 따로 캐시하지 않음
+        message = get_message(self.user_id, self.chat_id, message_id)
+        return message["message"] if message else None
+
+
+class HistoryStore:
+    """세션 하나가 연 채팅들의 기록. 채팅 수와 메모리 예산을 넘으면 LRU로 내보냄"""
+
+    def __init__(self, max_chats=HISTORY_MAX_CHATS, memory_budget=HISTORY_MEMORY_BUDGET):
+        self.max_chats = max_chats
+        self.memory_budget = memory_budget
+        self.evictions = 0
+        self._chats = OrderedDict()
+        with _stores_lock:
+            _stores.add(self)
+
+    def get(self, chat_id):
+        history = self._chats.get(chat_id)
+        if history is not None:
+            self._chats.move_to_end(chat_id)
+        return history
+
+    def load(self, user_id, chat_id, messages):
+        history = ChatHistory(
+            user_id, chat_id, messages, len(messages) >= HISTORY_PAGE_SIZE
+        )
+        self._chats[chat_id] = history
+        self.enforce_budget()
+        return history
+
+    def discard(self, chat_id):
+        self._chats.pop(chat_id, None)
+
+    def enforce_budget(self):
+        """가장 오래 사용하지 않은 채팅부터 내보내고, 그래도 넘으면 현재 채팅의 앞부분을 버림"""
+        while len(self._chats) > 1 and (
+            len(self._chats) > self.max_chats or self.size > self.memory_budget
+        ):
+            self._chats.popitem(last=False)
+            self.evictions += 1
+        if self._chats and self.size > self.memory_budget:
+            next(reversed(self._chats.values())).trim(self.memory_budget)
+
+    @property
+    def size(self):
+        # 지표 스레드에서도 읽으므로 복사본으로 계산
+        return sum(history.size for history in list(self._chats.values()))
+
+    def stats(self):
+        records = [record for history in list(self._chats.values()) for record in history]
+        return {
+            "chats": len(self._chats),
+            "messages": len(records),
+            "out_of_line": sum(record.out_of_line for record in records),
+            "bytes": self.size,
+            "budget": self.memory_budget,
+            "evictions": self.evictions,
+        }
+
+
+def to_messages(messages):
+    """
+    레코드를 이벤트 루프 스레드로 넘길 dict로 바꿈. 밖에 둔 본문은 여기서 (호출 스레드에서)
+    다시 읽고, 토큰 수 캐시는 레코드와 공유합니다.
+    """
+    result = []
+    for message in messages:
+        if isinstance(message, HistoryRecord):
+            if message.token_counts is None:
+                message.token_counts = {}
+            message = {
+                "id": message.id,
+                "role": message.role,
+                "message": message.message,
+                "timestamp": message.timestamp,
+                "token_counts": message.token_counts,
+            }
+        result.append(message)
+    return result
+
+
+def get_history_stats():
+    """살아 있는 세션 저장소 전체의 메모리 사용량 (세션이 끝나면 자동으로 빠짐)"""
+    with _stores_lock:
+        sizes = [store.size for store in list(_stores)]
+    return {
+        "sessions": len(sizes),
+        "bytes": sum(sizes),
+        "max_session_bytes": max(sizes, default=0),
+    }
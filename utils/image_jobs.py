@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from utils.cache import MISSING, LRUCache
+from utils.firestore import chat_exists, save_message
+from utils.llm import image_generation, run_in_background
+from utils.metrics import record_cache_hit, track
+from utils.storage import get_generated_image_url, store_generated_image
+
+# 사용자별 동시 이미지 생성 수
+IMAGE_JOBS_PER_USER = 2
+# 끝난 작업 정보를 보관하는 시간 (초)
+FINISHED_JOB_TTL = 600
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+# 사용자·프롬프트 해시 → 저장된 이미지 URL
+_generated_urls = LRUCache(max_entries=4096)
+# 사용자 → [세마포어, 사용 중인 작업 수]. 작업이 없는 사용자는 지움 (이벤트 루프 스레드에서만 사용)
+_user_slots = {}
+
+
+class ImageJob:
+    def __init__(self, user_id, chat_id, prompt, model, size):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.prompt = prompt
+        self.model = model
+        self.size = size
+        self.status = "queued"
+        self.image_url = None
+        self.error = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    @property
+    def message(self):
+        """채팅 기록에 저장되는 결과 메시지"""
+        if self.image_url is not None:
+            return f"![Generated Image]({self.image_url})"
+        return f"Error generating image: {self.error}"
+
+
+def get_prompt_key(user_id, prompt, model, size):
+    """생성 결과는 같은 사용자의 채팅끼리만 공유 (다른 사용자의 프롬프트가 드러나지 않도록)"""
+    return hashlib.sha256(
+        f"{user_id}|{model}|{size}|{prompt}".encode("utf-8")
+    ).hexdigest()
+
+
+@asynccontextmanager
+async def _user_slot(user_id):
+    slot = _user_slots.get(user_id)
+    if slot is None:
+        slot = _user_slots[user_id] = [asyncio.Semaphore(IMAGE_JOBS_PER_USER), 0]
+    slot[1] += 1
+    try:
+        async with slot[0]:
+            yield
+    finally:
+        slot[1] -= 1
+        if slot[1] == 0:
+            del _user_slots[user_id]
+
+
+async def _generate(job):
+    with track("image_job"):
+        key = get_prompt_key(job.user_id, job.prompt, job.model, job.size)
+        image_url = _generated_urls.get(key)
+        if image_url is MISSING:
+            image_url = await asyncio.to_thread(get_generated_image_url, key)
+        if image_url is None:
+            response = await image_generation(
+                job.model, job.prompt, size=job.size, quality="standard", n=1
+            )
+            # 반환된 URL은 임시 주소이므로 Storage에 옮겨 저장
+            image_url = await asyncio.to_thread(
+                store_generated_image, key, response.data[0].url
+            )
+        else:
+            record_cache_hit()
+        _generated_urls.set(key, image_url)
+        return image_url
+
+
+async def _run_job(job):
+    async with _user_slot(job.user_id):
+        job.status = "running"
+        try:
+            job.image_url = await _generate(job)
+        except Exception as e:
+            job.error = str(e)
+
+    # 사용자가 다른 채팅으로 이동해도 결과가 남도록 작업에서 직접 저장한 뒤 완료 처리
+    # (생성하는 동안 채팅이 삭제됐으면 저장하지 않음. 저장하면 채팅 문서가 다시 생김)
+    try:
+        if await asyncio.to_thread(chat_exists, job.user_id, job.chat_id):
+            await asyncio.to_thread(
+                save_message, job.user_id, job.chat_id, "assistant", job.message
+            )
+    finally:
+        job.finished_at = time.time()
+        job.status = "done" if job.image_url is not None else "failed"
+
+
+def submit_image_job(user_id, chat_id, prompt, model="dall-e-3", size="1024x1024"):
+    """이미지 생성 작업을 백그라운드에 등록하고 작업 ID를 반환"""
+    _prune_finished_jobs()
+    job = ImageJob(user_id, chat_id, prompt, model, size)
+    with _jobs_lock:
+        _jobs[job.id] = job
+    run_in_background(_run_job(job))
+    return job.id
+
+
+def get_image_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def _prune_finished_jobs():
+    cutoff = time.time() - FINISHED_JOB_TTL
+    with _jobs_lock:
+        for job_id in [
+            job_id
+            for job_id, job in _jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]:
+            del _jobs[job_id]
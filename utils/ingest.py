@@ -0,0 +1,242 @@
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+from utils.tokens import count_tokens, truncate_text
+
+# PDF 페이지 추출에 사용할 프로세스 수와 작업 하나가 처리하는 페이지 수
+PDF_WORKERS = max(1, min(4, os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = 8
+
+# CSV를 나눠 읽는 행 수와 컬럼별로 보여줄 최빈값 수
+CSV_CHUNK_ROWS = 10000
+CSV_TOP_VALUES = 3
+# 청크마다 예시로 포함할 최대 행 수
+CSV_SAMPLE_ROWS = 200
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+# 워커 프로세스에서 마지막으로 연 PDF (경로, PdfReader). 같은 문서의 작업은 다시 파싱하지 않음
+_worker_reader = None
+
+
+class TokenBudget:
+    """추출한 텍스트를 토큰 예산 안에서만 모음"""
+
+    def __init__(self, model, max_tokens):
+        self.model = model
+        self.remaining = max_tokens
+        self.parts = []
+        self.truncated = False
+
+    @property
+    def exhausted(self):
+        return self.remaining <= 0
+
+    def add(self, text):
+        """텍스트를 추가하고, 예산이 남아 있으면 True를 반환"""
+        if not text:
+            return not self.exhausted
+        if self.exhausted:
+            self.truncated = True
+            return False
+
+        tokens = count_tokens(text, self.model)
+        if tokens > self.remaining:
+            text = truncate_text(text, self.model, self.remaining)
+            self.truncated = True
+            tokens = self.remaining
+        self.parts.append(text)
+        self.remaining -= tokens
+        return not self.exhausted
+
+    def text(self, separator="\n"):
+        return separator.join(self.parts)
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # Streamlit 프로세스의 스레드 상태를 복제하지 않도록 fork 대신 forkserver 사용
+            method = (
+                "forkserver"
+                if "forkserver" in multiprocessing.get_all_start_methods()
+                else "spawn"
+            )
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context(method),
+            )
+        return _pdf_pool
+
+
+def _extract_pdf_pages(path, start, stop):
+    # 작업마다 PDF 전체를 넘기지 않고 임시 파일 경로만 넘겨, 워커가 문서를 한 번만 읽게 함
+    global _worker_reader
+    import PyPDF2
+
+    if _worker_reader is None or _worker_reader[0] != path:
+        _worker_reader = (path, PyPDF2.PdfReader(path))
+    reader = _worker_reader[1]
+    return [reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+def extract_pdf_text(data, model, max_tokens):
+    """
+    PDF 페이지를 프로세스 풀에서 병렬로 추출하되, 토큰 예산이 차면 남은 페이지는 건너뜁니다.
+    """
+    import PyPDF2
+
+    page_count = len(PyPDF2.PdfReader(io.BytesIO(data)).pages)
+    ranges = [
+        (start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+
+    pool = _get_pdf_pool()
+    budget = TokenBudget(model, max_tokens)
+    pending = []
+    next_range = 0
+    pages_read = 0
+
+    # 워커는 경로로 문서를 구분하므로 경로가 다시 쓰이지 않도록 고유한 이름 사용
+    with tempfile.NamedTemporaryFile(
+        prefix=f"pdf-{uuid.uuid4().hex}-", suffix=".pdf", delete=False
+    ) as f:
+        f.write(data)
+        path = f.name
+    try:
+        # 예산을 넘길 페이지까지 미리 추출하지 않도록 동시에 제출하는 작업 수를 제한
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < PDF_WORKERS * 2:
+                pending.append(pool.submit(_extract_pdf_pages, path, *ranges[next_range]))
+                next_range += 1
+
+            pages = pending.pop(0).result()
+            pages_read += len(pages)
+            if not all(budget.add(page) for page in pages):
+                break
+
+        for future in pending:
+            future.cancel()
+    finally:
+        # 이미 실행 중이던 작업이 파일을 못 찾아 실패해도 결과는 쓰지 않으므로 기다리지 않음
+        os.remove(path)
+
+    text = budget.text()
+    if budget.truncated or pages_read < page_count:
+        text += f"\n\n[토큰 한도로 {page_count}페이지 중 일부만 포함됨]"
+    return text
+
+
+def summarize_csv(file, model, max_tokens):
+    """
+    CSV를 청크 단위로 읽어 전체를 출력하는 대신 컬럼 타입/통계 요약과 앞부분 행을 만듭니다.
+    """
+    import pandas as pd
+
+    row_count = 0
+    dtypes = None
+    null_counts = None
+    numeric_stats = {}
+    value_counts = {}
+    sample_rows = TokenBudget(model, max_tokens // 2)
+    header = None
+
+    for chunk in pd.read_csv(file, chunksize=CSV_CHUNK_ROWS):
+        row_count += len(chunk)
+        if dtypes is None:
+            dtypes = chunk.dtypes
+            null_counts = chunk.isna().sum()
+            header = ",".join(str(column) for column in chunk.columns)
+        else:
+            null_counts = null_counts.add(chunk.isna().sum(), fill_value=0)
+
+        for column in chunk.columns:
+            series = chunk[column]
+            if pd.api.types.is_numeric_dtype(series):
+                stats = numeric_stats.setdefault(
+                    column, {"min": None, "max": None, "sum": 0.0, "count": 0}
+                )
+                non_null = series.dropna()
+                if non_null.empty:
+                    continue
+                chunk_min, chunk_max = non_null.min(), non_null.max()
+                if stats["min"] is None:
+                    stats["min"], stats["max"] = chunk_min, chunk_max
+                else:
+                    stats["min"] = min(stats["min"], chunk_min)
+                    stats["max"] = max(stats["max"], chunk_max)
+                stats["sum"] += float(non_null.sum())
+                stats["count"] += int(non_null.count())
+            else:
+                counts = value_counts.setdefault(column, {})
+                for value, count in series.value_counts().head(100).items():
+                    counts[value] = counts.get(value, 0) + int(count)
+
+        if not sample_rows.exhausted:
+            sample_rows.add(chunk.head(CSV_SAMPLE_ROWS).to_csv(index=False, header=False))
+
+    if dtypes is None:
+        return "빈 CSV 파일입니다."
+
+    lines = [f"행 수: {row_count}, 열 수: {len(dtypes)}", "", "컬럼 요약:"]
+    for column, dtype in dtypes.items():
+        line = f"- {column} ({dtype}), 결측 {int(null_counts[column])}개"
+        if column in numeric_stats and numeric_stats[column]["count"]:
+            stats = numeric_stats[column]
+            line += (
+                f", 최소 {stats['min']}, 최대 {stats['max']}, "
+                f"평균 {stats['sum'] / stats['count']:.4g}"
+            )
+        elif column in value_counts:
+            top = sorted(value_counts[column].items(), key=lambda item: -item[1])
+            line += ", 주요 값: " + ", ".join(
+                f"{value}({count})" for value, count in top[:CSV_TOP_VALUES]
+            )
+        lines.append(line)
+
+    summary = TokenBudget(model, max_tokens)
+    summary.add("\n".join(lines))
+    summary.add(f"\n데이터 (앞부분):\n{header}\n{sample_rows.text('')}")
+    text = summary.text()
+    if sample_rows.truncated or summary.truncated:
+        text += "\n[토큰 한도로 일부 행만 포함됨]"
+    return text
+
+
+def iter_docx_paragraphs(file):
+    """DOCX 본문을 전체 문서를 메모리에 올리지 않고 문단 단위로 yield"""
+    with zipfile.ZipFile(file) as archive:
+        with archive.open("word/document.xml") as document:
+            for _, element in ElementTree.iterparse(document, events=("end",)):
+                if element.tag == f"{WORD_NAMESPACE}p":
+                    yield "".join(
+                        node.text or "" for node in element.iter(f"{WORD_NAMESPACE}t")
+                    )
+                    element.clear()
+
+
+def extract_docx_text(file, model, max_tokens):
+    budget = TokenBudget(model, max_tokens)
+    try:
+        for paragraph in iter_docx_paragraphs(file):
+            if not budget.add(paragraph):
+                break
+    except zipfile.BadZipFile:
+        # 구형 .doc(바이너리) 형식은 지원하지 않음
+        return "Unsupported Word file format. Please upload a .docx file."
+
+    text = budget.text()
+    if budget.truncated:
+        text += "\n\n[토큰 한도로 문서 일부만 포함됨]"
+    return text
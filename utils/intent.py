@@ -0,0 +1,180 @@
+import math
+import re
+import threading
+from collections import Counter
+
+# 이미지 생성 요청으로 확실히 볼 수 있는 패턴: 시각적 대상(그림/image/picture…)과 함께 쓴 명령형만
+# ("그려", "draw"처럼 동사만 있으면 "Draw a conclusion…"처럼 다른 뜻일 수 있어 분류기/LLM이 판단)
+IMAGE_REQUEST_PATTERNS = [
+    re.compile(p, re.IGNORECASE)
+    for p in [
+        r"(그림|이미지|사진|일러스트|로고|아이콘|초상화|배경화면|캐릭터).{0,12}(그려|만들어)\s*(줘|주세요|줄래|줄\s*수|봐|달라)",
+        r"^\s*(please\s+|(can|could|would|will) you\s+)?(draw|paint|sketch|illustrate|generate|create|make|design|produce|show me)\b.{0,30}\b(image|picture|photo|drawing|illustration|logo|icon|portrait|wallpaper|painting)\b",
+        r"^\s*(an?\s+)?(image|picture|photo|illustration|painting|drawing)\s+of\b",
+    ]
+]
+
+# 이미지 생성 요청이 아님이 확실한 패턴 (이미지에 대한 질문/설명 등)
+NON_IMAGE_PATTERNS = [
+    re.compile(p, re.IGNORECASE)
+    for p in [
+        r"(그림|이미지|사진).{0,10}(설명|분석|요약|뭐|무엇|어떤|있는)",
+        r"\b(what|explain|describe|analy[sz]e|summari[sz]e)\b.{0,30}\b(image|picture|photo)\b",
+        r"\b(how|why) (do|does|to|is|are)\b",
+        r"(코드|함수|에러|오류|번역|요약|설명해)",
+        r"\b(code|function|error|bug|translate|summari[sz]e)\b",
+    ]
+]
+
+# 시각적 표현과 관련된 단어. 하나도 없으면 이미지 생성 요청이 아닌 것으로 판단
+VISUAL_CUE_PATTERN = re.compile(
+    r"그림|그려|이미지|사진|일러스트|로고|아이콘|초상화|배경화면|캐릭터|풍경|수채화|유화|스케치|만화|애니|픽셀|렌더|"
+    r"\b(image|picture|photo|drawing|illustration|logo|icon|portrait|wallpaper|painting|art|artwork|draw|paint|dall-?e|"
+    r"style|render|sketch|cartoon|anime|pixel|watercolor|photorealistic|avatar|poster|scene)s?\b",
+    re.IGNORECASE,
+)
+
+# 나이브 베이즈 분류기 학습용 예문 (True: 이미지 생성 요청)
+TRAINING_EXAMPLES = [
+    ("고양이 그림 그려줘", True),
+    ("바다 위의 일몰 이미지를 만들어줘", True),
+    ("우주 비행사 캐릭터 생성해줘", True),
+    ("귀여운 강아지 사진 하나 만들어 줄래", True),
+    ("판타지 풍경화 그려 주세요", True),
+    ("회사 로고 디자인해줘", True),
+    ("수채화 느낌으로 꽃을 표현해줘", True),
+    ("사이버펑크 도시 배경화면 만들어줘", True),
+    ("a watercolor painting of a fox in the snow", True),
+    ("draw a cat wearing a hat", True),
+    ("generate an image of a futuristic city", True),
+    ("create a logo for my coffee shop", True),
+    ("make a picture of a dragon", True),
+    ("an illustration of a robot reading a book", True),
+    ("photorealistic portrait of an old sailor", True),
+    ("cartoon style avatar for my profile", True),
+    ("파이썬으로 리스트 정렬하는 방법 알려줘", False),
+    ("이 문장 영어로 번역해줘", False),
+    ("오늘 날씨 어때", False),
+    ("이 이미지에 뭐가 있는지 설명해줘", False),
+    ("회의록 요약해줘", False),
+    ("양자역학이 뭐야", False),
+    ("이메일 초안 작성해줘", False),
+    ("맛있는 김치찌개 레시피 알려줘", False),
+    ("explain how transformers work", False),
+    ("write a python function to reverse a string", False),
+    ("what is in this picture", False),
+    ("summarize this document for me", False),
+    ("help me write a cover letter", False),
+    ("what's the capital of france", False),
+    ("fix this error in my code", False),
+    ("tell me a joke", False),
+    # 그리기 동사나 시각적 단어가 들어 있지만 이미지 생성 요청이 아닌 예
+    ("What paint should I use for my bathroom walls?", False),
+    ("Draw a conclusion from this essay", False),
+    ("Can you sketch out a plan for my project?", False),
+    ("사진 보여줘", False),
+    ("이미지 생성 모델 추천해줘", False),
+]
+
+# 분류기가 이 확률 범위 밖이면 확신, 안이면 LLM으로 위임
+CONFIDENT_LOW = 0.15
+CONFIDENT_HIGH = 0.85
+
+_TOKEN_PATTERN = re.compile(r"[a-z]+|[가-힣]+", re.IGNORECASE)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _tokenize(text):
+    features = []
+    for word in _TOKEN_PATTERN.findall(text.lower()):
+        if word[0] <= "z":
+            features.append(word)
+        else:
+            # 한글은 조사/어미 변화가 많아 글자 bigram을 특징으로 사용
+            features.extend(word[i : i + 2] for i in range(max(len(word) - 1, 1)))
+    return features
+
+
+class NaiveBayesIntentModel:
+    def __init__(self, examples):
+        self.word_counts = {True: Counter(), False: Counter()}
+        self.doc_counts = Counter()
+        for text, label in examples:
+            self.doc_counts[label] += 1
+            self.word_counts[label].update(_tokenize(text))
+        self.vocabulary = set(self.word_counts[True]) | set(self.word_counts[False])
+        self.totals = {label: sum(c.values()) for label, c in self.word_counts.items()}
+
+    def predict_proba(self, text):
+        """이미지 생성 요청일 확률을 반환"""
+        features = [f for f in _tokenize(text) if f in self.vocabulary]
+        if not features:
+            return 0.5
+
+        vocab_size = len(self.vocabulary)
+        total_docs = sum(self.doc_counts.values())
+        log_probs = {}
+        for label in (True, False):
+            log_prob = math.log(self.doc_counts[label] / total_docs)
+            for feature in features:
+                log_prob += math.log(
+                    (self.word_counts[label][feature] + 1)
+                    / (self.totals[label] + vocab_size)
+                )
+            log_probs[label] = log_prob
+
+        diff = log_probs[False] - log_probs[True]
+        if diff > 50:
+            return 0.0
+        return 1 / (1 + math.exp(diff))
+
+
+_model = NaiveBayesIntentModel(TRAINING_EXAMPLES)
+
+
+def classify_image_request(prompt):
+    """
+    로컬에서 이미지 생성 요청 여부를 판별합니다.
+
+    Returns:
+    - True/False: 확신할 수 있는 경우의 판별 결과.
+    - None: 확신할 수 없어 LLM 판별이 필요한 경우.
+    """
+    # 첨부 파일 내용은 판별에서 제외
+    text = prompt.split("\n\nAttached file content:", 1)[0]
+
+    is_non_image = any(p.search(text) for p in NON_IMAGE_PATTERNS)
+    is_image = any(p.search(text) for p in IMAGE_REQUEST_PATTERNS)
+    if is_non_image and is_image:
+        # "이 함수의 흐름도를 그려줘"처럼 양쪽이 모두 맞으면 LLM이 판단
+        decision = None
+    elif is_non_image:
+        decision = False
+    elif is_image:
+        decision = True
+    elif not VISUAL_CUE_PATTERN.search(text):
+        decision = False
+    else:
+        probability = _model.predict_proba(text)
+        if probability >= CONFIDENT_HIGH:
+            decision = True
+        elif probability <= CONFIDENT_LOW:
+            decision = False
+        else:
+            decision = None
+
+    _record_decision("fallback" if decision is None else "local_hit")
+    return decision
+
+
+def _record_decision(kind):
+    with _stats_lock:
+        _stats[kind] += 1
+
+
+def get_intent_stats():
+    """로컬 판별 적중/LLM 위임 횟수를 반환"""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,262 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+
+import httpx
+
+from utils.metrics import current_call, record_usage
+from utils.ratelimit import RateLimitScheduler
+from utils.tokens import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+# Groq에서 서빙하는 모델 (나머지는 OpenAI)
+GROQ_MODELS = {"llama-3.1-8b-instant"}
+
+# 프로바이더별 동시 요청 수 제한
+PROVIDER_CONCURRENCY = {
+    "openai": int(os.getenv("OPENAI_MAX_CONCURRENCY", "32")),
+    "groq": int(os.getenv("GROQ_MAX_CONCURRENCY", "16")),
+}
+
+REQUEST_TIMEOUT = httpx.Timeout(
+    float(os.getenv("LLM_REQUEST_TIMEOUT", "120")), connect=10.0
+)
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+# max_tokens를 지정하지 않은 요청의 응답 토큰 추정치 (토큰 버킷 차감용)
+DEFAULT_COMPLETION_TOKENS = 500
+# 이보다 긴 프롬프트는 이벤트 루프를 막지 않도록 워커 스레드에서 토큰을 셈
+INLINE_COUNT_CHARS = 2000
+
+logger = logging.getLogger(__name__)
+
+_loop = None
+_loop_lock = threading.Lock()
+
+# 아래 객체들은 모두 이벤트 루프 스레드에서만 생성/사용됨
+_clients = {}
+_semaphores = {}
+_scheduler = None
+
+# 요청을 보낸 사용자 (사용자 간 공정한 대기열에 사용)
+current_user_id = contextvars.ContextVar("current_user_id", default=None)
+
+
+def get_event_loop():
+    """모든 세션이 공유하는 백그라운드 이벤트 루프를 반환 (최초 호출 시 시작)"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="llm-event-loop", daemon=True
+            ).start()
+            _loop = loop
+        return _loop
+
+
+def set_current_user(user_id):
+    """이 스레드에서 이후 보내는 LLM 요청의 사용자를 지정"""
+    current_user_id.set(user_id)
+
+
+def _with_current_user(coro):
+    # 이벤트 루프 스레드의 태스크는 호출한 스레드의 컨텍스트를 물려받지 않으므로 직접 전달
+    user_id = current_user_id.get()
+
+    async def runner():
+        current_user_id.set(user_id)
+        return await coro
+
+    return runner()
+
+
+def run_sync(coro):
+    """코루틴을 공유 이벤트 루프에서 실행하고 결과를 기다림"""
+    return asyncio.run_coroutine_threadsafe(
+        _with_current_user(coro), get_event_loop()
+    ).result()
+
+
+def iterate_sync(async_gen):
+    """비동기 제너레이터를 동기 제너레이터로 변환"""
+    try:
+        while True:
+            try:
+                yield run_sync(async_gen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        run_sync(async_gen.aclose())
+
+
+def provider_for_model(model):
+    return "groq" if model in GROQ_MODELS else "openai"
+
+
+def get_client(provider):
+    if provider not in _clients:
+        http_client = httpx.AsyncClient(limits=POOL_LIMITS, timeout=REQUEST_TIMEOUT)
+        if provider == "groq":
+            from groq import AsyncGroq
+
+            _clients[provider] = AsyncGroq(
+                api_key=os.getenv("GROQ_API_KEY"),
+                http_client=http_client,
+                timeout=REQUEST_TIMEOUT,
+                # 재시도는 RateLimitScheduler가 담당
+                max_retries=0,
+            )
+        else:
+            from openai import AsyncOpenAI
+
+            _clients[provider] = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=http_client,
+                timeout=REQUEST_TIMEOUT,
+                max_retries=0,
+            )
+    return _clients[provider]
+
+
+def _get_semaphore(provider):
+    if provider not in _semaphores:
+        _semaphores[provider] = asyncio.Semaphore(PROVIDER_CONCURRENCY[provider])
+    return _semaphores[provider]
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RateLimitScheduler()
+    return _scheduler
+
+
+def _message_texts(messages):
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content)
+        yield content or ""
+
+
+def _count_prompt_tokens(model, messages):
+    return sum(
+        MESSAGE_OVERHEAD_TOKENS + count_tokens(text, model)
+        for text in _message_texts(messages)
+    )
+
+
+async def _estimate_tokens(model, messages, params, prompt_tokens=None):
+    """
+    요청이 소비할 토큰 수를 프롬프트 길이와 max_tokens로 추정합니다. 호출자가 캐시된
+    토큰 수(prompt_tokens)를 넘기면 그대로 쓰고, 긴 프롬프트는 워커 스레드에서 셉니다.
+    """
+    if prompt_tokens is None:
+        if sum(len(text) for text in _message_texts(messages)) > INLINE_COUNT_CHARS:
+            prompt_tokens = await asyncio.to_thread(_count_prompt_tokens, model, messages)
+        else:
+            prompt_tokens = _count_prompt_tokens(model, messages)
+    return prompt_tokens + (params.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+
+async def _tokens_to_reserve(model, messages, params, prompt_tokens=None):
+    # 토큰 한도가 설정되지 않은 모델이면 프롬프트를 세지 않음
+    if not get_scheduler().limits_tokens(model):
+        return 0
+    return await _estimate_tokens(model, messages, params, prompt_tokens)
+
+
+async def chat_completion(model, messages, prompt_tokens=None, **params):
+    """prompt_tokens: 호출자가 이미 센 프롬프트 토큰 수 (한도 차감용, API로는 보내지 않음)"""
+    provider = provider_for_model(model)
+
+    async def create():
+        async with _get_semaphore(provider):
+            return await get_client(provider).chat.completions.create(
+                model=model, messages=messages, **params
+            )
+
+    response = await get_scheduler().run(
+        model,
+        create,
+        estimated_tokens=await _tokens_to_reserve(model, messages, params, prompt_tokens),
+        user_id=current_user_id.get(),
+    )
+    record_usage(getattr(response, "usage", None))
+    return response
+
+
+async def stream_chat_completion(model, messages, prompt_tokens=None, **params):
+    """응답 텍스트 조각(delta)을 yield하는 비동기 제너레이터"""
+    provider = provider_for_model(model)
+    semaphore = _get_semaphore(provider)
+    # 제너레이터는 매 단계 다른 태스크에서 실행될 수 있으므로 측정 대상을 시작 시점에 잡아둠
+    call = current_call()
+    stream_params = dict(params)
+    if provider == "openai":
+        # 마지막 청크로 토큰 사용량을 받음 (Groq는 x_groq.usage로 제공)
+        stream_params["stream_options"] = {"include_usage": True}
+
+    async def create():
+        # 스트림을 다 읽을 때까지 동시 요청 슬롯을 유지
+        await semaphore.acquire()
+        try:
+            return await get_client(provider).chat.completions.create(
+                model=model, messages=messages, stream=True, **stream_params
+            )
+        except BaseException:
+            semaphore.release()
+            raise
+
+    # 재시도는 첫 응답 조각을 받기 전(요청 생성 단계)에서만 일어남
+    scheduler = get_scheduler()
+    estimated_tokens = await _tokens_to_reserve(model, messages, params, prompt_tokens)
+    stream = await scheduler.run(
+        model,
+        create,
+        estimated_tokens=estimated_tokens,
+        user_id=current_user_id.get(),
+    )
+    try:
+        async for chunk in stream:
+            usage = getattr(chunk, "usage", None) or getattr(
+                getattr(chunk, "x_groq", None), "usage", None
+            )
+            if usage is not None:
+                if call is not None:
+                    call.add_usage(usage)
+                if getattr(usage, "total_tokens", None):
+                    scheduler.record_usage(model, estimated_tokens, usage.total_tokens)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    finally:
+        semaphore.release()
+
+
+async def image_generation(model, prompt, **params):
+    async def create():
+        async with _get_semaphore("openai"):
+            return await get_client("openai").images.generate(
+                model=model, prompt=prompt, **params
+            )
+
+    return await get_scheduler().run(model, create, user_id=current_user_id.get())
+
+
+def run_in_background(coro):
+    """코루틴을 공유 이벤트 루프에 예약만 하고 바로 반환"""
+    future = asyncio.run_coroutine_threadsafe(
+        _with_current_user(coro), get_event_loop()
+    )
+    future.add_done_callback(_log_background_failure)
+    return future
+
+
+def _log_background_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Background task failed", exc_info=future.exception())
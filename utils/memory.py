@@ -0,0 +1,223 @@
+import asyncio
+import threading
+
+from openai_api import get_context_token_budget, update_memory_async
+from utils.firestore import (
+    HISTORY_PAGE_SIZE,
+    flush_messages,
+    get_chat_history,
+    get_chat_memory,
+    get_chat_token_counts,
+    get_older_messages,
+    update_chat_memory,
+    update_memory_token_count,
+)
+from utils.llm import run_in_background
+from utils.tokens import count_message_tokens, count_tokens
+
+# 요약되지 않은 대화가 모델 컨텍스트 예산의 이 비율을 넘으면 오래된 부분을 대화 기억(요약)에 합침
+COMPACTION_TRIGGER_SHARE = 0.4
+# 압축 후에도 원문 그대로 보내는 최신 대화의 비율
+RECENT_TAIL_SHARE = 0.15
+# 한 번의 압축에서 요약에 합치는 최대 토큰 수 (긴 기존 채팅은 여러 턴에 걸쳐 나눠 합침)
+COMPACTION_BATCH_TOKENS = 16000
+# 대화 기억의 최대 길이와 요약에 사용하는 모델 (토큰 수도 이 모델 기준으로 셈)
+MEMORY_MAX_TOKENS = 800
+MEMORY_MODEL = "gpt-4o-mini"
+
+_compacting = set()
+_compacting_lock = threading.Lock()
+
+
+def _unfolded_messages(chat_history, memory_until):
+    """아직 대화 기억에 합쳐지지 않은 메시지"""
+    return [
+        message
+        for message in chat_history
+        if message["message"] is not None
+        and (
+            memory_until is None
+            or message.get("timestamp") is None
+            or message["timestamp"] > memory_until
+        )
+    ]
+
+
+def build_memory_message(memory):
+    return {"role": "system", "message": f"이전 대화 요약:\n{memory}"}
+
+
+def build_turn_history(chat_history, memory):
+    """
+    모델에 보낼 대화를 만듭니다. 대화 기억이 있으면 기억과 그 이후의 메시지만 사용하므로
+    채팅이 길어져도 턴당 프롬프트 크기가 일정 범위 안에 머뭅니다.
+    """
+    if not memory.get("memory"):
+        return chat_history
+    return [build_memory_message(memory["memory"])] + _unfolded_messages(
+        chat_history, memory["memory_until"]
+    )
+
+
+def load_turn_history(user_id, chat_id, chat_history, model):
+    """
+    대화 기억과 그 이후의 메시지로 모델에 보낼 대화를 만듭니다. 세션에 불러 둔 페이지만으로
+    모델 컨텍스트가 차지 않으면, 기억에 합쳐지지 않은 이전 메시지를 컨텍스트가 찰 때까지
+    더 읽습니다 (세션 기록에는 넣지 않으며, 읽은 페이지는 메시지 캐시에 남음).
+    """
+    memory = get_chat_memory(user_id, chat_id)
+    memory_until = memory["memory_until"] if memory.get("memory") else None
+    messages = list(chat_history)
+    has_more = getattr(chat_history, "has_more", False)
+    budget = get_context_token_budget(model)
+    while has_more and messages and messages[0].get("timestamp") is not None:
+        oldest = messages[0]["timestamp"]
+        if memory_until is not None and oldest <= memory_until:
+            break
+        if sum(count_message_tokens(message, model) for message in messages) >= budget:
+            break
+        older, has_more = get_older_messages(user_id, chat_id, oldest)
+        messages = older + messages
+    return build_turn_history(messages, memory)
+
+
+def get_compaction_thresholds(model):
+    """
+    모델의 컨텍스트 예산에 맞춘 압축 기준.
+
+    Returns:
+    - (int, int): 압축을 시작하는 토큰 수와 원문으로 남기는 최신 대화의 토큰 수.
+    """
+    budget = get_context_token_budget(model)
+    return int(budget * COMPACTION_TRIGGER_SHARE), int(budget * RECENT_TAIL_SHARE)
+
+
+def _select_messages_to_fold(messages, model):
+    trigger_tokens, tail_limit = get_compaction_thresholds(model)
+    tokens = [count_message_tokens(message, model) for message in messages]
+    if sum(tokens) <= trigger_tokens:
+        return []
+
+    # 최신 메시지는 tail_limit 토큰만큼 원문으로 남김
+    split = len(messages)
+    tail_tokens = 0
+    while split > 0 and tail_tokens + tokens[split - 1] <= tail_limit:
+        split -= 1
+        tail_tokens += tokens[split]
+
+    fold = []
+    fold_tokens = 0
+    for message, message_tokens in zip(messages[:split], tokens):
+        if fold and fold_tokens + message_tokens > COMPACTION_BATCH_TOKENS:
+            break
+        fold.append(message)
+        fold_tokens += message_tokens
+
+    # 경계는 저장 시각으로 기록하므로 시각이 없는 메시지에서 끝나지 않게 함
+    while fold and fold[-1].get("timestamp") is None:
+        fold.pop()
+    return fold
+
+
+def _load_unfolded_messages(user_id, chat_id, memory_until):
+    """
+    대화 기억에 아직 합쳐지지 않은 메시지를 모두 읽습니다. 세션에 불러 둔 페이지가 아니라
+    저장된 기록(공용 메시지 캐시와 Firestore)에서 읽으므로 세션에 없는 이전 메시지도 포함됩니다.
+    """
+    messages = get_chat_history(user_id, chat_id)
+    has_more = len(messages) >= HISTORY_PAGE_SIZE
+    while has_more and messages and (
+        memory_until is None or messages[0]["timestamp"] > memory_until
+    ):
+        older, has_more = get_older_messages(user_id, chat_id, messages[0]["timestamp"])
+        messages = older + messages
+    return _unfolded_messages(messages, memory_until)
+
+
+def _plan_compaction(user_id, chat_id, model):
+    """
+    대화 기억에 합칠 메시지를 정합니다. 채팅 문서의 토큰 집계(전체 - 이미 합친 부분)로 먼저
+    판단하고, 기준을 넘을 때만 저장된 기록을 읽습니다.
+
+    Returns:
+    - (dict, list, int) 또는 None: 현재 대화 기억, 합칠 메시지, 이미 합쳐진 토큰 수.
+    """
+    # 아직 기록되지 않은 메시지까지 집계에 반영
+    flush_messages(user_id=user_id, chat_id=chat_id)
+    memory = get_chat_memory(user_id, chat_id)
+    counts = get_chat_token_counts(user_id, chat_id)
+    folded_tokens = counts["memory_token_count"] if memory["memory"] else 0
+    trigger_tokens, _ = get_compaction_thresholds(model)
+    if (
+        counts["token_count"] is not None
+        and folded_tokens is not None
+        and counts["token_count"] - folded_tokens <= trigger_tokens
+    ):
+        return None
+
+    messages = _load_unfolded_messages(user_id, chat_id, memory["memory_until"])
+    if folded_tokens is None:
+        # 합친 토큰 수를 기록하기 전에 만든 대화 기억이면 지금 읽은 기록으로 한 번 계산해 둠
+        folded_tokens = max(
+            0,
+            (counts["token_count"] or 0)
+            - sum(count_tokens(message["message"]) for message in messages),
+        )
+        update_memory_token_count(user_id, chat_id, folded_tokens)
+
+    fold = _select_messages_to_fold(messages, model)
+    if not fold:
+        return None
+    return memory, fold, folded_tokens
+
+
+async def _compact(user_id, chat_id, model):
+    try:
+        plan = await asyncio.to_thread(_plan_compaction, user_id, chat_id, model)
+        if plan is None:
+            return
+        memory, fold, folded_tokens = plan
+        new_memory = await update_memory_async(
+            memory["memory"], fold, MEMORY_MODEL, MEMORY_MAX_TOKENS
+        )
+        # 채팅 문서의 token_count와 같은 방식으로 센 토큰 수를 더해 둠
+        folded_tokens += sum(count_tokens(message["message"]) for message in fold)
+        await asyncio.to_thread(
+            update_chat_memory,
+            user_id,
+            chat_id,
+            new_memory,
+            fold[-1]["timestamp"],
+            folded_tokens,
+        )
+    finally:
+        with _compacting_lock:
+            _compacting.discard((user_id, chat_id))
+
+
+def compact_in_background(user_id, chat_id, chat_history, model):
+    """
+    요약되지 않은 대화가 model의 기준을 넘으면 오래된 메시지를 대화 기억에 합치는 작업을
+    백그라운드에서 시작합니다. 채팅마다 한 번에 하나의 작업만 실행됩니다.
+    """
+    memory = get_chat_memory(user_id, chat_id)
+    memory_until = memory["memory_until"]
+    # 세션 기록이 합쳐지지 않은 메시지를 모두 담고 있으면 여기서 바로 판단하고,
+    # 아니면 백그라운드에서 채팅 문서의 토큰 집계로 판단
+    covered = not chat_history.has_more or (
+        memory_until is not None
+        and len(chat_history) > 0
+        and chat_history[0].get("timestamp") is not None
+        and chat_history[0]["timestamp"] <= memory_until
+    )
+    if covered and not _select_messages_to_fold(
+        _unfolded_messages(chat_history, memory_until), model
+    ):
+        return None
+
+    key = (user_id, chat_id)
+    with _compacting_lock:
+        if key in _compacting:
+            return None
+        _compacting.add(key)
+    return run_in_background(_compact(user_id, chat_id, model))
@@ -0,0 +1,405 @@
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+# 지연 시간 히스토그램 구간 경계 (초)
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+
+# 호출별 기록을 JSON Lines로 남길 파일 (빈 값이면 기록하지 않음)
+METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH", ".cache/metrics.jsonl")
+METRICS_LOG_MAX_BYTES = 10 * 1024 * 1024
+METRICS_LOG_BACKUPS = 3
+# 설정하면 이 포트에서 Prometheus 텍스트 형식으로 /metrics를 제공
+METRICS_PORT = os.getenv("METRICS_PORT")
+
+
+class LatencyHistogram:
+    """고정 구간 지연 시간 히스토그램 (Prometheus histogram과 같은 구간 방식)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, q):
+        """q(0~1) 백분위수를 구간 안에서 선형 보간해 추정"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+class _SiteStats:
+    __slots__ = (
+        "calls",
+        "errors",
+        "cache_hits",
+        "prompt_tokens",
+        "completion_tokens",
+        "duration",
+        "first_token",
+    )
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.duration = LatencyHistogram()
+        self.first_token = LatencyHistogram()
+
+
+_sites = {}
+_sites_lock = threading.Lock()
+_current_call = contextvars.ContextVar("current_call", default=None)
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def _get_log():
+    global _log
+    with _log_lock:
+        if _log is None and METRICS_LOG_PATH:
+            os.makedirs(os.path.dirname(METRICS_LOG_PATH) or ".", exist_ok=True)
+            _log = logging.getLogger("metrics.calls")
+            _log.propagate = False
+            _log.setLevel(logging.INFO)
+            _log.addHandler(
+                RotatingFileHandler(
+                    METRICS_LOG_PATH,
+                    maxBytes=METRICS_LOG_MAX_BYTES,
+                    backupCount=METRICS_LOG_BACKUPS,
+                    encoding="utf-8",
+                )
+            )
+        return _log
+
+
+class Call:
+    """
+    호출 하나의 측정값. track()의 with 블록 안에서 하위 계층(LLM 클라이언트, 캐시)이
+    record_usage()/record_cache_hit()로 값을 채웁니다.
+    """
+
+    def __init__(self, site):
+        self.site = site
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hit = False
+        self.error = None
+        # 대체/헤지 요청으로 요청한 모델 대신 응답한 모델 (라우팅을 거친 경우)
+        self.served_model = None
+        self._previous = None
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def add_usage(self, usage):
+        self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def fail(self, error):
+        """호출한 쪽에서 예외를 처리해 삼킨 경우에도 오류로 집계"""
+        self.error = error
+
+    def __enter__(self):
+        self._previous = _current_call.get()
+        _current_call.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 비동기 제너레이터에서는 진입/종료가 서로 다른 컨텍스트일 수 있어 reset 대신 set 사용
+        _current_call.set(self._previous)
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            self.error = exc
+        _record(self, time.perf_counter())
+        return False
+
+
+def track(site):
+    """with track("get_response") as call: 형태로 호출 지점의 측정을 시작"""
+    return Call(site)
+
+
+def timed(site):
+    """동기 함수 전체를 track(site)로 감싸는 데코레이터"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(site):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def current_call():
+    return _current_call.get()
+
+
+def record_usage(usage):
+    call = _current_call.get()
+    if call is not None and usage is not None:
+        call.add_usage(usage)
+
+
+def record_served_model(model):
+    call = _current_call.get()
+    if call is not None:
+        call.served_model = model
+
+
+def record_cache_hit():
+    call = _current_call.get()
+    if call is not None:
+        call.cache_hit = True
+
+
+def _record(call, finished):
+    duration = finished - call.started
+    ttft = (
+        call.first_token_at - call.started if call.first_token_at is not None else None
+    )
+    with _sites_lock:
+        stats = _sites.get(call.site)
+        if stats is None:
+            stats = _sites[call.site] = _SiteStats()
+        stats.calls += 1
+        stats.errors += call.error is not None
+        stats.cache_hits += call.cache_hit
+        stats.prompt_tokens += call.prompt_tokens
+        stats.completion_tokens += call.completion_tokens
+        stats.duration.observe(duration)
+        if ttft is not None:
+            stats.first_token.observe(ttft)
+
+    log = _get_log()
+    if log is not None:
+        log.info(
+            json.dumps(
+                {
+                    "ts": time.time(),
+                    "site": call.site,
+                    "duration": round(duration, 6),
+                    "ttft": round(ttft, 6) if ttft is not None else None,
+                    "prompt_tokens": call.prompt_tokens,
+                    "completion_tokens": call.completion_tokens,
+                    "cache_hit": call.cache_hit,
+                    "served_model": call.served_model,
+                    "error": repr(call.error) if call.error is not None else None,
+                },
+                ensure_ascii=False,
+            )
+        )
+
+
+def get_site_stats():
+    """호출 지점별 집계 (호출/오류/캐시 적중 수, 토큰 합계, 지연 시간 백분위수)"""
+    with _sites_lock:
+        return {
+            site: {
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "cache_hits": stats.cache_hits,
+                "prompt_tokens": stats.prompt_tokens,
+                "completion_tokens": stats.completion_tokens,
+                "p50": stats.duration.percentile(0.5),
+                "p95": stats.duration.percentile(0.95),
+                "ttft_p50": stats.first_token.percentile(0.5),
+                "ttft_p95": stats.first_token.percentile(0.95),
+            }
+            for site, stats in sorted(_sites.items())
+        }
+
+
+def collect():
+    """디버그 패널과 내보내기에 쓰는 전체 지표 (호출 지점, 캐시, 의도 분류, 라우팅, 세션 기록, 쓰기 대기열)"""
+    from utils.cache import get_response_cache
+    from utils.firestore import get_write_stats
+    from utils.history_store import get_history_stats
+    from utils.intent import get_intent_stats
+    from utils.routing import get_route_stats
+
+    return {
+        "sites": get_site_stats(),
+        "response_cache": get_response_cache().stats(),
+        "intent": get_intent_stats(),
+        "routes": get_route_stats(),
+        "history": get_history_stats(),
+        "writes": get_write_stats(),
+    }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(name, labels, histogram):
+    label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}'
+    yield f'{name}_bucket{{{label_text},le="+Inf"}} {histogram.count}'
+    yield f"{name}_sum{{{label_text}}} {histogram.sum}"
+    yield f"{name}_count{{{label_text}}} {histogram.count}"
+
+
+def render_prometheus():
+    """Prometheus 텍스트 형식(0.0.4)으로 모든 지표를 반환"""
+    from utils.cache import get_response_cache
+    from utils.firestore import get_write_stats
+    from utils.history_store import get_history_stats
+    from utils.intent import get_intent_stats
+    from utils.routing import get_route_histograms
+
+    lines = []
+    counters = (
+        ("app_calls_total", "calls", "Calls per call site."),
+        ("app_call_errors_total", "errors", "Failed calls per call site."),
+        ("app_cache_hits_total", "cache_hits", "Calls served from a cache."),
+        ("app_prompt_tokens_total", "prompt_tokens", "Prompt tokens from response.usage."),
+        (
+            "app_completion_tokens_total",
+            "completion_tokens",
+            "Completion tokens from response.usage.",
+        ),
+    )
+    with _sites_lock:
+        sites = sorted(_sites.items())
+        for name, field, help_text in counters:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for site, stats in sites:
+                lines.append(f'{name}{{site="{_escape(site)}"}} {getattr(stats, field)}')
+
+        for name, field, help_text in (
+            ("app_call_duration_seconds", "duration", "Wall time per call site."),
+            ("app_time_to_first_token_seconds", "first_token", "Time to first token."),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for site, stats in sites:
+                lines.extend(_histogram_lines(name, {"site": site}, getattr(stats, field)))
+
+    cache_stats = get_response_cache().stats()
+    lines.append("# HELP app_response_cache_requests_total LLM response cache lookups.")
+    lines.append("# TYPE app_response_cache_requests_total counter")
+    for result in ("hits", "misses"):
+        lines.append(
+            f'app_response_cache_requests_total{{result="{result}"}} {cache_stats[result]}'
+        )
+
+    lines.append("# HELP app_intent_decisions_total Image intent decisions by kind.")
+    lines.append("# TYPE app_intent_decisions_total counter")
+    for kind, count in sorted(get_intent_stats().items()):
+        lines.append(f'app_intent_decisions_total{{kind="{_escape(kind)}"}} {count}')
+
+    lines.append("# HELP app_llm_route_latency_seconds Latency per model route.")
+    lines.append("# TYPE app_llm_route_latency_seconds histogram")
+    for (model, kind), histogram in get_route_histograms():
+        lines.extend(
+            _histogram_lines(
+                "app_llm_route_latency_seconds", {"model": model, "kind": kind}, histogram
+            )
+        )
+
+    history_stats = get_history_stats()
+    for name, field, help_text in (
+        ("app_history_sessions", "sessions", "Sessions holding chat history."),
+        ("app_history_bytes", "bytes", "Chat history memory across sessions."),
+        ("app_history_max_session_bytes", "max_session_bytes", "Largest session history."),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {history_stats[field]}")
+
+    write_stats = get_write_stats()
+    for name, field, kind, help_text in (
+        ("app_write_commits_total", "commits", "counter", "Committed write-behind batches."),
+        (
+            "app_write_commit_failures_total",
+            "commit_failures",
+            "counter",
+            "Failed write-behind batch commits (retried).",
+        ),
+        ("app_write_lost_total", "lost_writes", "counter", "Writes dropped at shutdown."),
+        ("app_write_pending", "pending", "gauge", "Write groups waiting to be committed."),
+        ("app_write_retrying", "retrying", "gauge", "Write groups waiting for a retry."),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {write_stats[field]}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None):
+    """METRICS_PORT가 설정되어 있으면 /metrics 엔드포인트를 한 번만 시작"""
+    global _server
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+            threading.Thread(
+                target=_server.serve_forever, name="metrics-server", daemon=True
+            ).start()
+        return _server
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import random
+import time
+from collections import OrderedDict, deque
+
+# 모델별 분당 요청 수(rpm)와 토큰 수(tpm) 한도. 실제 한도는 계정 등급마다 다르고 레플리카 수만큼
+# 나눠 써야 하므로 기본값은 두지 않고(429와 Retry-After에 따른 백오프만 사용),
+# LLM_RATE_LIMITS 환경 변수(JSON)에 지정한 모델만 이 프로세스에서 미리 제한합니다.
+# 예: {"gpt-4o": {"rpm": 250, "tpm": 400000}}
+DEFAULT_RATE_LIMIT = {"rpm": None, "tpm": None}
+
+
+def load_rate_limits(overrides=None):
+    """LLM_RATE_LIMITS(JSON)에 지정한 모델별 한도 표를 반환 (지정하지 않은 모델은 제한 없음)"""
+    if overrides is None:
+        overrides = json.loads(os.getenv("LLM_RATE_LIMITS") or "{}")
+    return {
+        model: {**DEFAULT_RATE_LIMIT, **override} for model, override in overrides.items()
+    }
+
+
+MODEL_RATE_LIMITS = load_rate_limits()
+
+# 재시도 설정
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+
+class TokenBucket:
+    """분당 한도를 초당 속도로 채워 넣는 토큰 버킷"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        now = time.monotonic()
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens < amount:
+            return (amount - self.tokens) / self.rate
+        return 0.0
+
+    def consume(self, amount):
+        self._refill(time.monotonic())
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _ModelScheduler:
+    """
+    모델 하나의 요청을 사용자별 대기열에 넣고 라운드 로빈으로 내보냅니다.
+
+    한 사용자가 요청을 많이 쌓아도 다른 사용자의 요청이 그 뒤에 밀리지 않습니다.
+    """
+
+    def __init__(self, limits):
+        self.requests = TokenBucket(limits["rpm"]) if limits.get("rpm") else None
+        self.tokens = TokenBucket(limits["tpm"]) if limits.get("tpm") else None
+        # 429 응답의 Retry-After 동안은 한도 설정과 관계없이 새 요청을 내보내지 않음
+        self.blocked_until = 0.0
+        self.waiters = OrderedDict()
+        self._dispatcher = None
+
+    async def acquire(self, user_id, tokens):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(user_id, deque()).append((tokens, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    def _wait_time(self, tokens):
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    async def _dispatch(self):
+        while self.waiters:
+            user_id, queue = next(iter(self.waiters.items()))
+            tokens, future = queue[0]
+            if not future.cancelled():
+                wait = self._wait_time(tokens)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                if self.requests is not None:
+                    self.requests.consume(1)
+                if self.tokens is not None:
+                    self.tokens.consume(tokens)
+                future.set_result(None)
+
+            queue.popleft()
+            if queue:
+                self.waiters.move_to_end(user_id)
+            else:
+                del self.waiters[user_id]
+
+    def block(self, seconds):
+        """서버가 알려준 대기 시간 동안 새 요청을 내보내지 않음"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def refund(self, estimated_tokens):
+        """실패한 요청이 차감한 토큰을 돌려줌 (요청 수는 보수적으로 그대로 둠)"""
+        if self.tokens is not None:
+            self.tokens.refund(estimated_tokens)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """추정치로 차감한 토큰을 실제 사용량으로 보정"""
+        if self.tokens is None:
+            return
+        if actual_tokens > estimated_tokens:
+            self.tokens.consume(actual_tokens - estimated_tokens)
+        else:
+            self.tokens.refund(estimated_tokens - actual_tokens)
+
+
+def _is_retryable(error):
+    if getattr(error, "code", None) == "insufficient_quota":
+        return False
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class RateLimitScheduler:
+    """모델별 요청/토큰 한도(설정된 경우)를 지키며 요청을 내보내고, 일시적인 오류는 백오프 후 재시도"""
+
+    def __init__(self, limits=None, max_retries=MAX_RETRIES):
+        self.limits = MODEL_RATE_LIMITS if limits is None else limits
+        self.max_retries = max_retries
+        # 이벤트 루프 스레드에서만 사용
+        self._schedulers = {}
+
+    def _get_scheduler(self, model):
+        if model not in self._schedulers:
+            self._schedulers[model] = _ModelScheduler(
+                self.limits.get(model, DEFAULT_RATE_LIMIT)
+            )
+        return self._schedulers[model]
+
+    def limits_tokens(self, model):
+        """model에 분당 토큰 한도가 설정되어 있는지 (없으면 토큰 수를 추정할 필요가 없음)"""
+        return self._get_scheduler(model).tokens is not None
+
+    async def run(self, model, call, estimated_tokens=0, user_id=None):
+        """
+        한도 안에서 call()을 실행합니다. 429/5xx/연결 오류는 Retry-After를 따르거나
+        지터를 섞은 지수 백오프로 재시도하고, 결과 객체의 usage로 토큰 사용량을 보정합니다.
+        """
+        scheduler = self._get_scheduler(model)
+        for attempt in range(self.max_retries + 1):
+            await scheduler.acquire(user_id, estimated_tokens)
+            try:
+                result = await call()
+            except Exception as e:
+                scheduler.refund(estimated_tokens)
+                if attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = min(
+                        RETRY_MAX_DELAY,
+                        RETRY_BASE_DELAY * (2**attempt) * random.uniform(0.5, 1.5),
+                    )
+                if getattr(e, "status_code", None) == 429:
+                    # 다른 사용자의 요청도 같은 시간 동안 대기열에서 기다리게 함
+                    scheduler.block(delay)
+                await asyncio.sleep(delay)
+                continue
+
+            usage = getattr(result, "usage", None)
+            if usage is not None and getattr(usage, "total_tokens", None):
+                scheduler.record_usage(estimated_tokens, usage.total_tokens)
+            return result
+
+    def record_usage(self, model, estimated_tokens, actual_tokens):
+        """스트림처럼 사용량을 나중에 알게 되는 요청의 토큰 차감을 보정"""
+        self._get_scheduler(model).record_usage(estimated_tokens, actual_tokens)
@@ -0,0 +1,303 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.cache import MISSING, LRUCache
+from utils.storage import (
+    download_chat_index,
+    get_chat_index_generation,
+    upload_chat_index,
+)
+from utils.tokens import count_tokens
+
+# 문서를 나누는 조각 크기와 겹침, 한 턴에 주입할 조각 수
+CHUNK_TOKENS = 400
+CHUNK_OVERLAP_TOKENS = 50
+TOP_K = 5
+# 한 턴에 주입할 검색 결과의 최대 토큰 수
+RETRIEVAL_CONTEXT_TOKENS = 4000
+
+# BM25 파라미터
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 인덱스 원본은 Storage에 두고 (재시작하거나 다른 레플리카에서도 사용), 로컬 파일은 사본으로 사용
+INDEX_DIR = os.getenv("RETRIEVAL_INDEX_DIR", ".cache/indexes")
+# 로컬 사본이 Storage의 최신 인덱스인지 다시 확인하는 간격 (초)
+INDEX_SYNC_TTL = 60
+# 설정하면 sentence-transformers 로컬 임베딩 모델을 사용 (없으면 BM25)
+EMBEDDING_MODEL = os.getenv("RETRIEVAL_EMBEDDING_MODEL")
+
+_WORD_PATTERN = re.compile(r"[0-9a-z]+|[가-힣]+")
+
+_index_locks = {}
+_index_locks_lock = threading.Lock()
+# 디스크에서 읽은 인덱스와 BM25 통계 (키: (경로, 수정 시각))
+_loaded_indexes = LRUCache(max_entries=256, ttl=600)
+# 최근 확인한 Storage 인덱스 세대 (키: (user_id, chat_id), 인덱스가 없으면 None)
+_index_generations = LRUCache(max_entries=4096, ttl=INDEX_SYNC_TTL)
+# 로컬 사본이 최신인지는 답변 경로 밖에서 확인
+_sync_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="retrieval-sync")
+
+logger = logging.getLogger(__name__)
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def _tokenize(text):
+    terms = []
+    for word in _WORD_PATTERN.findall(text.lower()):
+        terms.append(word)
+        if word[0] >= "가" and len(word) > 2:
+            # 한글은 조사가 붙어 형태가 달라지므로 글자 bigram도 함께 사용
+            terms.extend(word[i : i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+def _get_embedder():
+    global _embedder
+    if not EMBEDDING_MODEL:
+        return None
+    with _embedder_lock:
+        if _embedder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                return None
+            _embedder = SentenceTransformer(EMBEDDING_MODEL)
+        return _embedder
+
+
+def _embed(texts):
+    embedder = _get_embedder()
+    if embedder is None:
+        return None
+    return embedder.encode(texts, normalize_embeddings=True).tolist()
+
+
+def get_index_path(user_id, chat_id):
+    return os.path.join(INDEX_DIR, user_id, f"{chat_id}.json")
+
+
+def _get_lock(path):
+    with _index_locks_lock:
+        return _index_locks.setdefault(path, threading.Lock())
+
+
+def _load_index(path):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cache_key = (path, mtime)
+    loaded = _loaded_indexes.get(cache_key)
+    if loaded is MISSING:
+        with open(path, encoding="utf-8") as f:
+            index = json.load(f)
+        term_counts = [Counter(_tokenize(chunk["text"])) for chunk in index["chunks"]]
+        document_frequency = Counter()
+        for counts in term_counts:
+            document_frequency.update(counts.keys())
+        lengths = [sum(counts.values()) for counts in term_counts]
+        loaded = {
+            "index": index,
+            "term_counts": term_counts,
+            "document_frequency": document_frequency,
+            "lengths": lengths,
+            "average_length": sum(lengths) / len(lengths) if lengths else 0,
+        }
+        _loaded_indexes.set(cache_key, loaded)
+    return loaded
+
+
+def _write_index(path, index):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _sync_index(user_id, chat_id, path):
+    """
+    로컬 사본이 없거나 Storage의 인덱스와 세대가 다르면 내려받습니다 (호출자가 path의 잠금을
+    잡고 있어야 함).
+    """
+    key = (user_id, chat_id)
+    generation = get_chat_index_generation(user_id, chat_id)
+    loaded = _load_index(path)
+    if generation is not None and (
+        loaded is None or loaded["index"].get("generation") != generation
+    ):
+        generation, data = download_chat_index(user_id, chat_id)
+        if data is not None:
+            index = json.loads(data)
+            index["generation"] = generation
+            _write_index(path, index)
+    _index_generations.set(key, generation)
+
+
+def add_document(user_id, chat_id, name, chunks):
+    """문서 조각을 채팅의 검색 인덱스에 추가하고 Storage에 저장"""
+    path = get_index_path(user_id, chat_id)
+    with _get_lock(path):
+        # 다른 레플리카에서 추가한 문서를 덮어쓰지 않도록 최신 인덱스에 추가
+        _sync_index(user_id, chat_id, path)
+        loaded = _load_index(path)
+        if loaded is None:
+            index = {"documents": [], "chunks": [], "embedding_model": EMBEDDING_MODEL}
+        else:
+            index = {
+                **loaded["index"],
+                "documents": list(loaded["index"]["documents"]),
+                "chunks": list(loaded["index"]["chunks"]),
+            }
+
+        index["documents"].append(name)
+        new_chunks = [
+            {"document": name, "text": chunk} for chunk in chunks if chunk.strip()
+        ]
+        embeddings = _embed([chunk["text"] for chunk in new_chunks])
+        if embeddings is not None and index.get("embedding_model") == EMBEDDING_MODEL:
+            for chunk, embedding in zip(new_chunks, embeddings):
+                chunk["embedding"] = embedding
+        index["chunks"].extend(new_chunks)
+        index.pop("generation", None)
+
+        generation = upload_chat_index(
+            user_id, chat_id, json.dumps(index, ensure_ascii=False).encode("utf-8")
+        )
+        index["generation"] = generation
+        _write_index(path, index)
+        _index_generations.set((user_id, chat_id), generation)
+
+    # 검색은 이 표시가 있는 채팅에서만 하므로 인덱스를 올린 뒤에 기록
+    # (utils.firestore가 이 모듈을 임포트하므로 여기서 임포트)
+    from utils.firestore import mark_retrieval_index
+
+    mark_retrieval_index(user_id, chat_id)
+
+
+def _refresh_index(user_id, chat_id, path):
+    try:
+        with _get_lock(path):
+            _sync_index(user_id, chat_id, path)
+    except Exception as e:
+        # 다음 확인 때 다시 시도하고, 그동안은 로컬 사본 사용
+        _index_generations.delete((user_id, chat_id))
+        logger.warning("Failed to refresh retrieval index %s: %r", path, e)
+
+
+def _get_index(user_id, chat_id):
+    """
+    채팅의 검색 인덱스를 반환합니다 (없으면 None). 로컬 사본이 있으면 바로 사용하고 Storage의
+    최신 여부는 INDEX_SYNC_TTL초마다 백그라운드에서 확인하며, 사본이 없을 때만(재시작, 다른
+    레플리카) 답변 전에 내려받습니다.
+    """
+    from utils.firestore import has_retrieval_index
+
+    path = get_index_path(user_id, chat_id)
+    loaded = _load_index(path)
+    key = (user_id, chat_id)
+    if loaded is not None:
+        if _index_generations.get(key) is MISSING:
+            _index_generations.set(key, loaded["index"].get("generation"))
+            _sync_executor.submit(_refresh_index, user_id, chat_id, path)
+        return loaded
+    if not has_retrieval_index(user_id, chat_id):
+        return None
+    with _get_lock(path):
+        _sync_index(user_id, chat_id, path)
+        return _load_index(path)
+
+
+def delete_index(user_id, chat_id):
+    """로컬 사본을 삭제 (Storage의 인덱스는 채팅 파일과 함께 삭제됨)"""
+    path = get_index_path(user_id, chat_id)
+    with _get_lock(path):
+        _index_generations.delete((user_id, chat_id))
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _bm25_scores(loaded, query):
+    query_terms = set(_tokenize(query))
+    chunk_count = len(loaded["term_counts"])
+    scores = []
+    for counts, length in zip(loaded["term_counts"], loaded["lengths"]):
+        score = 0.0
+        for term in query_terms:
+            frequency = counts.get(term)
+            if not frequency:
+                continue
+            df = loaded["document_frequency"][term]
+            idf = math.log(1 + (chunk_count - df + 0.5) / (df + 0.5))
+            length_norm = 1 - BM25_B + BM25_B * length / (loaded["average_length"] or 1)
+            score += (
+                idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+            )
+        scores.append(score)
+    return scores
+
+
+def _embedding_scores(chunks, query):
+    if any("embedding" not in chunk for chunk in chunks):
+        return None
+    query_embedding = _embed([query])
+    if query_embedding is None:
+        return None
+    return [
+        sum(a * b for a, b in zip(chunk["embedding"], query_embedding[0]))
+        for chunk in chunks
+    ]
+
+
+def retrieve(user_id, chat_id, query, model, max_tokens, top_k=TOP_K):
+    """
+    채팅에 첨부된 문서에서 질문과 관련된 조각을 최대 top_k개, max_tokens 이내로 반환합니다.
+    """
+    loaded = _get_index(user_id, chat_id)
+    if loaded is None or not loaded["index"]["chunks"]:
+        return []
+
+    chunks = loaded["index"]["chunks"]
+    scores = _embedding_scores(chunks, query) or _bm25_scores(loaded, query)
+    best_score = max(scores)
+    if best_score > 0:
+        ranked = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)
+    else:
+        # 질문과 겹치는 단어가 없으면(예: "요약해줘") 문서 앞부분을 사용
+        ranked = list(range(len(chunks)))
+
+    selected = []
+    remaining = max_tokens
+    for i in ranked[:top_k]:
+        if scores[i] <= 0 < best_score:
+            break
+        tokens = count_tokens(chunks[i]["text"], model)
+        if tokens > remaining:
+            continue
+        selected.append(chunks[i])
+        remaining -= tokens
+    return selected
+
+
+def build_context_message(chunks):
+    """검색된 조각을 모델에 전달할 system 메시지로 만듦"""
+    excerpts = "\n\n".join(
+        f"[{chunk['document']}]\n{chunk['text']}" for chunk in chunks
+    )
+    return {
+        "role": "system",
+        "message": "다음은 사용자가 첨부한 문서에서 현재 질문과 관련된 부분입니다. "
+        "답변에 필요하면 참고하세요.\n\n" + excerpts,
+    }
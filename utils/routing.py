@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from utils.llm import chat_completion, provider_for_model, stream_chat_completion
+from utils.metrics import LatencyHistogram, record_served_model
+
+# 요청한 모델이 실패하거나 느릴 때 순서대로 시도할 대체 모델
+# (프롬프트가 요청한 모델 기준으로 잘리므로 컨텍스트 한도가 같거나 큰 모델만 지정.
+#  llama-3.1-8b-instant는 131072 토큰이라 더 큰 대체 모델이 없음)
+MODEL_FALLBACKS = {
+    "gpt-4o": ["gpt-4o-mini"],
+    "gpt-4o-mini": ["gpt-4o"],
+    "gpt-4-turbo": ["gpt-4o"],
+    "gpt-4": ["gpt-4o"],
+    "gpt-3.5-turbo-0125": ["gpt-4o-mini"],
+}
+
+# 응답 지연이 이 백분위수를 넘으면 대체 모델로 요청을 하나 더 보냄 (헤지 요청)
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "1") != "0"
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# 백분위수를 신뢰할 수 있을 만큼 표본이 모이기 전에 사용하는 대기 시간 (초)
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "10"))
+
+# 요청 자체가 잘못된 경우라 다른 모델로 보내도 실패할 상태 코드
+NON_FALLBACK_STATUS_CODES = {400, 422}
+
+logger = logging.getLogger(__name__)
+
+
+# 키: (모델, 종류) — 종류는 "completion"(전체 응답) 또는 "first_token"(스트림 첫 조각)
+_histograms = {}
+_counters = {}
+_stats_lock = threading.Lock()
+
+
+def _observe(route, seconds):
+    with _stats_lock:
+        _histograms.setdefault(route, LatencyHistogram()).observe(seconds)
+
+
+def _count(route, name):
+    with _stats_lock:
+        _counters.setdefault(route, Counter())[name] += 1
+
+
+def _hedge_delay(route):
+    with _stats_lock:
+        histogram = _histograms.get(route)
+        if histogram is None or histogram.count < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return histogram.percentile(HEDGE_PERCENTILE)
+
+
+def get_route_stats():
+    """경로(모델, 종류)별 지연 시간 백분위수와 헤지/대체 횟수"""
+    with _stats_lock:
+        routes = set(_histograms) | set(_counters)
+        stats = {}
+        for model, kind in sorted(routes):
+            histogram = _histograms.get((model, kind), LatencyHistogram())
+            stats[f"{provider_for_model(model)}:{model}:{kind}"] = {
+                "count": histogram.count,
+                "p50": histogram.percentile(0.5),
+                "p95": histogram.percentile(0.95),
+                "p99": histogram.percentile(0.99),
+                "histogram": histogram.snapshot(),
+                **_counters.get((model, kind), {}),
+            }
+        return stats
+
+
+def get_route_histograms():
+    """Prometheus 내보내기용 ((모델, 종류), 히스토그램) 목록"""
+    with _stats_lock:
+        routes = []
+        for route, histogram in sorted(_histograms.items()):
+            snapshot = LatencyHistogram(histogram.buckets)
+            snapshot.counts = list(histogram.counts)
+            snapshot.count = histogram.count
+            snapshot.sum = histogram.sum
+            routes.append((route, snapshot))
+        return routes
+
+
+def _should_fall_back(error):
+    return getattr(error, "status_code", None) not in NON_FALLBACK_STATUS_CODES
+
+
+async def _timed(model, kind, call):
+    start = time.monotonic()
+    try:
+        result = await call(model)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        _count((model, kind), "errors")
+        raise
+    _observe((model, kind), time.monotonic() - start)
+    return result
+
+
+async def _hedged(model, hedge_model, kind, call, discard=None, tried=None):
+    """
+    model로 요청을 보내고, 지연 기준 안에 끝나지 않으면 hedge_model로도 보내
+    먼저 성공한 (결과, 응답한 모델)을 반환합니다. 진 요청은 취소하고, 이미 끝났다면
+    discard(result)로 정리합니다. 요청을 보낸 모델은 tried에 추가합니다.
+    """
+    if tried is not None:
+        tried.add(model)
+    primary = asyncio.create_task(_timed(model, kind, call))
+    if not HEDGING_ENABLED or hedge_model is None:
+        return await primary, model
+
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=_hedge_delay((model, kind)))
+    except asyncio.CancelledError:
+        primary.cancel()
+        raise
+    if done:
+        return primary.result(), model
+
+    _count((model, kind), "hedged")
+    if tried is not None:
+        tried.add(hedge_model)
+    hedge = asyncio.create_task(_timed(hedge_model, kind, call))
+    pending = {primary, hedge}
+    winner = None
+    error = None
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif winner is None:
+                    winner = task
+                elif discard is not None:
+                    await discard(task.result())
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if winner is None:
+        raise error
+    if winner is hedge:
+        _count((model, kind), "hedge_wins")
+        return winner.result(), hedge_model
+    return winner.result(), model
+
+
+async def _route(model, kind, call, discard=None):
+    """
+    요청한 모델부터 대체 모델 순서로 시도하고, 각 단계에서 다음 모델로 헤지 요청.
+    실제로 응답한 모델은 현재 호출 측정값(served_model)에 기록합니다.
+    """
+    routes = [model, *MODEL_FALLBACKS.get(model, [])]
+    tried = set()
+    while True:
+        route = routes.pop(0)
+        hedge_model = routes[0] if routes else None
+        try:
+            result, served_model = await _hedged(
+                route, hedge_model, kind, call, discard, tried
+            )
+        except Exception as e:
+            # 헤지 요청으로 이미 실패한 모델은 다시 시도하지 않음
+            routes = [r for r in routes if r not in tried]
+            if not routes or not _should_fall_back(e):
+                raise
+            logger.warning("%s failed, falling back to %s: %s", route, routes[0], e)
+            _count((route, kind), "fallbacks")
+            continue
+        record_served_model(served_model)
+        return result
+
+
+async def route_chat_completion(model, messages, **params):
+    """chat_completion과 같지만 오류 시 대체 모델로 넘어가고 느린 요청은 헤지"""
+
+    async def call(route_model):
+        return await chat_completion(route_model, messages, **params)
+
+    return await _route(model, "completion", call)
+
+
+async def route_stream_chat_completion(model, messages, **params):
+    """
+    stream_chat_completion과 같지만 첫 조각을 받기 전까지 대체/헤지를 적용합니다.
+    첫 조각이 나온 뒤에는 그 스트림을 끝까지 사용합니다.
+    """
+
+    async def call(route_model):
+        stream = stream_chat_completion(route_model, messages, **params)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            await stream.aclose()
+            raise
+        return stream, first
+
+    async def discard(result):
+        await result[0].aclose()
+
+    stream, first = await _route(model, "first_token", call, discard)
+    try:
+        if first is not None:
+            yield first
+        async for delta in stream:
+            yield delta
+    finally:
+        await stream.aclose()
@@ -0,0 +1,141 @@
+import base64
+import hashlib
+import io
+import os
+
+import requests
+from firebase_config import get_bucket
+
+# 비전 모델이 high detail에서 실제로 사용하는 해상도 (긴 변 2048, 짧은 변 768 이내로 축소됨)
+VISION_MAX_LONG_SIDE = 2048
+VISION_MAX_SHORT_SIDE = 768
+JPEG_QUALITY = 85
+
+# 업로드 이미지 전달 방식: "storage"(Storage 업로드 후 URL) 또는 "data_url"(base64로 직접 전달)
+IMAGE_UPLOAD_MODE = os.getenv("IMAGE_UPLOAD_MODE", "storage")
+
+# 생성된 이미지는 사용자·프롬프트 해시로 그 사용자의 모든 채팅이 공유 (채팅 삭제 시에도 유지)
+GENERATED_IMAGE_PREFIX = "generated/"
+
+
+def get_chat_storage_prefix(user_id, chat_id):
+    """채팅에 첨부된 파일이 저장되는 Storage 경로"""
+    return f"chats/{user_id}/{chat_id}/"
+
+
+def prepare_image(data, content_type):
+    """
+    이미지를 비전 모델이 사용하는 해상도로 줄이고 다시 인코딩합니다.
+
+    Returns:
+    - (bytes, str): 변환된 이미지 데이터와 content type. Pillow가 없거나 더 작아지지 않으면 원본.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return data, content_type
+
+    try:
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    except Exception:
+        return data, content_type
+
+    width, height = image.size
+    scale = min(
+        1.0,
+        VISION_MAX_LONG_SIDE / max(width, height),
+        VISION_MAX_SHORT_SIDE / min(width, height),
+    )
+    if scale < 1.0:
+        image = image.resize(
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            Image.LANCZOS,
+        )
+
+    output = io.BytesIO()
+    if image.mode in ("RGBA", "LA", "P"):
+        image.save(output, format="PNG", optimize=True)
+        encoded, encoded_type = output.getvalue(), "image/png"
+    else:
+        image.convert("RGB").save(output, format="JPEG", quality=JPEG_QUALITY)
+        encoded, encoded_type = output.getvalue(), "image/jpeg"
+
+    if scale == 1.0 and len(encoded) >= len(data):
+        return data, content_type
+    return encoded, encoded_type
+
+
+def upload_chat_image(data, content_type, user_id, chat_id):
+    """이미지를 내용 해시 이름으로 업로드하고 공개 URL 반환 (이미 있으면 업로드 생략)"""
+    extension = content_type.split("/")[-1].replace("jpeg", "jpg")
+    digest = hashlib.sha256(data).hexdigest()
+    blob = get_bucket().blob(
+        f"{get_chat_storage_prefix(user_id, chat_id)}images/{digest}.{extension}"
+    )
+    if not blob.exists():
+        blob.upload_from_string(data, content_type=content_type)
+        blob.make_public()
+    return blob.public_url
+
+
+def _chat_index_blob_name(user_id, chat_id):
+    # 채팅 파일과 같은 경로에 두어 채팅을 삭제할 때 함께 삭제됨
+    return f"{get_chat_storage_prefix(user_id, chat_id)}retrieval/index.json"
+
+
+def upload_chat_index(user_id, chat_id, data):
+    """채팅 검색 인덱스(첨부 문서 조각)를 Storage에 저장하고 세대(generation) 번호를 반환"""
+    blob = get_bucket().blob(_chat_index_blob_name(user_id, chat_id))
+    blob.upload_from_string(data, content_type="application/json")
+    return blob.generation
+
+
+def get_chat_index_generation(user_id, chat_id):
+    """Storage에 저장된 채팅 검색 인덱스의 세대 번호 (없으면 None)"""
+    blob = get_bucket().get_blob(_chat_index_blob_name(user_id, chat_id))
+    return blob.generation if blob is not None else None
+
+
+def download_chat_index(user_id, chat_id):
+    """
+    Storage에 저장된 채팅 검색 인덱스를 내려받습니다.
+
+    Returns:
+    - (int, bytes): 세대 번호와 인덱스 JSON. 없으면 (None, None).
+    """
+    blob = get_bucket().get_blob(_chat_index_blob_name(user_id, chat_id))
+    if blob is None:
+        return None, None
+    return blob.generation, blob.download_as_bytes()
+
+
+def get_generated_image_url(key):
+    """이미 저장된 생성 이미지가 있으면 공개 URL을, 없으면 None을 반환"""
+    blob = get_bucket().blob(f"{GENERATED_IMAGE_PREFIX}{key}.png")
+    return blob.public_url if blob.exists() else None
+
+
+def store_generated_image(key, source_url):
+    """임시 URL의 생성 이미지를 내려받아 Storage에 영구 저장하고 공개 URL 반환"""
+    response = requests.get(source_url, timeout=60)
+    response.raise_for_status()
+    blob = get_bucket().blob(f"{GENERATED_IMAGE_PREFIX}{key}.png")
+    blob.upload_from_string(
+        response.content,
+        content_type=response.headers.get("Content-Type", "image/png"),
+    )
+    blob.make_public()
+    return blob.public_url
+
+
+def to_data_url(data, content_type):
+    return f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def delete_chat_files(user_id, chat_id):
+    """채팅에 업로드된 Storage 파일을 모두 삭제"""
+    bucket = get_bucket()
+    blobs = list(bucket.list_blobs(prefix=get_chat_storage_prefix(user_id, chat_id)))
+    if blobs:
+        bucket.delete_blobs(blobs, on_error=lambda blob: None)
+    return len(blobs)
@@ -0,0 +1,164 @@
+import threading
+
+# 메시지마다 role/구분자로 추가되는 토큰 수 (OpenAI chat 포맷 기준)
+MESSAGE_OVERHEAD_TOKENS = 4
+# 응답 앞에 붙는 assistant 프라이밍 토큰 수
+REPLY_PRIMING_TOKENS = 3
+
+# tiktoken이 모델명을 모르는 경우(예: llama) 사용할 기본 인코딩
+DEFAULT_ENCODING = "cl100k_base"
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _load_encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+
+    try:
+        name = tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        name = DEFAULT_ENCODING
+
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        # BPE 파일을 내려받을 수 없는 환경(오프라인 등)에서는 추정치로 대체
+        return None
+
+
+def _get_encoding(model):
+    with _encodings_lock:
+        if model not in _encodings:
+            _encodings[model] = _load_encoding(model)
+        return _encodings[model]
+
+
+def get_encoding_name(model):
+    """모델에 해당하는 토크나이저 인코딩 이름을 반환"""
+    encoding = _get_encoding(model)
+    return encoding.name if encoding is not None else "approx"
+
+
+def _approx_token_count(text):
+    # tiktoken이 없을 때의 보수적 추정: ASCII는 4글자당 1토큰, 한글 등 비ASCII는 글자당 1토큰
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def count_tokens(text, model="gpt-4o"):
+    if not text:
+        return 0
+
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return _approx_token_count(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_text(text, model, max_tokens):
+    """텍스트를 max_tokens 이내로 자름"""
+    if max_tokens <= 0:
+        return ""
+
+    encoding = _get_encoding(model)
+    if encoding is None:
+        while text and _approx_token_count(text) > max_tokens:
+            text = text[: len(text) * max_tokens // _approx_token_count(text)]
+        return text
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def count_message_tokens(message, model="gpt-4o"):
+    """메시지 토큰 수를 계산하고 메시지 dict에 인코딩별로 캐시"""
+    encoding_name = get_encoding_name(model)
+    token_counts = message.get("token_counts")
+    if token_counts is None:
+        token_counts = message["token_counts"] = {}
+
+    if encoding_name not in token_counts:
+        token_counts[encoding_name] = (
+            count_tokens(message["message"], model) + MESSAGE_OVERHEAD_TOKENS
+        )
+    return token_counts[encoding_name]
+
+
+def select_context_window(messages, model, max_tokens):
+    """최신 메시지부터 거꾸로 max_tokens에 들어가는 만큼만 선택"""
+    budget = max_tokens - REPLY_PRIMING_TOKENS
+    window = []
+
+    for message in reversed(messages):
+        if message["message"] is None:
+            continue
+
+        message_tokens = count_message_tokens(message, model)
+        if message_tokens > budget:
+            if not window:
+                # 가장 최근 메시지 하나가 예산을 넘으면 잘라서라도 포함
+                window.append(
+                    {
+                        "role": message["role"],
+                        "message": truncate_text(
+                            message["message"],
+                            model,
+                            budget - MESSAGE_OVERHEAD_TOKENS,
+                        ),
+                    }
+                )
+            break
+
+        window.append(message)
+        budget -= message_tokens
+
+    window.reverse()
+    return window
+
+
+def split_text(text, model, chunk_tokens, overlap_tokens=0):
+    """텍스트를 문단 경계를 우선으로 chunk_tokens 이내의 조각으로 나눔"""
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for paragraph in text.split("\n"):
+        paragraph_tokens = count_tokens(paragraph, model) + 1
+        if paragraph_tokens > chunk_tokens:
+            # 너무 긴 문단은 모아둔 조각을 먼저 내보낸 뒤 토큰 단위로 잘라서 처리
+            if any(line.strip() for line in current):
+                chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+            while paragraph:
+                piece = truncate_text(paragraph, model, chunk_tokens)
+                if not piece:
+                    break
+                chunks.append(piece)
+                paragraph = paragraph[len(piece) :]
+            continue
+
+        if current and current_tokens + paragraph_tokens > chunk_tokens:
+            chunks.append("\n".join(current))
+            # 다음 조각의 앞부분에 이전 조각의 끝 문단을 일부 겹쳐 넣음
+            overlap = []
+            overlap_count = 0
+            for previous in reversed(current):
+                previous_tokens = count_tokens(previous, model) + 1
+                if overlap_count + previous_tokens > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_count += previous_tokens
+            current, current_tokens = overlap, overlap_count
+
+        current.append(paragraph)
+        current_tokens += paragraph_tokens
+
+    if any(line.strip() for line in current):
+        chunks.append("\n".join(current))
+    return chunks
@@ -0,0 +1,182 @@
+import asyncio
+import time
+
+from openai_api import (
+    analyze_user_input_for_image_request_async,
+    get_attachment_token_budget,
+    stream_response_async,
+    summarize_chat_async,
+)
+from utils.firestore import save_message, update_chat_summary
+from utils.history_store import to_messages
+from utils.llm import get_event_loop, iterate_sync, run_in_background, run_sync
+from utils.memory import compact_in_background, load_turn_history
+from utils.retrieval import RETRIEVAL_CONTEXT_TOKENS, build_context_message, retrieve
+
+_STREAM_END = object()
+
+
+async def _buffer_reply(queue, chat_history, model, route_info):
+    try:
+        async for delta in stream_response_async(
+            chat_history, model, route_info=route_info
+        ):
+            queue.put_nowait(delta)
+    finally:
+        queue.put_nowait(_STREAM_END)
+
+
+async def _drain_reply(queue, reply_task):
+    try:
+        while True:
+            delta = await queue.get()
+            if delta is _STREAM_END:
+                break
+            yield delta
+    finally:
+        # 소비자가 중간에 멈추면 생성 중인 응답도 취소
+        reply_task.cancel()
+
+
+class Turn:
+    """
+    start_turn()이 시작한 턴 하나. with 블록을 벗어나면 답변 스트림을 끝까지 읽지 않았거나
+    아예 읽지 않았더라도 생성 중인 답변을 취소합니다.
+    """
+
+    def __init__(self, model, is_image_request, queue=None, reply_task=None, route_info=None):
+        self.model = model
+        self.is_image_request = is_image_request
+        # begin_turn()이 단계별 소요 시간(초)을 기록
+        self.timings = {}
+        self._queue = queue
+        self._reply_task = reply_task
+        self._route_info = {} if route_info is None else route_info
+
+    @property
+    def fallback_model(self):
+        """요청한 모델 대신 대체/헤지 모델이 답했으면 그 모델 (첫 조각을 받은 뒤에 알 수 있음)"""
+        served_model = self._route_info.get("model")
+        return served_model if served_model not in (None, self.model) else None
+
+    def stream(self):
+        """답변 조각(delta)을 yield하는 동기 제너레이터 (이미지 요청이면 None)"""
+        if self._reply_task is None:
+            return None
+        return iterate_sync(_drain_reply(self._queue, self._reply_task))
+
+    def close(self):
+        if self._reply_task is not None and not self._reply_task.done():
+            get_event_loop().call_soon_threadsafe(self._reply_task.cancel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+async def start_turn_async(chat_history, prompt, model):
+    """
+    이미지 생성 요청 판별과 답변 생성을 동시에 시작합니다.
+
+    답변은 판별이 끝날 때까지 버퍼에 쌓이고, 이미지 요청으로 판별되면 취소됩니다.
+    """
+    queue = asyncio.Queue()
+    route_info = {}
+    reply_task = asyncio.create_task(
+        _buffer_reply(queue, list(chat_history), model, route_info)
+    )
+
+    try:
+        is_image_request = await analyze_user_input_for_image_request_async(
+            prompt, model
+        )
+    except asyncio.CancelledError:
+        reply_task.cancel()
+        raise
+    except Exception:
+        # 판별 실패 시 일반 답변으로 처리
+        is_image_request = False
+
+    if is_image_request:
+        reply_task.cancel()
+        return Turn(model, True)
+    return Turn(model, False, queue, reply_task, route_info)
+
+
+def start_turn(chat_history, prompt, model):
+    """
+    Turn을 반환합니다. 생성 중인 답변이 남지 않도록 with 블록 안에서 사용:
+
+        with start_turn(history, prompt, model) as turn:
+            if not turn.is_image_request:
+                response = "".join(turn.stream())
+    """
+    return run_sync(start_turn_async(chat_history, prompt, model))
+
+
+async def _summarize_and_store(user_id, chat_id, chat_history):
+    summary = await summarize_chat_async(chat_history)
+    await asyncio.to_thread(update_chat_summary, user_id, chat_id, summary)
+
+
+def summarize_in_background(user_id, chat_id, chat_history):
+    """채팅 요약을 응답 경로 밖에서 생성하고 저장"""
+    return run_in_background(
+        _summarize_and_store(user_id, chat_id, list(chat_history))
+    )
+
+
+def build_turn_messages(user_id, chat_id, chat_history, prompt, model):
+    """
+    모델에 보낼 대화: 오래된 대화는 채팅에 저장된 요약(대화 기억)으로 대신하고, 첨부 문서에서
+    이번 질문과 관련된 부분을 기록에는 남기지 않고 마지막 질문 앞에 넣습니다.
+    """
+    turn_history = to_messages(load_turn_history(user_id, chat_id, chat_history, model))
+    context_chunks = retrieve(
+        user_id,
+        chat_id,
+        prompt,
+        model,
+        min(RETRIEVAL_CONTEXT_TOKENS, get_attachment_token_budget(model)),
+    )
+    if context_chunks:
+        turn_history = (
+            turn_history[:-1]
+            + [build_context_message(context_chunks)]
+            + turn_history[-1:]
+        )
+    return turn_history
+
+
+def begin_turn(user_id, chat_id, chat_history, prompt, model):
+    """
+    텍스트 턴 하나를 시작합니다: 사용자 메시지 저장 → 보낼 대화 구성 → 이미지 요청 판별과
+    답변 생성 시작. 화면(modules/chat.py)과 부하 테스트가 같은 흐름을 사용합니다.
+    """
+    timings = {}
+    started = time.perf_counter()
+    chat_history.append(save_message(user_id, chat_id, "user", prompt))
+    timings["save_user"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    turn_history = build_turn_messages(user_id, chat_id, chat_history, prompt, model)
+    timings["context"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    turn = start_turn(turn_history, prompt, model)
+    timings["intent"] = time.perf_counter() - started
+    turn.timings.update(timings)
+    return turn
+
+
+def finish_turn(user_id, chat_id, chat_history, model):
+    """턴이 끝난 뒤 채팅 요약(처음 한 번)과 대화 기억 압축을 백그라운드로 시작"""
+    if not chat_history.summary_created:
+        summarize_in_background(user_id, chat_id, to_messages(chat_history))
+        chat_history.summary_created = True
+
+    # 대화가 길어지면 오래된 부분을 백그라운드에서 대화 기억에 합침
+    compact_in_background(user_id, chat_id, chat_history, model)
@@ -0,0 +1,368 @@
+import atexit
+import logging
+import random
+import threading
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# Firestore 배치 하나에 담을 수 있는 최대 쓰기 수
+FIRESTORE_BATCH_LIMIT = 500
+# 다시 시도해도 성공할 수 없는 오류 (google.api_core.exceptions의 클래스 이름)
+PERMANENT_ERRORS = {
+    "InvalidArgument",
+    "PermissionDenied",
+    "Unauthenticated",
+    "NotFound",
+    "AlreadyExists",
+    "FailedPrecondition",
+    "OutOfRange",
+    "Unimplemented",
+    "ValueError",
+    "TypeError",
+}
+# 일시적인 오류라도 이 횟수만큼 실패하면 포기 (뒤따르는 같은 key의 쓰기가 계속 막히지 않도록)
+MAX_ATTEMPTS = 10
+
+
+def _is_permanent(error):
+    return type(error).__name__ in PERMANENT_ERRORS
+
+
+class _Entry:
+    """submit() 한 번으로 들어온, 함께 커밋될 쓰기 묶음"""
+
+    __slots__ = ("key", "operations", "attempts", "retry_at", "error")
+
+    def __init__(self, key, operations):
+        self.key = key
+        self.operations = operations
+        self.attempts = 0
+        self.retry_at = None
+        self.error = None
+
+
+class WriteBehindQueue:
+    """
+    Firestore 쓰기를 모아 배치로 커밋하는 write-behind 큐.
+
+    쓰기는 호출 즉시 반환되고, 백그라운드 스레드가 max_batch_size개가 모이거나
+    flush_interval초가 지나면 하나의 배치로 커밋합니다.
+
+    같은 key(예: 채팅)의 쓰기는 들어온 순서대로, 배치마다 하나씩만 커밋합니다. 그래서
+    SERVER_TIMESTAMP로 기록한 시각(커밋 시각)이 key 안에서 서로 다르고 순서도 유지됩니다.
+    커밋에 실패한 묶음은 버리지 않고 백오프 후 다시 시도하며, 그동안 같은 key의 뒤따르는
+    쓰기만 기다리고 다른 key의 쓰기는 계속 커밋됩니다. 다시 시도해도 소용없는 오류이거나
+    MAX_ATTEMPTS번 실패하면 오류를 기록하고 버립니다 (lost_writes).
+
+    client는 batch()를 제공하는 Firestore 클라이언트(에뮬레이터 포함) 또는 같은
+    인터페이스의 인메모리 대체 객체면 됩니다.
+    """
+
+    def __init__(
+        self,
+        client,
+        max_batch_size=50,
+        flush_interval=0.5,
+        retry_backoff=0.5,
+        max_retry_delay=30.0,
+    ):
+        self.client = client
+        self.max_batch_size = min(max_batch_size, FIRESTORE_BATCH_LIMIT)
+        self.flush_interval = flush_interval
+        self.retry_backoff = retry_backoff
+        self.max_retry_delay = max_retry_delay
+
+        self._pending = deque()
+        self._pending_ops = 0
+        # 재시도를 기다리는 묶음 (key → _Entry). 이 key의 다른 쓰기는 그동안 보류
+        self._failed = {}
+        # key별로 아직 커밋되지 않은 묶음 수 (대기 + 커밋 중 + 재시도 대기)
+        self._outstanding = Counter()
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = Counter()
+        # key별로 버린 묶음 수 (flush가 그동안 버려진 쓰기가 있었는지 알 수 있도록)
+        self._lost = Counter()
+
+        self._thread = threading.Thread(
+            target=self._run, name="firestore-write-behind", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, *operations, key=None):
+        """
+        원자적으로 함께 커밋될 쓰기들을 큐에 추가합니다.
+
+        Parameters:
+        - operations: ("set" | "merge" | "update" | "delete", document_ref, data) 튜플들.
+          "merge"는 set(..., merge=True)로, 문서가 없어도 실패하지 않습니다.
+        - key: 순서를 지키고 flush(key)로 기다릴 단위 (없으면 첫 문서 경로)
+        """
+        if len(operations) > FIRESTORE_BATCH_LIMIT:
+            raise ValueError("Too many operations for a single Firestore batch.")
+        if key is None:
+            key = operations[0][1].path
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write-behind queue is closed.")
+            self._pending.append(_Entry(key, operations))
+            self._pending_ops += len(operations)
+            self._outstanding[key] += 1
+            # 쉬고 있던 스레드가 flush_interval 타이머를 시작하도록 항상 깨움
+            self._cond.notify_all()
+
+    def discard(self, predicate):
+        """아직 커밋되지 않은 쓰기(재시도 대기 포함) 중 predicate(document_ref)가 참인 것을 버림"""
+        with self._cond:
+            kept = deque()
+            for entry in self._pending:
+                if self._filter(entry, predicate):
+                    kept.append(entry)
+            self._pending = kept
+            self._pending_ops = sum(len(entry.operations) for entry in kept)
+            for key, entry in list(self._failed.items()):
+                if not self._filter(entry, predicate):
+                    del self._failed[key]
+            self._cond.notify_all()
+
+    def _filter(self, entry, predicate):
+        # 남는 쓰기가 없으면 False를 반환하고 key의 미완료 수를 줄임
+        entry.operations = tuple(op for op in entry.operations if not predicate(op[1]))
+        if entry.operations:
+            return True
+        self._release(entry.key)
+        return False
+
+    def _release(self, key):
+        self._outstanding[key] -= 1
+        if self._outstanding[key] <= 0:
+            del self._outstanding[key]
+
+    def flush(self, timeout=None, key=None):
+        """
+        대기 중인 쓰기(key를 주면 그 key의 쓰기만)가 커밋될 때까지 기다립니다.
+
+        재시도를 기다리는 쓰기는 바로 다시 시도하고, 그 시도마저 실패하면 기다리지 않고
+        반환합니다 (실패한 쓰기는 큐에 남아 백오프하며 계속 재시도됨).
+
+        Returns:
+        - bool: 모두 커밋되었으면 True, 실패했거나 버려졌거나 시간이 초과되면 False.
+        """
+
+        def keys():
+            if key is None:
+                return list(self._outstanding)
+            return [key] if key in self._outstanding else []
+
+        def settled(k):
+            # 이번 flush에서 다시 시도한 뒤에도 (또는 새로) 실패해 재시도를 기다리는 중
+            entry = self._failed.get(k)
+            if entry is None:
+                return False
+            target = retried.get(k)
+            return target is None or target[0] is not entry or entry.attempts >= target[1]
+
+        with self._cond:
+            if not keys():
+                return True
+            lost = self._lost_count(key)
+            now = time.monotonic()
+            retried = {}
+            for k, entry in self._failed.items():
+                if key is None or k == key:
+                    entry.retry_at = now
+                    retried[k] = (entry, entry.attempts + 1)
+            self._flush_requested = True
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: all(settled(k) for k in keys()), timeout)
+            return not keys() and self._lost_count(key) == lost
+
+    def _lost_count(self, key):
+        return sum(self._lost.values()) if key is None else self._lost[key]
+
+    def failure(self, key):
+        """key의 쓰기가 재시도를 기다리고 있으면 마지막 오류, 아니면 None"""
+        with self._cond:
+            entry = self._failed.get(key)
+            return entry.error if entry is not None else None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "retrying": len(self._failed),
+                "commits": self._stats["commits"],
+                "committed_writes": self._stats["committed_writes"],
+                "commit_failures": self._stats["commit_failures"],
+                "lost_writes": self._stats["lost_writes"],
+            }
+
+    def close(self, timeout=30):
+        """새 쓰기를 막고 남은 쓰기를 모두 커밋 (프로세스 종료 시 자동 호출)"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _next_retry_at(self):
+        return min((entry.retry_at for entry in self._failed.values()), default=None)
+
+    def _take_batch(self, now):
+        """재시도할 때가 된 묶음과, 보류되지 않은 key의 묶음을 key마다 하나씩 꺼냄"""
+        batch = []
+        batch_ops = 0
+        keys = set()
+        for key, entry in list(self._failed.items()):
+            if (self._closed or entry.retry_at <= now) and (
+                not batch or batch_ops + len(entry.operations) <= FIRESTORE_BATCH_LIMIT
+            ):
+                del self._failed[key]
+                batch.append(entry)
+                batch_ops += len(entry.operations)
+                keys.add(key)
+
+        kept = deque()
+        while self._pending:
+            entry = self._pending.popleft()
+            if (
+                entry.key in keys
+                or entry.key in self._failed
+                or (batch and batch_ops + len(entry.operations) > FIRESTORE_BATCH_LIMIT)
+            ):
+                kept.append(entry)
+                continue
+            batch.append(entry)
+            batch_ops += len(entry.operations)
+            keys.add(entry.key)
+            self._pending_ops -= len(entry.operations)
+        self._pending = kept
+        return batch
+
+    def _next_batch(self):
+        with self._cond:
+            deadline = None
+            while True:
+                now = time.monotonic()
+                retry_at = self._next_retry_at()
+                # 재시도 대기 중인 key의 쓰기만 남았으면 다음 재시도 시각까지 기다림
+                ready = any(entry.key not in self._failed for entry in self._pending)
+                if not ready and (retry_at is None or (retry_at > now and not self._closed)):
+                    if self._closed and not self._pending and not self._failed:
+                        return None
+                    self._flush_requested = False
+                    deadline = None
+                    self._cond.wait(None if retry_at is None else retry_at - now)
+                    continue
+
+                if deadline is None:
+                    deadline = now + self.flush_interval
+                if (
+                    self._closed
+                    or self._flush_requested
+                    or self._pending_ops >= self.max_batch_size
+                    or now >= deadline
+                    or (retry_at is not None and retry_at <= now)
+                ):
+                    break
+                self._cond.wait(deadline - now)
+
+            batch = self._take_batch(now)
+            # key마다 하나씩만 꺼내 남은 쓰기는 기다리지 않고 바로 다음 배치로 커밋
+            self._flush_requested = any(
+                entry.key not in self._failed for entry in self._pending
+            )
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch:
+                self._commit(batch)
+
+    def _commit_batch(self, operations):
+        batch = self.client.batch()
+        for op, ref, data in operations:
+            if op == "delete":
+                batch.delete(ref)
+            elif op == "merge":
+                batch.set(ref, data, merge=True)
+            else:
+                getattr(batch, op)(ref, data)
+        batch.commit()
+
+    def _commit(self, entries):
+        try:
+            self._commit_batch([op for entry in entries for op in entry.operations])
+        except Exception as e:
+            if len(entries) == 1:
+                self._retry_later(entries, e)
+                return
+            with self._cond:
+                self._stats["commit_failures"] += 1
+            # 실패한 묶음 때문에 다른 key의 쓰기까지 기다리지 않도록 묶음별로 다시 커밋
+            for entry in entries:
+                self._commit([entry])
+            return
+
+        with self._cond:
+            self._stats["commits"] += 1
+            self._stats["committed_writes"] += sum(len(entry.operations) for entry in entries)
+            for entry in entries:
+                self._release(entry.key)
+            self._cond.notify_all()
+
+    def _drop(self, entries, error, reason):
+        # self._cond를 잡은 상태에서 호출
+        count = sum(len(entry.operations) for entry in entries)
+        self._stats["lost_writes"] += count
+        logger.error("Dropping %d Firestore writes (%s): %r", count, reason, error)
+        for entry in entries:
+            self._lost[entry.key] += 1
+            self._release(entry.key)
+
+    def _retry_later(self, entries, error):
+        with self._cond:
+            self._stats["commit_failures"] += 1
+            if _is_permanent(error):
+                self._drop(entries, error, "not retryable")
+                entries = []
+            else:
+                for entry in entries:
+                    entry.attempts += 1
+                given_up = [entry for entry in entries if entry.attempts >= MAX_ATTEMPTS]
+                if given_up:
+                    self._drop(given_up, error, f"failed {MAX_ATTEMPTS} times")
+                entries = [entry for entry in entries if entry.attempts < MAX_ATTEMPTS]
+            if self._closed:
+                # 종료 중에는 더 기다릴 수 없으므로 한 번 더 실패하면 포기
+                lost = [entry for entry in entries if entry.attempts > 1]
+                if lost:
+                    self._drop(lost, error, "shutting down")
+                entries = [entry for entry in entries if entry.attempts <= 1]
+            if entries:
+                logger.warning(
+                    "Firestore batch commit failed (%d writes), will retry: %r",
+                    sum(len(entry.operations) for entry in entries),
+                    error,
+                )
+            now = time.monotonic()
+            for entry in entries:
+                entry.error = error
+                # 지터를 섞은 지수 백오프 (스레드는 그동안 다른 key의 쓰기를 커밋)
+                entry.retry_at = now + min(
+                    self.max_retry_delay,
+                    self.retry_backoff
+                    * (2 ** (entry.attempts - 1))
+                    * random.uniform(0.5, 1.5),
+                )
+                self._failed[entry.key] = entry
+            self._cond.notify_all()